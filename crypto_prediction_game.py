@@ -3,6 +3,29 @@
 
 from genlayer import *
 import json
+import time
+
+# Price consensus: validators accept the leader's price if it is within
+# this many basis points of their own (plus 1 cent for rounding)
+PRICE_TOLERANCE_BPS = {"BTC": 50, "ETH": 50, "SOL": 100, "DOGE": 200, "ADA": 200}
+DEFAULT_PRICE_TOLERANCE_BPS = 100
+
+# LLM price extraction only sees the fragment around the price, capped at
+# PROMPT_PAYLOAD_MAX_TOKENS (~4 characters per token)
+PROMPT_PAYLOAD_MAX_TOKENS = 64
+PROMPT_PAYLOAD_LEAD_CHARS = 32
+
+# Counters kept by the price instrumentation (see get_price_metrics)
+PRICE_METRIC_NAMES = [
+    "render_calls", "render_ms", "render_bytes", "render_failures", "retries",
+    "prompt_calls", "prompt_ms", "prompt_chars",
+    "consensus_rounds", "consensus_failures", "mock_fallbacks",
+]
+
+# Per-call traces for local runs (module state is not kept between
+# transactions on chain, and node-local timings never reach storage)
+PRICE_TRACE = []
+PRICE_TRACE_LIMIT = 500
 
 class CryptoPredictionGame(gl.Contract):
     """
@@ -27,12 +50,149 @@ class CryptoPredictionGame(gl.Contract):
     
     next_prediction_id: u256
     
+    # Price instrumentation counters (PRICE_METRIC_NAMES -> total)
+    price_metrics: TreeMap[str, u256]
+    
     def __init__(self):
         """Initialize the game contract"""
         # TreeMaps are automatically initialized by GenLayer
         # Only initialize simple types
         self.next_prediction_id = 0
     
+    def parse_price_cents(self, web_data: str) -> int:
+        """
+        Read integer cents straight from a known price API response
+        Handles CryptoCompare {"USD": 95642.5} and CoinGecko {"bitcoin": {"usd": 95642.5}}
+        Returns -1 for any other shape so the caller can fall back to the LLM
+        """
+        try:
+            data = json.loads(web_data.strip(), parse_float=str, parse_int=str)
+        except ValueError:
+            return -1
+        if not isinstance(data, dict):
+            return -1
+        
+        if "USD" in data:
+            return self.decimal_to_cents(data["USD"])
+        if len(data) == 1:
+            inner = next(iter(data.values()))
+            if isinstance(inner, dict) and "usd" in inner:
+                return self.decimal_to_cents(inner["usd"])
+        return -1
+    
+    def decimal_to_cents(self, value) -> int:
+        """Convert a JSON decimal literal (kept as a string) to integer cents, truncating"""
+        if not isinstance(value, str):
+            return -1
+        whole, _, fraction = value.partition(".")
+        if not whole.isdigit() or (fraction and not fraction.isdigit()):
+            return -1
+        return int(whole) * 100 + int((fraction + "00")[:2])
+    
+    def trim_price_payload(self, web_data: str, keys: list, max_tokens: int = PROMPT_PAYLOAD_MAX_TOKENS) -> str:
+        """
+        Cut a rendered response down to the part around the price before prompting
+        Starts just before the first key found (else at the beginning) and
+        keeps at most max_tokens worth of text, with whitespace collapsed.
+        """
+        text = " ".join(web_data.split())
+        budget = max_tokens * 4
+        for key in keys:
+            i = text.find(key)
+            if i >= 0:
+                start = max(0, i - PROMPT_PAYLOAD_LEAD_CHARS)
+                return text[start:start + budget]
+        return text[:budget]
+    
+    def prices_agree(self, symbol: str, a: int, b: int) -> bool:
+        """Whether two cent prices are within the symbol's tolerance (integer math)"""
+        if a <= 0 or b <= 0:
+            return False
+        bps = PRICE_TOLERANCE_BPS.get(symbol, DEFAULT_PRICE_TOLERANCE_BPS)
+        diff = abs(a - b)
+        return diff <= 1 or diff * 10000 <= bps * max(a, b)
+    
+    def run_price_consensus(self, symbol: str, fetch, key: str = "price_usd_cents") -> dict:
+        """
+        Run fetch() with a numeric equivalence check instead of an LLM comparison
+        Each validator fetches its own price and accepts the leader's result
+        if both succeeded with prices within tolerance (or both failed).
+        """
+        def validator_fn(leaders_res) -> bool:
+            if not isinstance(leaders_res, gl.vm.Return):
+                return False
+            leader = leaders_res.calldata
+            mine = fetch()
+            if not leader.get("success", False) or not mine.get("success", False):
+                return leader.get("success", False) == mine.get("success", False)
+            return self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0)))
+        
+        return self.timed_consensus(lambda: gl.vm.run_nondet(fetch, validator_fn))
+    
+    def timed_render(self, url: str, metrics: dict) -> str:
+        """gl.nondet.web.render, counting calls, time, bytes and failures into metrics"""
+        started = time.monotonic()
+        try:
+            response = gl.nondet.web.render(url, mode="text")
+        except Exception as e:
+            self.count_price_call(metrics, "render", started, 0, True)
+            raise
+        self.count_price_call(metrics, "render", started, len(response), False)
+        return response
+    
+    def timed_prompt(self, task: str, metrics: dict) -> str:
+        """gl.nondet.exec_prompt, counting calls, time and prompt size into metrics"""
+        started = time.monotonic()
+        result = gl.nondet.exec_prompt(task)
+        self.count_price_call(metrics, "prompt", started, len(task), False)
+        return result
+    
+    def timed_consensus(self, run) -> dict:
+        """
+        Run one consensus call, tracing its duration locally only
+        (each node measures a different time, so it cannot be stored)
+        """
+        started = time.monotonic()
+        failed = True
+        try:
+            result = run()
+            failed = False
+            return result
+        finally:
+            self.trace_price_call("consensus", int((time.monotonic() - started) * 1000), 0, failed)
+    
+    def count_price_call(self, metrics: dict, kind: str, started: float, size: int, failed: bool):
+        """Add one render/prompt call to a nondet metrics dict and to the local trace"""
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        size_key = "render_bytes" if kind == "render" else "prompt_chars"
+        metrics[f"{kind}_calls"] = metrics.get(f"{kind}_calls", 0) + 1
+        metrics[f"{kind}_ms"] = metrics.get(f"{kind}_ms", 0) + elapsed_ms
+        metrics[size_key] = metrics.get(size_key, 0) + size
+        if failed:
+            metrics[f"{kind}_failures"] = metrics.get(f"{kind}_failures", 0) + 1
+        self.trace_price_call(kind, elapsed_ms, size, failed)
+    
+    def trace_price_call(self, kind: str, elapsed_ms: int, size: int, failed: bool):
+        """Append to PRICE_TRACE, dropping the oldest entry once full"""
+        if len(PRICE_TRACE) >= PRICE_TRACE_LIMIT:
+            del PRICE_TRACE[0]
+        PRICE_TRACE.append({"kind": kind, "ms": elapsed_ms, "size": size, "failed": failed})
+    
+    def record_price_metrics(self, metrics: dict):
+        """Add the leader's agreed metrics to the stored counters (write paths only)"""
+        for name, value in metrics.items():
+            if name in PRICE_METRIC_NAMES:
+                self.price_metrics[name] = self.price_metrics.get(name, 0) + int(value)
+    
+    @gl.public.view
+    def get_price_metrics(self) -> dict:
+        """Aggregated price-path counters, with average render/prompt latency"""
+        result = {name: self.price_metrics.get(name, 0) for name in PRICE_METRIC_NAMES}
+        for kind in ["render", "prompt"]:
+            calls = result[f"{kind}_calls"]
+            result[f"{kind}_avg_ms"] = result[f"{kind}_ms"] // calls if calls > 0 else 0
+        return result
+    
     @gl.public.view
     def get_current_price(self, crypto_symbol: str) -> dict:
         """
@@ -40,24 +200,31 @@ class CryptoPredictionGame(gl.Contract):
         Returns: {"symbol": "BTC", "price_usd_cents": 4500000, "timestamp": 1234567890}
         Note: price_usd_cents is in cents (multiply by 100) to avoid float encoding issues
         Uses AI consensus for reliable price extraction
+        Also returns the call's "metrics" for write paths to record
         """
         crypto_symbol_upper = crypto_symbol.upper()
         
         def fetch_and_extract_price():
             """Non-deterministic function to fetch and extract price"""
+            metrics = {}
             # CryptoCompare API - more generous rate limits than CoinGecko
             url = f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol_upper}&tsyms=USD"
             
             # Use GenLayer's non-deterministic web rendering
-            web_data = gl.nondet.web.render(url, mode="text")
+            web_data = self.timed_render(url, metrics)
             print(f"Fetched data for {crypto_symbol_upper}: {web_data}")
+            # Known JSON shape: parse directly and skip the LLM call
+            cents = self.parse_price_cents(web_data)
+            if cents > 0:
+                return {"price_usd_cents": cents, "success": True, "metrics": metrics}
             
             # Use AI to extract the price reliably
+            payload = self.trim_price_payload(web_data, ['"USD"', '"usd"'])
             task = f"""
 From the following API response, extract the USD price for {crypto_symbol_upper}.
 
 API Response:
-{web_data}
+{payload}
 
 Respond with ONLY a JSON object in this exact format:
 {{
@@ -73,7 +240,7 @@ Extract the numeric price value. If the data is not available or invalid, set su
 Your response must be valid JSON only, no other text.
 """
             
-            result = gl.nondet.exec_prompt(task).replace("```json", "").replace("```", "").strip()
+            result = self.timed_prompt(task, metrics).replace("```json", "").replace("```", "").strip()
             print(f"AI extracted: {result}")
             
             parsed = json.loads(result)
@@ -87,19 +254,14 @@ Your response must be valid JSON only, no other text.
                 # Ensure it's an integer
                 parsed["price_usd_cents"] = int(parsed["price_usd_cents"])
             
+            parsed["metrics"] = metrics
             return parsed
         
+        metrics = {"consensus_rounds": 1}
         try:
-            # Use prompt_comparative for semantic comparison (more flexible for prices)
-            def get_price_json():
-                data = fetch_and_extract_price()
-                return json.dumps(data)
-            
-            price_json = gl.eq_principle.prompt_comparative(
-                get_price_json,
-                "The price_usd_cents values should be within 1% of each other"
-            )
-            price_data = json.loads(price_json)
+            # Numeric consensus: validators accept prices within tolerance
+            price_data = self.run_price_consensus(crypto_symbol_upper, fetch_and_extract_price)
+            metrics.update(price_data.get("metrics", {}))
             
             if price_data.get("success", False):
                 # Handle both field names and convert to integer
@@ -113,20 +275,24 @@ Your response must be valid JSON only, no other text.
                 
                 return {
                     "symbol": crypto_symbol_upper,
-                    "price_usd_cents": price_cents
+                    "price_usd_cents": price_cents,
+                    "metrics": metrics
                 }
             else:
                 return {
                     "symbol": crypto_symbol_upper,
                     "price_usd_cents": 0,
-                    "error": price_data.get("error", "Failed to extract price")
+                    "error": price_data.get("error", "Failed to extract price"),
+                    "metrics": metrics
                 }
         except Exception as e:
             print(f"Error in consensus price fetching: {e}")
+            metrics["consensus_failures"] = 1
             return {
                 "symbol": crypto_symbol_upper,
                 "price_usd_cents": 0,
-                "error": str(e)
+                "error": str(e),
+                "metrics": metrics
             }
     
     @gl.public.write
@@ -174,6 +340,7 @@ Your response must be valid JSON only, no other text.
         
         # Get current price
         price_data = self.get_current_price(crypto_symbol)
+        self.record_price_metrics(price_data.pop("metrics", {}))
         if "error" in price_data:
             return "ERROR: Failed to fetch current price"
         
@@ -227,6 +394,7 @@ Your response must be valid JSON only, no other text.
         # Get current price
         symbol = self.prediction_symbols[prediction_id]
         price_data = self.get_current_price(symbol)
+        self.record_price_metrics(price_data.pop("metrics", {}))
         if "error" in price_data:
             return "ERROR: Failed to fetch exit price"
         
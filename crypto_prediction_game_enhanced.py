@@ -1,8 +1,127 @@
-# v1.0.0 - Enhanced Multi-User Crypto Prediction Game
+# v1.1.0 - Enhanced Multi-User Crypto Prediction Game
 # { "Depends": "py-genlayer:latest" }
 
 from genlayer import *
+from dataclasses import dataclass
+from datetime import datetime
 import json
+import struct
+import time
+
+
+# Compact codes stored in Prediction records (decoded only in views)
+STATUS_ACTIVE = 0
+STATUS_WON = 1
+STATUS_LOST = 2
+STATUS_EXPIRED = 3
+STATUS_NAMES = ["ACTIVE", "WON", "LOST", "EXPIRED"]
+
+DIRECTION_UP = 0
+DIRECTION_DOWN = 1
+DIRECTION_NAMES = ["UP", "DOWN"]
+
+# Leaderboards show LEADERBOARD_SIZE rows. Wins only grow, so a bounded
+# list is exact; profit can drop, so its board is read from the rank
+# buckets below (each bucket also lists its members).
+LEADERBOARD_SIZE = 10
+
+# Rank lookups use a Fenwick tree over score buckets. Wins map 1:1 to
+# buckets (exact below RANK_BUCKETS); profit is bucketed around zero.
+RANK_BUCKETS = 1024
+PROFIT_BUCKET_WIDTH = 100
+
+# Archived (settled) predictions, one fixed-width entry per prediction:
+# id, symbol_id, direction, status, amount, entry_price, creation_tx, duration_tx
+HISTORY_RECORD_FORMAT = ">QBBBQQQQ"
+HISTORY_RECORD_SIZE = struct.calcsize(HISTORY_RECORD_FORMAT)  # 43 bytes
+
+# Upper bound on entries examined by one paginated view call
+MAX_PAGE_SIZE = 100
+
+# Upper bound on legs in one place_predictions_batch call
+MAX_BATCH_ORDERS = 20
+
+# Upper bound on the expiry grid, so snapping can only stretch a bet by
+# less than this many transactions (30 tx ~ 5 minutes)
+MAX_EXPIRY_GRID_TX = 30
+
+# Assets refreshed by get_prices() when no symbols are given
+SUPPORTED_SYMBOLS = ["BTC", "ETH", "SOL", "DOGE", "ADA"]
+
+# Price consensus: validators accept the leader's price if it is within
+# this many basis points of their own (plus 1 cent for rounding)
+PRICE_TOLERANCE_BPS = {"BTC": 50, "ETH": 50, "SOL": 100, "DOGE": 200, "ADA": 200}
+DEFAULT_PRICE_TOLERANCE_BPS = 100
+
+# LLM price extraction only sees the fragment around the price, capped at
+# PROMPT_PAYLOAD_MAX_TOKENS (~4 characters per token)
+PROMPT_PAYLOAD_MAX_TOKENS = 64
+PROMPT_PAYLOAD_LEAD_CHARS = 32
+
+# Counters kept by the price instrumentation (see get_price_metrics)
+PRICE_METRIC_NAMES = [
+    "render_calls", "render_ms", "render_bytes", "render_failures", "retries",
+    "prompt_calls", "prompt_ms", "prompt_chars",
+    "consensus_rounds", "consensus_failures", "mock_fallbacks", "breaker_skips",
+]
+
+# Per-call traces for local runs (module state is not kept between
+# transactions on chain, and node-local timings never reach storage)
+PRICE_TRACE = []
+PRICE_TRACE_LIMIT = 500
+
+# Live prices come from the first built-in source that answers (CryptoCompare,
+# then CoinGecko for COINGECKO_IDS), so a fetch costs one render. A validator
+# that disagrees takes the median of all built-in sources instead; the
+# configurable extra source only breaks a tie when those two disagree, so the
+# median of three stays between them.
+COINGECKO_IDS = {"BTC": "bitcoin", "ETH": "ethereum", "SOL": "solana", "DOGE": "dogecoin", "ADA": "cardano"}
+
+# Entry prices need an oracle round published at most ORACLE_MAX_AGE_SECONDS
+# ago (wall clock, so quiet periods don't stretch it). Expiry is counted in tx,
+# so exit prices need a round at most ORACLE_MAX_EXIT_LAG_TX after expiry.
+ORACLE_MAX_AGE_SECONDS = 60
+ORACLE_MAX_EXIT_LAG_TX = 30
+
+# Circuit breaker for the live price source. After BREAKER_FAILURE_THRESHOLD
+# consecutive failures it opens and prices come from the mock generator
+# without trying the API. After BREAKER_COOLDOWN_TX one probe is let through.
+BREAKER_CLOSED = 0
+BREAKER_OPEN = 1
+BREAKER_HALF_OPEN = 2
+BREAKER_STATE_NAMES = ["CLOSED", "OPEN", "HALF_OPEN"]
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_TX = 20
+
+
+@allow_storage
+@dataclass
+class Prediction:
+    """All fields of one prediction, stored as a single record"""
+    owner: str
+    symbol_id: u8   # Index into symbol_names
+    direction: u8   # DIRECTION_*
+    status: u8      # STATUS_*
+    amount: u256
+    entry_price: u256
+    creation_tx: u256
+    duration_tx: u256
+
+
+@allow_storage
+@dataclass
+class UserStats:
+    """Per-user aggregates, updated at placement and settlement"""
+    total: u256
+    active: u256
+    won: u256
+    lost: u256
+    expired: u256
+    total_wagered: u256
+    total_paid_out: u256
+    current_streak: u256  # Consecutive wins, reset by a loss
+    best_streak: u256
+
 
 class CryptoPredictionGame(gl.Contract):
     """
@@ -23,8 +142,17 @@ class CryptoPredictionGame(gl.Contract):
     # Leaderboard tracking
     leaderboard_wins: TreeMap[str, u256]
     leaderboard_profit: TreeMap[str, u256]
+    top_wins: DynArray[str]    # Bounded, sorted by wins (desc)
+    rank_tree_wins: DynArray[u256]    # Fenwick tree: players per wins bucket
+    rank_tree_profit: DynArray[u256]  # Fenwick tree: players per profit bucket
+    profit_bucket_members: TreeMap[u256, DynArray[str]]  # Profit bucket -> players in it
+    profit_bucket_pos: TreeMap[str, u256]  # Player -> index in their bucket's list
+    
+    # Prediction storage - one packed record per prediction_id
+    predictions: TreeMap[u256, Prediction]
     
-    # Prediction storage - using prediction_id as key
+    # Legacy per-field storage (pre-v1.1 deployments)
+    # Drained into `predictions` by migrate_legacy_predictions()
     prediction_symbols: TreeMap[u256, str]
     prediction_directions: TreeMap[u256, str]
     prediction_amounts: TreeMap[u256, u256]
@@ -34,10 +162,60 @@ class CryptoPredictionGame(gl.Contract):
     prediction_owners: TreeMap[u256, str]
     prediction_statuses: TreeMap[u256, str]  # ACTIVE, WON, LOST, EXPIRED
     
+    # Expiry queue: min-heap of (expiry_tx << 64) | prediction_id
+    expiry_heap: DynArray[u256]
+    
+    # Settlement cohorts: (expiry_tx << 8) | symbol_id -> prediction IDs
+    cohorts: TreeMap[u256, DynArray[u256]]
+    cohort_pos: TreeMap[u256, u256]  # prediction_id -> index in its cohort's list
+    expiry_grid_tx: u256  # Snap expiries up to multiples of this (0/1 = off, at most MAX_EXPIRY_GRID_TX)
+    
+    # Oracle rounds: one published price snapshot per round_id (= index)
+    round_tx: DynArray[u256]  # Publish tx per round, increasing
+    round_time: DynArray[u256]  # Publish time per round, Unix seconds (absent for pre-upgrade rounds)
+    round_prices: TreeMap[u256, TreeMap[u8, u256]]  # round_id -> symbol_id -> cents
+    
+    # Symbol interning table ("BTC" <-> u8 id)
+    symbol_ids: TreeMap[str, u8]
+    symbol_names: DynArray[str]
+    
+    # Per-user indexes so user views don't scan every prediction
+    user_prediction_ids: TreeMap[str, DynArray[u256]]  # All IDs, in placement order
+    user_active_ids: TreeMap[str, TreeMap[u256, bool]]  # Set of ACTIVE IDs
+    user_stats: TreeMap[str, UserStats]
+    
+    # Cold storage for settled predictions (append-only, per user)
+    user_history: TreeMap[str, DynArray[bytes]]
+    user_archive_pos: TreeMap[str, TreeMap[u256, u256]]  # prediction_id -> index in user_history
+    archive_queue: TreeMap[u256, u256]  # Settled IDs waiting for compact()
+    archive_queue_head: u256
+    archive_queue_tail: u256
+    
+    # Optional third price source, URL with a {symbol} placeholder ("" = none)
+    extra_price_source: str
+    
+    # Price instrumentation counters (PRICE_METRIC_NAMES -> total)
+    price_metrics: TreeMap[str, u256]
+    
+    # Live price circuit breaker (BREAKER_*)
+    breaker_state: u8
+    breaker_failures: u256  # Consecutive failures
+    breaker_total_failures: u256
+    breaker_trips: u256  # Times the breaker opened
+    breaker_opened_tx: u256
+    
     # Global counters
     next_prediction_id: u256
     transaction_counter: u256
     price_counter: u256  # For mock prices when API fails
+    legacy_migration_cursor: u256  # Next legacy prediction_id to migrate
+    
+    # Running totals so get_game_stats never scans storage
+    status_counts: TreeMap[u8, u256]  # STATUS_* -> number of predictions
+    unique_player_count: u256
+    total_pool: u256    # Sum of the balances of pool_members
+    pool_members: TreeMap[str, bool]  # Users whose balance total_pool includes
+    total_volume: u256  # Sum of all bets ever placed
     
     # Constants
     PAYOUT_MULTIPLIER: u256 = 18  # 1.8x (stored as 18 to multiply by 10)
@@ -49,6 +227,19 @@ class CryptoPredictionGame(gl.Contract):
         self.next_prediction_id = 0
         self.transaction_counter = 0
         self.price_counter = 0
+        self.legacy_migration_cursor = 0
+        self.unique_player_count = 0
+        self.total_pool = 0
+        self.total_volume = 0
+        self.archive_queue_head = 0
+        self.archive_queue_tail = 0
+        self.expiry_grid_tx = 0
+        self.extra_price_source = ""
+        self.breaker_state = BREAKER_CLOSED
+        self.breaker_failures = 0
+        self.breaker_total_failures = 0
+        self.breaker_trips = 0
+        self.breaker_opened_tx = 0
         # Note: TreeMaps are not initialized - they're auto-initialized by GenLayer
     
     # ============================================================
@@ -59,25 +250,93 @@ class CryptoPredictionGame(gl.Contract):
     def get_current_price(self, crypto_symbol: str) -> dict:
         """
         Fetch real crypto price from CryptoCompare API
-        Falls back to mock prices if API fails
+        Falls back to mock prices if API fails or the circuit breaker is open
         """
-        crypto_symbol_upper = crypto_symbol.upper()
+        return self.fetch_price(crypto_symbol.upper(), False)
+    
+    def fetch_price(self, crypto_symbol: str, track: bool) -> dict:
+        """
+        Live price with mock fallback, guarded by the circuit breaker
+        Write paths pass track=True so the outcome moves the breaker and
+        the price metrics; views only read them.
+        """
+        if not self.breaker_allows_live(track):
+            if track:
+                self.record_price_metrics({"breaker_skips": 1, "mock_fallbacks": 1})
+            return self.get_mock_price(crypto_symbol)
         
         # Try real API first
         try:
-            return self.fetch_real_price(crypto_symbol_upper)
+            price_data = self.fetch_real_price(crypto_symbol)
         except Exception as e:
             # Fallback to mock prices
-            return self.get_mock_price(crypto_symbol_upper)
+            if track:
+                self.record_breaker_result(False)
+                self.record_price_metrics({"consensus_rounds": 1, "consensus_failures": 1, "mock_fallbacks": 1})
+            return self.get_mock_price(crypto_symbol)
+        
+        metrics = price_data.pop("metrics", {})
+        if track:
+            self.record_breaker_result(True)
+            metrics["consensus_rounds"] = 1
+            self.record_price_metrics(metrics)
+        return price_data
     
     def fetch_real_price(self, crypto_symbol: str) -> dict:
-        """Fetch real price from CryptoCompare API"""
-        def fetch_and_extract_price():
-            url = f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol}&tsyms=USD"
-            web_data = gl.nondet.web.render(url, mode="text")
+        """
+        Fetch real price from several APIs (CryptoCompare, CoinGecko, extra source)
+        The price comes from the first built-in source that answers. With
+        all_sources (validators that disagree) it is the median of the
+        built-in sources, and the extra source is asked only when both
+        answered and disagree. The contributing sources are reported.
+        """
+        sources = self.price_sources(crypto_symbol)
+        extra_url = self.extra_price_source.replace("{symbol}", crypto_symbol)
+        
+        def fetch_and_extract_price(all_sources: bool = False):
+            metrics = {}
+            quotes = {}
+            web_data = ""
+            for name, url in sources:
+                if metrics.get("render_calls", 0) > len(quotes):
+                    metrics["retries"] = metrics.get("retries", 0) + 1
+                try:
+                    response = self.timed_render(url, metrics)
+                except Exception as e:
+                    continue  # Source down - try the next one
+                if web_data == "":
+                    web_data = response
+                
+                # Known JSON shape: parse directly and skip the LLM call
+                cents = self.parse_price_cents(response)
+                if cents > 0:
+                    quotes[name] = cents
+                    if not all_sources:
+                        break  # One quote is enough unless a validator disagrees
+            
+            # Tiebreak: never averaged with a single built-in quote
+            values = list(quotes.values())
+            if extra_url != "" and len(values) == 2 and not self.prices_agree(crypto_symbol, values[0], values[1]):
+                try:
+                    cents = self.parse_price_cents(self.timed_render(extra_url, metrics))
+                    if cents > 0:
+                        quotes["extra"] = cents
+                except Exception as e:
+                    pass  # No tiebreak - use the built-in pair
             
+            if len(quotes) > 0:
+                return {
+                    "price_usd_cents": self.median_cents(list(quotes.values())),
+                    "success": True,
+                    "sources": sorted(quotes),
+                    "metrics": metrics
+                }
+            if web_data == "":
+                return {"success": False, "metrics": metrics}
+            
+            payload = self.trim_price_payload(web_data, ['"USD"', '"usd"', '"amount"'])
             task = f"""
-Extract USD price from this API response: {web_data}
+Extract USD price from this API response: {payload}
 
 Return ONLY valid JSON in this exact format:
 {{"price_usd_cents": <integer>, "success": true}}
@@ -86,7 +345,7 @@ Convert the price to cents (multiply by 100 and make it an integer).
 Example: if USD is 95642.50, return 9564250
 """
             
-            result = gl.nondet.exec_prompt(task).replace("```json", "").replace("```", "").strip()
+            result = self.timed_prompt(task, metrics).replace("```json", "").replace("```", "").strip()
             parsed = json.loads(result)
             
             # Ensure integer cents
@@ -96,26 +355,265 @@ Example: if USD is 95642.50, return 9564250
             elif "price_usd_cents" in parsed:
                 parsed["price_usd_cents"] = int(parsed["price_usd_cents"])
             
+            parsed["metrics"] = metrics
             return parsed
         
-        def get_price_json():
-            return json.dumps(fetch_and_extract_price())
-        
-        price_json = gl.eq_principle.prompt_comparative(
-            get_price_json,
-            "Price values should be within 1% of each other"
-        )
-        price_data = json.loads(price_json)
+        # Numeric consensus: validators accept prices within tolerance
+        price_data = self.run_price_consensus(crypto_symbol, fetch_and_extract_price)
         
         if price_data.get("success", False):
             return {
                 "symbol": crypto_symbol,
                 "price_usd_cents": int(price_data["price_usd_cents"]),
-                "source": "api"
+                "source": "api",
+                "sources": price_data.get("sources", ["llm"]),
+                "metrics": price_data.get("metrics", {})
             }
         else:
             raise Exception("API returned failure")
     
+    def price_sources(self, crypto_symbol: str) -> list:
+        """Built-in (name, url) pairs queried by fetch_real_price, in order"""
+        sources = [("cryptocompare", f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol}&tsyms=USD")]
+        if crypto_symbol in COINGECKO_IDS:
+            sources.append(("coingecko", f"https://api.coingecko.com/api/v3/simple/price?ids={COINGECKO_IDS[crypto_symbol]}&vs_currencies=usd"))
+        return sources
+    
+    def median_cents(self, values: list) -> int:
+        """Median of integer prices (lower-biased mean of the middle two for even counts)"""
+        ordered = sorted(values)
+        mid = len(ordered) // 2
+        if len(ordered) % 2 == 1:
+            return ordered[mid]
+        return (ordered[mid - 1] + ordered[mid]) // 2
+    
+    @gl.public.write
+    def set_extra_price_source(self, url_template: str) -> str:
+        """
+        Add a tiebreaker price source, e.g.
+        "https://api.coinbase.com/v2/prices/{symbol}-USD/spot" ("" removes it)
+        The response must be one of the shapes parse_price_cents understands.
+        It is only consulted when the built-in sources disagree.
+        """
+        self.extra_price_source = url_template
+        if url_template == "":
+            return "Extra price source removed"
+        return f"Extra price source set: {url_template}"
+    
+    def parse_price_cents(self, web_data: str) -> int:
+        """
+        Read integer cents straight from a known price API response
+        Handles CryptoCompare {"USD": 95642.5}, CoinGecko {"bitcoin": {"usd": 95642.5}}
+        and Coinbase {"data": {"amount": "95642.5", ...}}
+        Returns -1 for any other shape so the caller can fall back to the LLM
+        """
+        try:
+            data = json.loads(web_data.strip(), parse_float=str, parse_int=str)
+        except ValueError:
+            return -1
+        if not isinstance(data, dict):
+            return -1
+        
+        if "USD" in data:
+            return self.decimal_to_cents(data["USD"])
+        if len(data) == 1:
+            inner = next(iter(data.values()))
+            if isinstance(inner, dict) and "usd" in inner:
+                return self.decimal_to_cents(inner["usd"])
+        if isinstance(data.get("data"), dict) and "amount" in data["data"]:
+            return self.decimal_to_cents(data["data"]["amount"])
+        return -1
+    
+    def decimal_to_cents(self, value) -> int:
+        """Convert a JSON decimal literal (kept as a string) to integer cents, truncating"""
+        if not isinstance(value, str):
+            return -1
+        whole, _, fraction = value.partition(".")
+        if not whole.isdigit() or (fraction and not fraction.isdigit()):
+            return -1
+        return int(whole) * 100 + int((fraction + "00")[:2])
+    
+    def trim_price_payload(self, web_data: str, keys: list, max_tokens: int = PROMPT_PAYLOAD_MAX_TOKENS) -> str:
+        """
+        Cut a rendered response down to the part around the price before prompting
+        Starts just before the first key found (else at the beginning) and
+        keeps at most max_tokens worth of text, with whitespace collapsed.
+        """
+        text = " ".join(web_data.split())
+        budget = max_tokens * 4
+        for key in keys:
+            i = text.find(key)
+            if i >= 0:
+                start = max(0, i - PROMPT_PAYLOAD_LEAD_CHARS)
+                return text[start:start + budget]
+        return text[:budget]
+    
+    def prices_agree(self, symbol: str, a: int, b: int) -> bool:
+        """Whether two cent prices are within the symbol's tolerance (integer math)"""
+        if a <= 0 or b <= 0:
+            return False
+        bps = PRICE_TOLERANCE_BPS.get(symbol, DEFAULT_PRICE_TOLERANCE_BPS)
+        diff = abs(a - b)
+        return diff <= 1 or diff * 10000 <= bps * max(a, b)
+    
+    def run_price_consensus(self, symbol: str, fetch, key: str = "price_usd_cents") -> dict:
+        """
+        Run fetch() with a numeric equivalence check instead of an LLM comparison
+        Each validator fetches its own price and accepts the leader's result
+        if both succeeded with prices within tolerance (or both failed).
+        fetch() stops at the first source that answers, so a fetch costs one
+        render; only a validator that disagrees asks every source, via
+        fetch(True), before rejecting.
+        """
+        def validator_fn(leaders_res) -> bool:
+            if not isinstance(leaders_res, gl.vm.Return):
+                return False
+            leader = leaders_res.calldata
+            mine = fetch()
+            if not leader.get("success", False) or not mine.get("success", False):
+                return leader.get("success", False) == mine.get("success", False)
+            if self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0))):
+                return True
+            mine = fetch(True)
+            return mine.get("success", False) and self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0)))
+        
+        return self.timed_consensus(lambda: gl.vm.run_nondet(fetch, validator_fn))
+    
+    def run_price_vector_consensus(self, fetch) -> dict:
+        """
+        run_price_consensus for {"prices": {symbol: cents}, ...} payloads:
+        same symbols, each within tolerance
+        """
+        def validator_fn(leaders_res) -> bool:
+            if not isinstance(leaders_res, gl.vm.Return):
+                return False
+            leader = leaders_res.calldata["prices"]
+            mine = fetch()["prices"]
+            if set(leader) != set(mine):
+                return False
+            return all(self.prices_agree(symbol, int(leader[symbol]), int(mine[symbol])) for symbol in mine)
+        
+        return self.timed_consensus(lambda: gl.vm.run_nondet(fetch, validator_fn))
+    
+    @gl.public.view
+    def get_prices(self, symbols: list = []) -> dict:
+        """
+        Fetch several prices with one web request and one consensus round
+        Defaults to SUPPORTED_SYMBOLS. Symbols missing from the response
+        (or all of them, if the API fails) fall back to mock prices.
+        """
+        return self.fetch_prices(symbols, False)
+    
+    def fetch_prices(self, symbols: list, track: bool) -> dict:
+        """get_prices, guarded by the circuit breaker (see fetch_price)"""
+        symbols_upper = []
+        for symbol in symbols or SUPPORTED_SYMBOLS:
+            if symbol.upper() not in symbols_upper:
+                symbols_upper.append(symbol.upper())
+        
+        prices = {}
+        metrics = {}
+        if self.breaker_allows_live(track):
+            metrics["consensus_rounds"] = 1
+            try:
+                fetched = self.fetch_real_prices(symbols_upper)
+                prices = fetched["prices"]
+                metrics.update(fetched.get("metrics", {}))
+                if track:
+                    self.record_breaker_result(True)
+            except Exception as e:
+                metrics["consensus_failures"] = 1
+                if track:
+                    self.record_breaker_result(False)
+        else:
+            metrics["breaker_skips"] = 1
+        
+        result = {}
+        for symbol in symbols_upper:
+            if prices.get(symbol, 0) > 0:
+                result[symbol] = {
+                    "symbol": symbol,
+                    "price_usd_cents": prices[symbol],
+                    "source": "api"
+                }
+            else:
+                result[symbol] = self.get_mock_price(symbol)
+                metrics["mock_fallbacks"] = metrics.get("mock_fallbacks", 0) + 1
+        
+        if track:
+            self.record_price_metrics(metrics)
+        return result
+    
+    def fetch_real_prices(self, symbols: list) -> dict:
+        """
+        Fetch a price vector from CryptoCompare pricemulti
+        Returns {"prices": {symbol: cents}, "metrics": {...}}
+        """
+        def fetch_and_extract_prices():
+            metrics = {}
+            url = f"https://min-api.cryptocompare.com/data/pricemulti?fsyms={','.join(symbols)}&tsyms=USD"
+            web_data = self.timed_render(url, metrics)
+            # Known JSON shape: parse directly and skip the LLM call
+            prices = self.parse_price_vector(web_data, symbols)
+            if len(prices) > 0:
+                return {"prices": prices, "metrics": metrics}
+            
+            payload = self.trim_price_payload(web_data, [f'"{symbols[0]}"'], PROMPT_PAYLOAD_MAX_TOKENS * len(symbols))
+            task = f"""
+Extract the USD price of each symbol from this API response: {payload}
+
+Return ONLY valid JSON mapping symbol to price in cents (integer), e.g.
+{{"BTC": 9564250, "ETH": 350012}}
+Leave out any symbol whose price is missing.
+"""
+            
+            result = self.timed_prompt(task, metrics).replace("```json", "").replace("```", "").strip()
+            parsed = json.loads(result)
+            return {
+                "prices": {symbol: int(parsed[symbol]) for symbol in symbols if symbol in parsed},
+                "metrics": metrics
+            }
+        
+        return self.run_price_vector_consensus(fetch_and_extract_prices)
+    
+    def parse_price_vector(self, web_data: str, symbols: list) -> dict:
+        """
+        Read {"BTC": {"USD": 95642.5}, ...} (pricemulti) into {symbol: cents}
+        Symbols that are absent or malformed are left out
+        """
+        try:
+            data = json.loads(web_data.strip(), parse_float=str, parse_int=str)
+        except ValueError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        
+        prices = {}
+        for symbol in symbols:
+            entry = data.get(symbol)
+            if isinstance(entry, dict) and "USD" in entry:
+                cents = self.decimal_to_cents(entry["USD"])
+                if cents > 0:
+                    prices[symbol] = cents
+        return prices
+    
+    def prefetch_prices(self, symbols, price_memo: dict):
+        """Fill price_memo for all symbols not already in it, using one batched fetch"""
+        missing = [symbol.upper() for symbol in symbols if symbol.upper() not in price_memo]
+        if len(missing) > 0:
+            price_memo.update(self.fetch_prices(missing, True))
+    
+    def get_price_memoized(self, crypto_symbol: str, price_memo: dict) -> dict:
+        """
+        fetch_price through a caller-owned memo dict
+        Batch operations create one memo per call, so each distinct
+        symbol is fetched (and reaches consensus) at most once
+        """
+        symbol = crypto_symbol.upper()
+        if symbol not in price_memo:
+            price_memo[symbol] = self.fetch_price(symbol, True)
+        return price_memo[symbol]
+    
     def get_mock_price(self, crypto_symbol: str) -> dict:
         """Generate mock price with variation (fallback)"""
         # Base prices in cents
@@ -139,6 +637,257 @@ Example: if USD is 95642.50, return 9564250
             "source": "mock"
         }
     
+    # ============================================================
+    # PRICE INSTRUMENTATION
+    # ============================================================
+    
+    def timed_render(self, url: str, metrics: dict) -> str:
+        """gl.nondet.web.render, counting calls, time, bytes and failures into metrics"""
+        started = time.monotonic()
+        try:
+            response = gl.nondet.web.render(url, mode="text")
+        except Exception as e:
+            self.count_price_call(metrics, "render", started, 0, True)
+            raise
+        self.count_price_call(metrics, "render", started, len(response), False)
+        return response
+    
+    def timed_prompt(self, task: str, metrics: dict) -> str:
+        """gl.nondet.exec_prompt, counting calls, time and prompt size into metrics"""
+        started = time.monotonic()
+        result = gl.nondet.exec_prompt(task)
+        self.count_price_call(metrics, "prompt", started, len(task), False)
+        return result
+    
+    def timed_consensus(self, run) -> dict:
+        """
+        Run one consensus call, tracing its duration locally only
+        (each node measures a different time, so it cannot be stored)
+        """
+        started = time.monotonic()
+        failed = True
+        try:
+            result = run()
+            failed = False
+            return result
+        finally:
+            self.trace_price_call("consensus", int((time.monotonic() - started) * 1000), 0, failed)
+    
+    def count_price_call(self, metrics: dict, kind: str, started: float, size: int, failed: bool):
+        """Add one render/prompt call to a nondet metrics dict and to the local trace"""
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        size_key = "render_bytes" if kind == "render" else "prompt_chars"
+        metrics[f"{kind}_calls"] = metrics.get(f"{kind}_calls", 0) + 1
+        metrics[f"{kind}_ms"] = metrics.get(f"{kind}_ms", 0) + elapsed_ms
+        metrics[size_key] = metrics.get(size_key, 0) + size
+        if failed:
+            metrics[f"{kind}_failures"] = metrics.get(f"{kind}_failures", 0) + 1
+        self.trace_price_call(kind, elapsed_ms, size, failed)
+    
+    def trace_price_call(self, kind: str, elapsed_ms: int, size: int, failed: bool):
+        """Append to PRICE_TRACE, dropping the oldest entry once full"""
+        if len(PRICE_TRACE) >= PRICE_TRACE_LIMIT:
+            del PRICE_TRACE[0]
+        PRICE_TRACE.append({"kind": kind, "ms": elapsed_ms, "size": size, "failed": failed})
+    
+    def record_price_metrics(self, metrics: dict):
+        """Add the leader's agreed metrics to the stored counters (write paths only)"""
+        for name, value in metrics.items():
+            if name in PRICE_METRIC_NAMES:
+                self.price_metrics[name] = self.price_metrics.get(name, 0) + int(value)
+    
+    @gl.public.view
+    def get_price_metrics(self) -> dict:
+        """Aggregated price-path counters, with average render/prompt latency"""
+        result = {name: self.price_metrics.get(name, 0) for name in PRICE_METRIC_NAMES}
+        for kind in ["render", "prompt"]:
+            calls = result[f"{kind}_calls"]
+            result[f"{kind}_avg_ms"] = result[f"{kind}_ms"] // calls if calls > 0 else 0
+        return result
+    
+    # ============================================================
+    # CIRCUIT BREAKER (skip the live source while it is failing)
+    # ============================================================
+    
+    def breaker_allows_live(self, track: bool) -> bool:
+        """Whether to try the live API now. An OPEN breaker past its cooldown half-opens"""
+        if self.breaker_state != BREAKER_OPEN:
+            return True
+        if self.transaction_counter - self.breaker_opened_tx < BREAKER_COOLDOWN_TX:
+            return False
+        
+        # Cooldown over - let one probe through
+        if track:
+            self.breaker_state = BREAKER_HALF_OPEN
+        return True
+    
+    def record_breaker_result(self, ok: bool):
+        """Feed one live fetch outcome into the breaker"""
+        if ok:
+            self.breaker_state = BREAKER_CLOSED
+            self.breaker_failures = 0
+            return
+        
+        self.breaker_failures += 1
+        self.breaker_total_failures += 1
+        if self.breaker_state == BREAKER_HALF_OPEN or self.breaker_failures >= BREAKER_FAILURE_THRESHOLD:
+            # Failed probe, or too many failures in a row - (re)open
+            if self.breaker_state != BREAKER_OPEN:
+                self.breaker_trips += 1
+            self.breaker_state = BREAKER_OPEN
+            self.breaker_opened_tx = self.transaction_counter
+    
+    @gl.public.view
+    def get_breaker_state(self) -> dict:
+        """Circuit breaker state and failure counts"""
+        probe_in = 0
+        if self.breaker_state == BREAKER_OPEN:
+            probe_in = max(0, BREAKER_COOLDOWN_TX - (self.transaction_counter - self.breaker_opened_tx))
+        return {
+            "state": BREAKER_STATE_NAMES[self.breaker_state],
+            "consecutive_failures": self.breaker_failures,
+            "total_failures": self.breaker_total_failures,
+            "trips": self.breaker_trips,
+            "opened_tx": self.breaker_opened_tx,
+            "probe_in_tx": probe_in
+        }
+    
+    # ============================================================
+    # ORACLE ROUNDS (one consensus fetch shared by every later tx)
+    # ============================================================
+    
+    @gl.public.write
+    def publish_round(self, symbols: list = []) -> str:
+        """
+        Keeper entry point: fetch all prices once and store them as a new round
+        Placements and settlements read rounds instead of fetching themselves
+        """
+        self.transaction_counter += 1
+        self.price_counter += 1
+        
+        # Only live prices become canonical - mock fallbacks stay per-call
+        prices = {}
+        for symbol, price_data in self.fetch_prices(symbols, True).items():
+            if price_data.get("source") != "api":
+                continue
+            if symbol not in SUPPORTED_SYMBOLS:
+                continue
+            prices[symbol] = price_data["price_usd_cents"]
+        
+        if len(prices) == 0:
+            return "ERROR: No live prices available, round not published"
+        
+        # Pad round_time for rounds published before it existed
+        while len(self.round_time) < len(self.round_tx):
+            self.round_time.append(0)
+        
+        round_id = len(self.round_tx)
+        self.round_tx.append(self.transaction_counter)
+        self.round_time.append(self.current_time_seconds())
+        snapshot = self.round_prices.get_or_insert_default(round_id)
+        for symbol, price in prices.items():
+            snapshot[self.intern_symbol(symbol)] = price
+        
+        return f"Published round #{round_id} at tx {self.transaction_counter} ({len(snapshot)} symbols)"
+    
+    def current_time_seconds(self) -> u256:
+        """Unix seconds from the transaction's message datetime"""
+        return int(datetime.fromisoformat(gl.message_raw["datetime"].replace("Z", "+00:00")).timestamp())
+    
+    def round_price(self, round_id: int, symbol: str) -> u256:
+        """A symbol's price in one round, or 0 if the round doesn't have it"""
+        if round_id < 0 or symbol not in self.symbol_ids:
+            return 0
+        return self.round_prices[round_id].get(self.symbol_ids[symbol], 0)
+    
+    def first_round_at_or_after(self, tx: u256) -> int:
+        """Binary search round_tx for the first round published at or after tx (-1 if none)"""
+        lo = 0
+        hi = len(self.round_tx)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.round_tx[mid] < tx:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self.round_tx) else -1
+    
+    def round_entry_price(self, symbol: str) -> u256:
+        """Latest round's price if it was published within ORACLE_MAX_AGE_SECONDS, else 0"""
+        round_id = len(self.round_tx) - 1
+        if round_id < 0 or round_id >= len(self.round_time):
+            return 0
+        if self.current_time_seconds() - self.round_time[round_id] > ORACLE_MAX_AGE_SECONDS:
+            return 0
+        return self.round_price(round_id, symbol)
+    
+    def round_exit_price(self, symbol: str, expiry_tx: u256) -> u256:
+        """Price in the first round at/after expiry if it is close enough to expiry, else 0"""
+        round_id = self.first_round_at_or_after(expiry_tx)
+        if round_id < 0 or self.round_tx[round_id] - expiry_tx > ORACLE_MAX_EXIT_LAG_TX:
+            return 0
+        return self.round_price(round_id, symbol)
+    
+    def get_entry_price(self, crypto_symbol: str, price_memo: dict) -> dict:
+        """Price for a new prediction: the latest oracle round, else a live fetch"""
+        symbol = crypto_symbol.upper()
+        price = self.round_entry_price(symbol)
+        if price > 0:
+            return {"symbol": symbol, "price_usd_cents": price, "source": "round"}
+        return self.get_price_memoized(symbol, price_memo)
+    
+    def get_exit_price(self, crypto_symbol: str, expiry_tx: u256, price_memo: dict) -> dict:
+        """Price for settlement: the oracle round at expiry, else a live fetch"""
+        symbol = crypto_symbol.upper()
+        price = self.round_exit_price(symbol, expiry_tx)
+        if price > 0:
+            return {"symbol": symbol, "price_usd_cents": price, "source": "round"}
+        return self.get_price_memoized(symbol, price_memo)
+    
+    @gl.public.view
+    def get_round(self, round_id: u256) -> dict:
+        """One oracle round: publish tx and time, and price per symbol (cents)"""
+        if round_id >= len(self.round_tx):
+            return {"error": "Round not found"}
+        return {
+            "round_id": round_id,
+            "published_tx": self.round_tx[round_id],
+            "published_at": self.round_time[round_id] if round_id < len(self.round_time) else 0,
+            "prices": {self.symbol_names[sid]: price for sid, price in self.round_prices[round_id].items()}
+        }
+    
+    @gl.public.view
+    def get_latest_round(self) -> dict:
+        """The most recent oracle round"""
+        if len(self.round_tx) == 0:
+            return {"error": "No rounds published yet"}
+        return self.get_round(len(self.round_tx) - 1)
+    
+    # ============================================================
+    # SYMBOL INTERNING
+    # ============================================================
+    
+    def intern_symbol(self, symbol: str) -> u8:
+        """
+        Return the u8 id for a symbol, registering it on first use
+        Slots are never freed: callers only intern SUPPORTED_SYMBOLS (and
+        symbols of migrated legacy predictions)
+        """
+        if symbol in self.symbol_ids:
+            return self.symbol_ids[symbol]
+        
+        symbol_id = len(self.symbol_names)
+        assert symbol_id < 256, "Symbol table is full"
+        
+        self.symbol_names.append(symbol)
+        self.symbol_ids[symbol] = symbol_id
+        return symbol_id
+    
+    @gl.public.view
+    def get_symbols(self) -> list:
+        """List interned symbols in id order"""
+        return list(self.symbol_names)
+    
     # ============================================================
     # USER BALANCE MANAGEMENT
     # ============================================================
@@ -154,7 +903,9 @@ Example: if USD is 95642.50, return 9564250
         if user_address not in self.user_balances:
             self.user_balances[user_address] = 0
         
+        self.join_pool(user_address)
         self.user_balances[user_address] += amount
+        self.total_pool += amount
         return f"✅ Deposited {amount} tokens. New balance: {self.user_balances[user_address]}"
     
     @gl.public.view
@@ -164,39 +915,54 @@ Example: if USD is 95642.50, return 9564250
     
     @gl.public.view
     def get_user_stats(self, user_address: str) -> dict:
-        """Get comprehensive user statistics"""
+        """Get comprehensive user statistics (single aggregate read)"""
         balance = self.user_balances.get(user_address, 0)
-        wins = self.leaderboard_wins.get(user_address, 0)
         profit = self.leaderboard_profit.get(user_address, 0)
         
-        # Count predictions
-        total = active = won = lost = expired = 0
-        for pred_id in self.prediction_owners:
-            if self.prediction_owners[pred_id] == user_address:
-                total += 1
-                status = self.prediction_statuses[pred_id]
-                if status == "ACTIVE":
-                    active += 1
-                elif status == "WON":
-                    won += 1
-                elif status == "LOST":
-                    lost += 1
-                elif status == "EXPIRED":
-                    expired += 1
-        
-        win_rate = (won * 100 // total) if total > 0 else 0
+        if user_address in self.user_stats:
+            stats = self.user_stats[user_address]
+        else:
+            stats = UserStats(0, 0, 0, 0, 0, 0, 0, 0, 0)
+        
+        total = stats.total
+        win_rate = (stats.won * 100 // total) if total > 0 else 0
         
         return {
             "balance": balance,
             "total_predictions": total,
-            "active": active,
-            "won": won,
-            "lost": lost,
-            "expired": expired,
+            "active": stats.active,
+            "won": stats.won,
+            "lost": stats.lost,
+            "expired": stats.expired,
             "win_rate_percent": win_rate,
-            "total_profit": profit
+            "total_profit": profit,
+            "total_wagered": stats.total_wagered,
+            "total_paid_out": stats.total_paid_out,
+            "current_streak": stats.current_streak,
+            "best_streak": stats.best_streak
         }
     
+    def load_user_stats(self, user_address: str) -> UserStats:
+        """Get a user's aggregate record, creating it on first use"""
+        if user_address not in self.user_stats:
+            self.user_stats[user_address] = UserStats(0, 0, 0, 0, 0, 0, 0, 0, 0)
+        return self.user_stats[user_address]
+    
+    def record_settlement(self, stats: UserStats, status: u8, payout: u256):
+        """Move one prediction out of ACTIVE in a user's aggregates"""
+        stats.active -= 1
+        stats.total_paid_out += payout
+        if status == STATUS_WON:
+            stats.won += 1
+            stats.current_streak += 1
+            if stats.current_streak > stats.best_streak:
+                stats.best_streak = stats.current_streak
+        elif status == STATUS_LOST:
+            stats.lost += 1
+            stats.current_streak = 0
+        elif status == STATUS_EXPIRED:
+            stats.expired += 1
+    
     # ============================================================
     # PREDICTION MANAGEMENT
     # ============================================================
@@ -225,48 +991,165 @@ Example: if USD is 95642.50, return 9564250
         
         # Validation
         direction_upper = direction.upper()
-        if direction_upper not in ["UP", "DOWN"]:
-            return "ERROR: Direction must be UP or DOWN"
-        
-        if bet_amount < self.MIN_BET:
-            return f"ERROR: Minimum bet is {self.MIN_BET} tokens"
-        
-        if bet_amount > self.MAX_BET:
-            return f"ERROR: Maximum bet is {self.MAX_BET} tokens"
+        symbol_upper = crypto_symbol.upper()
+        error = self.validate_order(symbol_upper, direction_upper, bet_amount)
+        if error:
+            return f"ERROR: {error}"
         
         user_balance = self.user_balances.get(user_address, 0)
         if user_balance < bet_amount:
             return f"ERROR: Insufficient balance. Have {user_balance}, need {bet_amount}"
         
-        # Get current price
-        price_data = self.get_current_price(crypto_symbol)
+        # Get current price (latest oracle round, or a live fetch)
+        price_data = self.get_entry_price(symbol_upper, {})
         if "error" in price_data or price_data["price_usd_cents"] == 0:
             return "ERROR: Failed to fetch price. Try again."
         
+        # Convert duration to transaction blocks (assume 1 tx per 10 seconds)
+        duration_tx = self.snap_duration_tx(max(1, duration_seconds // 10))
+        
+        prediction_id = self.record_prediction(
+            user_address, symbol_upper, direction_upper, bet_amount,
+            duration_tx, price_data["price_usd_cents"]
+        )
+        
+        price_usd = price_data["price_usd_cents"] / 100
+        potential_win = (bet_amount * self.PAYOUT_MULTIPLIER) // 10
+        
+        return f"✅ Prediction #{prediction_id} placed!\n{direction_upper} on {symbol_upper} @ ${price_usd:.2f}\nBet: {bet_amount} tokens | Potential win: {potential_win}\nExpires in ~{duration_seconds}s ({duration_tx} transactions)\nSource: {price_data.get('source', 'unknown')}"
+    
+    @gl.public.write
+    def place_predictions_batch(self, user_address: str, orders: list) -> str:
+        """
+        Place several predictions in one transaction
+        
+        Args:
+            user_address: User's wallet address
+            orders: List of legs, e.g.
+                [{"symbol": "BTC", "direction": "UP", "amount": 50, "duration_seconds": 60}, ...]
+        
+        Every leg is validated before anything is placed, the balance is
+        checked once for the total stake, and each distinct symbol's price
+        is fetched once.
+        """
+        self.transaction_counter += 1
+        self.price_counter += 1
+        
+        if len(orders) == 0:
+            return "ERROR: No orders given"
+        
+        if len(orders) > MAX_BATCH_ORDERS:
+            return f"ERROR: At most {MAX_BATCH_ORDERS} orders per batch"
+        
+        # Validate all legs first
+        legs = []
+        total_stake = 0
+        for i, order in enumerate(orders):
+            symbol_upper = str(order.get("symbol", "")).upper()
+            direction_upper = str(order.get("direction", "")).upper()
+            amount = int(order.get("amount", 0))
+            duration_seconds = int(order.get("duration_seconds", 60))
+            
+            error = self.validate_order(symbol_upper, direction_upper, amount)
+            if error:
+                return f"ERROR: Order {i + 1}: {error}"
+            
+            legs.append((symbol_upper, direction_upper, amount, self.snap_duration_tx(max(1, duration_seconds // 10))))
+            total_stake += amount
+        
+        user_balance = self.user_balances.get(user_address, 0)
+        if user_balance < total_stake:
+            return f"ERROR: Insufficient balance. Have {user_balance}, need {total_stake}"
+        
+        # Oracle round prices where available, one batched fetch for the rest
+        price_memo = {}
+        self.prefetch_prices({leg[0] for leg in legs if self.round_entry_price(leg[0]) == 0}, price_memo)
+        prices = {}
+        for symbol_upper, _, _, _ in legs:
+            price_data = self.get_entry_price(symbol_upper, price_memo)
+            if "error" in price_data or price_data["price_usd_cents"] == 0:
+                return f"ERROR: Failed to fetch {symbol_upper} price. Try again."
+            prices[symbol_upper] = price_data["price_usd_cents"]
+        
+        lines = []
+        for symbol_upper, direction_upper, amount, duration_tx in legs:
+            prediction_id = self.record_prediction(
+                user_address, symbol_upper, direction_upper, amount,
+                duration_tx, prices[symbol_upper]
+            )
+            price_usd = prices[symbol_upper] / 100
+            lines.append(f"#{prediction_id}: {direction_upper} on {symbol_upper} @ ${price_usd:.2f} | Bet: {amount} | Expires in {duration_tx} tx")
+        
+        return f"✅ Placed {len(legs)} predictions ({total_stake} tokens):\n" + "\n".join(lines)
+    
+    def validate_order(self, symbol_upper: str, direction_upper: str, bet_amount: u256) -> str:
+        """Check one order's fields. Returns an error message, or "" if valid"""
+        if direction_upper not in ["UP", "DOWN"]:
+            return "Direction must be UP or DOWN"
+        
+        if bet_amount < self.MIN_BET:
+            return f"Minimum bet is {self.MIN_BET} tokens"
+        
+        if bet_amount > self.MAX_BET:
+            return f"Maximum bet is {self.MAX_BET} tokens"
+        
+        if symbol_upper not in SUPPORTED_SYMBOLS:
+            return f"Unsupported symbol. Choose from: {', '.join(SUPPORTED_SYMBOLS)}"
+        
+        return ""
+    
+    def record_prediction(
+        self,
+        user_address: str,
+        symbol_upper: str,
+        direction_upper: str,
+        bet_amount: u256,
+        duration_tx: u256,
+        entry_price: u256
+    ) -> u256:
+        """Debit the stake and write a validated prediction plus its indexes"""
         # Deduct bet from balance
+        self.join_pool(user_address)
         self.user_balances[user_address] -= bet_amount
+        self.total_pool -= bet_amount
+        self.total_volume += bet_amount
         
         # Create prediction
         prediction_id = self.next_prediction_id
         self.next_prediction_id += 1
         
-        # Convert duration to transaction blocks (assume 1 tx per 10 seconds)
-        duration_tx = max(1, duration_seconds // 10)
-        
-        # Store prediction
-        self.prediction_symbols[prediction_id] = crypto_symbol.upper()
-        self.prediction_directions[prediction_id] = direction_upper
-        self.prediction_amounts[prediction_id] = bet_amount
-        self.prediction_entry_prices[prediction_id] = price_data["price_usd_cents"]
-        self.prediction_creation_tx[prediction_id] = self.transaction_counter
-        self.prediction_duration_tx[prediction_id] = duration_tx
-        self.prediction_owners[prediction_id] = user_address
-        self.prediction_statuses[prediction_id] = "ACTIVE"
+        # Store prediction (single record write)
+        self.predictions[prediction_id] = Prediction(
+            owner=user_address,
+            symbol_id=self.intern_symbol(symbol_upper),
+            direction=DIRECTION_UP if direction_upper == "UP" else DIRECTION_DOWN,
+            status=STATUS_ACTIVE,
+            amount=bet_amount,
+            entry_price=entry_price,
+            creation_tx=self.transaction_counter,
+            duration_tx=duration_tx,
+        )
         
-        price_usd = price_data["price_usd_cents"] / 100
-        potential_win = (bet_amount * self.PAYOUT_MULTIPLIER) // 10
+        # Queue for keeper settlement, individually and by cohort
+        expiry_tx = self.transaction_counter + duration_tx
+        self.schedule_expiry(prediction_id, expiry_tx)
+        cohort = self.cohorts.get_or_insert_default((expiry_tx << 8) | self.symbol_ids[symbol_upper])
+        self.cohort_pos[prediction_id] = len(cohort)
+        cohort.append(prediction_id)
+        
+        # Index by owner
+        if user_address not in self.user_prediction_ids:
+            self.unique_player_count += 1
+        self.user_prediction_ids.get_or_insert_default(user_address).append(prediction_id)
+        self.user_active_ids.get_or_insert_default(user_address)[prediction_id] = True
+        self.count_status(STATUS_ACTIVE, 1)
+        
+        stats = self.load_user_stats(user_address)
+        stats.total += 1
+        stats.active += 1
+        stats.total_wagered += bet_amount
         
-        return f"✅ Prediction #{prediction_id} placed!\n{direction_upper} on {crypto_symbol.upper()} @ ${price_usd:.2f}\nBet: {bet_amount} tokens | Potential win: {potential_win}\nExpires in ~{duration_seconds}s ({duration_tx} transactions)\nSource: {price_data.get('source', 'unknown')}"
+        return prediction_id
     
     @gl.public.write
     def settle_prediction(self, user_address: str, prediction_id: u256) -> str:
@@ -278,47 +1161,61 @@ Example: if USD is 95642.50, return 9564250
         self.price_counter += 1
         
         # Validation
-        if prediction_id not in self.prediction_owners:
+        if prediction_id not in self.predictions:
             return "ERROR: Prediction not found"
         
-        if self.prediction_owners[prediction_id] != user_address:
+        pred = self.predictions[prediction_id]
+        if pred.owner != user_address:
             return "ERROR: Not your prediction"
         
-        status = self.prediction_statuses[prediction_id]
-        if status != "ACTIVE":
-            return f"ERROR: Already settled (Status: {status})"
+        if pred.status != STATUS_ACTIVE:
+            return f"ERROR: Already settled (Status: {STATUS_NAMES[pred.status]})"
         
         # Check if enough time has passed
-        creation_tx = self.prediction_creation_tx[prediction_id]
-        duration_tx = self.prediction_duration_tx[prediction_id]
-        tx_passed = self.transaction_counter - creation_tx
+        duration_tx = pred.duration_tx
+        tx_passed = self.transaction_counter - pred.creation_tx
         
         if tx_passed < duration_tx:
             tx_remaining = duration_tx - tx_passed
             return f"⏳ Too early! Need {tx_remaining} more transactions.\nTip: Call advance_time() or make other transactions to simulate time passing."
         
-        # Get exit price
-        symbol = self.prediction_symbols[prediction_id]
-        price_data = self.get_current_price(symbol)
+        # Get exit price (oracle round at expiry, or a live fetch)
+        symbol = self.symbol_names[pred.symbol_id]
+        price_data = self.get_exit_price(symbol, pred.creation_tx + duration_tx, {})
         
         if "error" in price_data or price_data["price_usd_cents"] == 0:
             return "ERROR: Failed to fetch exit price. Try again."
         
-        exit_price = price_data["price_usd_cents"]
-        entry_price = self.prediction_entry_prices[prediction_id]
+        return self.resolve_prediction(prediction_id, price_data["price_usd_cents"])
+    
+    def resolve_prediction(self, prediction_id: u256, exit_price: u256) -> str:
+        """Settle an ACTIVE, due prediction against a known exit price"""
+        pred = self.predictions[prediction_id]
+        user_address = pred.owner
+        symbol = self.symbol_names[pred.symbol_id]
+        entry_price = pred.entry_price
         
         # Determine winner
         price_went_up = exit_price > entry_price
-        direction = self.prediction_directions[prediction_id]
-        won = (price_went_up and direction == "UP") or (not price_went_up and direction == "DOWN")
+        direction = pred.direction
+        won = (price_went_up and direction == DIRECTION_UP) or (not price_went_up and direction == DIRECTION_DOWN)
+        
+        bet = pred.amount
         
-        bet = self.prediction_amounts[prediction_id]
+        # Previous scores, for moving the player between rank buckets.
+        # Players not indexed yet (deployments that predate the rank trees,
+        # before rebuild_leaderboards) are inserted rather than moved
+        indexed = user_address in self.profit_bucket_pos
+        old_wins = self.leaderboard_wins.get(user_address, None) if indexed else None
+        old_profit = self.leaderboard_profit.get(user_address, None) if indexed else None
         
         # Calculate result
         if won:
             payout = (bet * self.PAYOUT_MULTIPLIER) // 10
+            self.join_pool(user_address)
             self.user_balances[user_address] += payout
-            self.prediction_statuses[prediction_id] = "WON"
+            self.total_pool += payout
+            pred.status = STATUS_WON
             
             # Update leaderboard
             if user_address not in self.leaderboard_wins:
@@ -333,7 +1230,7 @@ Example: if USD is 95642.50, return 9564250
             result_text = "YOU WON!"
         else:
             payout = 0
-            self.prediction_statuses[prediction_id] = "LOST"
+            pred.status = STATUS_LOST
             
             # Track losses
             if user_address not in self.leaderboard_profit:
@@ -343,13 +1240,28 @@ Example: if USD is 95642.50, return 9564250
             result_emoji = "😔"
             result_text = "You Lost"
         
+        # Re-rank in the bounded leaderboards and rank trees
+        if won:
+            self.update_top_k(self.top_wins, self.leaderboard_wins, user_address, LEADERBOARD_SIZE)
+        if won or (not indexed and user_address in self.leaderboard_wins):
+            self.move_rank("wins", old_wins, self.leaderboard_wins[user_address], user_address)
+        self.move_rank("profit", old_profit, self.leaderboard_profit[user_address], user_address)
+        
+        # No longer active
+        del self.user_active_ids[user_address][prediction_id]
+        self.leave_cohort(prediction_id, pred)
+        self.count_status(STATUS_ACTIVE, -1)
+        self.count_status(pred.status, 1)
+        self.record_settlement(self.load_user_stats(user_address), pred.status, payout)
+        self.queue_for_archive(prediction_id)
+        
         # Format response
         entry_usd = entry_price / 100
         exit_usd = exit_price / 100
         change_percent = ((exit_price - entry_price) * 100 / entry_price) if entry_price > 0 else 0
         
         return f"""{result_emoji} {result_text}
-Prediction #{prediction_id}: {direction} on {symbol}
+Prediction #{prediction_id}: {DIRECTION_NAMES[direction]} on {symbol}
 Entry: ${entry_usd:.2f} → Exit: ${exit_usd:.2f} ({change_percent:+.2f}%)
 Bet: {bet} | Payout: {payout} | Profit: {payout - bet:+d}
 New Balance: {self.user_balances[user_address]}"""
@@ -358,58 +1270,254 @@ New Balance: {self.user_balances[user_address]}"""
     def settle_all_ready(self, user_address: str) -> str:
         """Auto-settle all ready predictions for a user"""
         self.transaction_counter += 1
+        self.price_counter += 1
         
         settled_count = 0
         results = []
+        price_memo = {}  # At most one price fetch per symbol in this call
+        
+        # Copy the ready IDs first - settling removes them from the active set
+        ready_ids = []
+        for pred_id in self.user_active_ids.get(user_address, {}):
+            pred = self.predictions[pred_id]
+            if self.transaction_counter - pred.creation_tx >= pred.duration_tx:
+                ready_ids.append(pred_id)
+        
+        needs_fetch = set()
+        for pred_id in ready_ids:
+            pred = self.predictions[pred_id]
+            symbol = self.symbol_names[pred.symbol_id]
+            if self.round_exit_price(symbol, pred.creation_tx + pred.duration_tx) == 0:
+                needs_fetch.add(symbol)
+        self.prefetch_prices(needs_fetch, price_memo)
         
-        for pred_id in self.prediction_owners:
-            if self.prediction_owners[pred_id] != user_address:
+        for pred_id in ready_ids:
+            pred = self.predictions[pred_id]
+            price_data = self.get_exit_price(self.symbol_names[pred.symbol_id], pred.creation_tx + pred.duration_tx, price_memo)
+            if "error" in price_data or price_data["price_usd_cents"] == 0:
+                results.append(f"#{pred_id}: ERROR: Failed to fetch exit price")
                 continue
             
-            if self.prediction_statuses[pred_id] != "ACTIVE":
+            result = self.resolve_prediction(pred_id, price_data["price_usd_cents"])
+            settled_count += 1
+            results.append(f"#{pred_id}: {result[:30]}...")
+        
+        if settled_count == 0:
+            return "No predictions ready to settle"
+        
+        return f"✅ Settled {settled_count} predictions:\n" + "\n".join(results)
+    
+    # ============================================================
+    # COHORT SETTLEMENT (one exit price per symbol + expiry)
+    # ============================================================
+    
+    def snap_duration_tx(self, duration_tx: u256) -> u256:
+        """Stretch a duration so the expiry lands on the expiry grid"""
+        grid = min(self.expiry_grid_tx, MAX_EXPIRY_GRID_TX)
+        if grid <= 1:
+            return duration_tx
+        
+        expiry_tx = self.transaction_counter + duration_tx
+        snapped = ((expiry_tx + grid - 1) // grid) * grid
+        return snapped - self.transaction_counter
+    
+    @gl.public.write
+    def set_expiry_grid(self, grid_tx: u256) -> str:
+        """
+        Snap new expiries to multiples of grid_tx transactions so more
+        predictions share a cohort (6 tx ~ 1 minute). 1 turns it off;
+        at most MAX_EXPIRY_GRID_TX.
+        """
+        self.transaction_counter += 1
+        if grid_tx < 1 or grid_tx > MAX_EXPIRY_GRID_TX:
+            return f"ERROR: Expiry grid must be 1-{MAX_EXPIRY_GRID_TX} transactions (1 = off)"
+        self.expiry_grid_tx = grid_tx
+        return f"Expiry grid set to {grid_tx} transactions"
+    
+    @gl.public.write
+    def settle_cohort(self, crypto_symbol: str, expiry_tx: u256) -> str:
+        """
+        Settle every active prediction on a symbol that expires at
+        expiry_tx, using a single exit price fetch
+        """
+        self.transaction_counter += 1
+        self.price_counter += 1
+        
+        symbol = crypto_symbol.upper()
+        if symbol not in self.symbol_ids:
+            return f"ERROR: Unknown symbol {symbol}"
+        
+        key = (expiry_tx << 8) | self.symbol_ids[symbol]
+        if key not in self.cohorts:
+            return f"No {symbol} cohort expiring at tx {expiry_tx}"
+        
+        if self.transaction_counter < expiry_tx:
+            return f"⏳ Too early! Cohort expires in {expiry_tx - self.transaction_counter} transactions."
+        
+        price_data = self.get_exit_price(symbol, expiry_tx, {})
+        if "error" in price_data or price_data["price_usd_cents"] == 0:
+            return "ERROR: Failed to fetch exit price. Try again."
+        exit_price = price_data["price_usd_cents"]
+        
+        settled = won = 0
+        # Resolving removes each member (and finally the cohort) in O(1)
+        for pred_id in list(self.cohorts[key]):
+            if pred_id not in self.predictions or self.predictions[pred_id].status != STATUS_ACTIVE:
                 continue
+            self.resolve_prediction(pred_id, exit_price)
+            settled += 1
+            if self.predictions[pred_id].status == STATUS_WON:
+                won += 1
+        
+        return f"✅ Settled {symbol} cohort @ tx {expiry_tx}: {settled} predictions ({won} won) at ${exit_price / 100:.2f}"
+    
+    def leave_cohort(self, prediction_id: u256, pred: Prediction):
+        """Remove a resolved prediction from its cohort, and the cohort once empty - O(1)"""
+        if prediction_id not in self.cohort_pos:
+            return  # Migrated legacy prediction - never had a cohort
+        
+        key = ((pred.creation_tx + pred.duration_tx) << 8) | pred.symbol_id
+        members = self.cohorts[key]
+        # Swap-remove
+        pos = self.cohort_pos[prediction_id]
+        last = members[len(members) - 1]
+        members[pos] = last
+        self.cohort_pos[last] = pos
+        members.pop()
+        del self.cohort_pos[prediction_id]
+        if len(members) == 0:
+            del self.cohorts[key]
+    
+    @gl.public.view
+    def get_cohort(self, crypto_symbol: str, expiry_tx: u256) -> list:
+        """Unsettled prediction IDs in a symbol + expiry cohort"""
+        symbol = crypto_symbol.upper()
+        if symbol not in self.symbol_ids:
+            return []
+        return list(self.cohorts.get((expiry_tx << 8) | self.symbol_ids[symbol], []))
+    
+    # ============================================================
+    # EXPIRY QUEUE & KEEPER SETTLEMENT
+    # ============================================================
+    
+    def schedule_expiry(self, prediction_id: u256, expiry_tx: u256):
+        """Push a prediction onto the expiry heap (sift up)"""
+        heap = self.expiry_heap
+        heap.append((expiry_tx << 64) | prediction_id)
+        i = len(heap) - 1
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[parent] <= heap[i]:
+                break
+            heap[parent], heap[i] = heap[i], heap[parent]
+            i = parent
+    
+    def pop_expiry(self) -> u256:
+        """Pop the entry with the earliest expiry (sift down)"""
+        heap = self.expiry_heap
+        top = heap[0]
+        last = heap.pop()
+        size = len(heap)
+        if size > 0:
+            heap[0] = last
+            i = 0
+            while True:
+                smallest = i
+                left = 2 * i + 1
+                right = left + 1
+                if left < size and heap[left] < heap[smallest]:
+                    smallest = left
+                if right < size and heap[right] < heap[smallest]:
+                    smallest = right
+                if smallest == i:
+                    break
+                heap[i], heap[smallest] = heap[smallest], heap[i]
+                i = smallest
+        return top
+    
+    @gl.public.write
+    def settle_due(self, max_count: u256 = 10) -> str:
+        """
+        Keeper entry point: settle due predictions for ALL users
+        Only pops predictions whose expiry has passed by the start of the call,
+        up to max_count heap entries (already-settled entries count too)
+        """
+        self.transaction_counter += 1
+        self.price_counter += 1
+        
+        now = self.transaction_counter  # Only what is due as of this call
+        popped = 0
+        settled_count = 0
+        results = []
+        retry = []
+        price_memo = {}  # At most one price fetch per symbol in this call
+        
+        while len(self.expiry_heap) > 0 and popped < max_count:
+            entry = self.expiry_heap[0]
+            if (entry >> 64) > now:
+                break
             
-            creation_tx = self.prediction_creation_tx[pred_id]
-            duration_tx = self.prediction_duration_tx[pred_id]
-            tx_passed = self.transaction_counter - creation_tx
+            self.pop_expiry()
+            popped += 1
+            pred_id = entry & ((1 << 64) - 1)
             
-            if tx_passed >= duration_tx:
-                result = self.settle_prediction(user_address, pred_id)
-                settled_count += 1
-                results.append(f"#{pred_id}: {result[:30]}...")
+            # Skip predictions already settled (and maybe archived) by their owner
+            if pred_id not in self.predictions:
+                continue
+            pred = self.predictions[pred_id]
+            if pred.status != STATUS_ACTIVE:
+                continue
+            
+            price_data = self.get_exit_price(self.symbol_names[pred.symbol_id], entry >> 64, price_memo)
+            if "error" in price_data or price_data["price_usd_cents"] == 0:
+                # Price fetch failed - keep it queued
+                retry.append(entry)
+                continue
+            
+            result = self.resolve_prediction(pred_id, price_data["price_usd_cents"])
+            settled_count += 1
+            results.append(f"#{pred_id}: {result[:30]}...")
+        
+        for entry in retry:
+            self.schedule_expiry(entry & ((1 << 64) - 1), entry >> 64)
         
         if settled_count == 0:
-            return "No predictions ready to settle"
+            return "No predictions due"
         
-        return f"✅ Settled {settled_count} predictions:\n" + "\n".join(results)
+        return f"✅ Settled {settled_count} due predictions:\n" + "\n".join(results)
+    
+    @gl.public.view
+    def get_pending_expiries(self) -> u256:
+        """Number of queued expiry entries (may include already-settled ones)"""
+        return len(self.expiry_heap)
     
     @gl.public.view
     def get_prediction_details(self, prediction_id: u256) -> dict:
         """Get detailed information about a prediction"""
-        if prediction_id not in self.prediction_owners:
+        if prediction_id not in self.predictions:
+            if prediction_id < self.next_prediction_id and prediction_id not in self.prediction_owners:
+                return {"error": "Prediction archived - see get_user_history", "id": prediction_id}
             return {"error": "Prediction not found"}
         
-        symbol = self.prediction_symbols[prediction_id]
-        direction = self.prediction_directions[prediction_id]
-        amount = self.prediction_amounts[prediction_id]
-        entry_price = self.prediction_entry_prices[prediction_id]
-        status = self.prediction_statuses[prediction_id]
-        owner = self.prediction_owners[prediction_id]
+        pred = self.predictions[prediction_id]
+        entry_price = pred.entry_price
+        status = pred.status
         
+        # Decode compact fields at the view boundary
         result = {
             "id": prediction_id,
-            "symbol": symbol,
-            "direction": direction,
-            "amount": amount,
+            "symbol": self.symbol_names[pred.symbol_id],
+            "direction": DIRECTION_NAMES[pred.direction],
+            "amount": pred.amount,
             "entry_price_cents": entry_price,
             "entry_price_usd": entry_price / 100,
-            "status": status,
-            "owner": owner
+            "status": STATUS_NAMES[status],
+            "owner": pred.owner
         }
         
-        if status == "ACTIVE":
-            creation_tx = self.prediction_creation_tx[prediction_id]
-            duration_tx = self.prediction_duration_tx[prediction_id]
+        if status == STATUS_ACTIVE:
+            creation_tx = pred.creation_tx
+            duration_tx = pred.duration_tx
             tx_passed = self.transaction_counter - creation_tx
             tx_remaining = max(0, duration_tx - tx_passed)
             
@@ -426,13 +1534,7 @@ New Balance: {self.user_balances[user_address]}"""
         """Get all active predictions for a user"""
         active = []
         
-        for pred_id in self.prediction_owners:
-            if self.prediction_owners[pred_id] != user_address:
-                continue
-            
-            if self.prediction_statuses[pred_id] != "ACTIVE":
-                continue
-            
+        for pred_id in self.user_active_ids.get(user_address, {}):
             details = self.get_prediction_details(pred_id)
             if "error" not in details:
                 ready = "✅ READY" if details.get("ready_to_settle", False) else f"⏳ {details.get('tx_remaining', 0)} tx left"
@@ -443,6 +1545,299 @@ New Balance: {self.user_balances[user_address]}"""
         
         return "\n".join(active)
     
+    # ============================================================
+    # ARCHIVE (settled predictions leave the hot maps)
+    # ============================================================
+    
+    def queue_for_archive(self, prediction_id: u256):
+        """Queue a settled prediction for the next compact() call"""
+        self.archive_queue[self.archive_queue_tail] = prediction_id
+        self.archive_queue_tail += 1
+    
+    def encode_history_record(self, prediction_id: u256, pred: Prediction) -> bytes:
+        """Pack a settled prediction into HISTORY_RECORD_SIZE bytes"""
+        return struct.pack(
+            HISTORY_RECORD_FORMAT,
+            prediction_id,
+            pred.symbol_id,
+            pred.direction,
+            pred.status,
+            pred.amount,
+            pred.entry_price,
+            pred.creation_tx,
+            pred.duration_tx,
+        )
+    
+    def decode_history_record(self, record: bytes) -> dict:
+        """Unpack a history entry into the same shape as get_prediction_details"""
+        (prediction_id, symbol_id, direction, status, amount,
+         entry_price, creation_tx, duration_tx) = struct.unpack(HISTORY_RECORD_FORMAT, record)
+        return {
+            "id": prediction_id,
+            "symbol": self.symbol_names[symbol_id],
+            "direction": DIRECTION_NAMES[direction],
+            "amount": amount,
+            "entry_price_cents": entry_price,
+            "entry_price_usd": entry_price / 100,
+            "status": STATUS_NAMES[status],
+            "creation_tx": creation_tx,
+            "duration_tx": duration_tx
+        }
+    
+    @gl.public.write
+    def compact(self, max_count: u256 = 50) -> str:
+        """
+        Move up to max_count settled predictions into their owners'
+        history logs and delete them from the hot prediction map
+        """
+        self.transaction_counter += 1
+        
+        archived = 0
+        while self.archive_queue_head < self.archive_queue_tail and archived < max_count:
+            pred_id = self.archive_queue[self.archive_queue_head]
+            del self.archive_queue[self.archive_queue_head]
+            self.archive_queue_head += 1
+            
+            if pred_id not in self.predictions:
+                continue
+            
+            pred = self.predictions[pred_id]
+            history = self.user_history.get_or_insert_default(pred.owner)
+            self.user_archive_pos.get_or_insert_default(pred.owner)[pred_id] = len(history)
+            history.append(self.encode_history_record(pred_id, pred))
+            del self.predictions[pred_id]
+            archived += 1
+        
+        pending = self.archive_queue_tail - self.archive_queue_head
+        return f"Archived {archived} predictions. Waiting: {pending}"
+    
+    @gl.public.view
+    def get_user_history(self, user_address: str) -> list:
+        """Archived (settled) predictions for a user, oldest first"""
+        return [self.decode_history_record(record) for record in self.user_history.get(user_address, [])]
+    
+    # ============================================================
+    # PAGINATED HISTORY
+    # ============================================================
+    
+    @gl.public.view
+    def get_user_predictions_page(
+        self,
+        user_address: str,
+        cursor: u256 = 0,
+        limit: u256 = 20,
+        status_filter: str = ""
+    ) -> dict:
+        """
+        Page through a user's predictions, newest first
+        
+        Args:
+            cursor: 0 for the first page, then the returned next_cursor
+            limit: Entries examined per call (max MAX_PAGE_SIZE)
+            status_filter: Optional ACTIVE, WON, LOST or EXPIRED
+        
+        A filtered page can hold fewer than limit items; keep following
+        next_cursor until it is null.
+        """
+        wanted = status_filter.upper()
+        if wanted and wanted not in STATUS_NAMES:
+            return {"error": f"Unknown status filter: {status_filter}"}
+        wanted_code = STATUS_NAMES.index(wanted) if wanted else None
+        
+        ids = self.user_prediction_ids.get(user_address, [])
+        end = cursor if 0 < cursor <= len(ids) else len(ids)
+        start = max(0, end - max(1, min(limit, MAX_PAGE_SIZE)))
+        
+        items = []
+        for i in range(end - 1, start - 1, -1):
+            pred_id = ids[i]
+            if pred_id in self.predictions:
+                # Filter on the compact code before decoding anything
+                if wanted_code is not None and self.predictions[pred_id].status != wanted_code:
+                    continue
+                items.append(self.get_prediction_details(pred_id))
+            else:
+                pos = self.user_archive_pos.get(user_address, {}).get(pred_id, None)
+                if pos is None:
+                    continue  # Legacy record not migrated yet
+                entry = self.decode_history_record(self.user_history[user_address][pos])
+                if wanted and entry["status"] != wanted:
+                    continue
+                items.append(entry)
+        
+        return {
+            "items": items,
+            "next_cursor": start if start > 0 else None,
+            "total": len(ids)
+        }
+    
+    # ============================================================
+    # TOP-K LEADERBOARD
+    # ============================================================
+    
+    def update_top_k(self, top: DynArray[str], scores: TreeMap[str, u256], user_address: str, capacity: int):
+        """
+        Re-rank one user inside a bounded, score-descending list - O(K)
+        Players outside the list only get in by beating its last entry
+        """
+        score = scores[user_address]
+        
+        pos = -1
+        for i in range(len(top)):
+            if top[i] == user_address:
+                pos = i
+                break
+        
+        if pos == -1:
+            if len(top) >= capacity and score <= scores[top[len(top) - 1]]:
+                return
+            top.append(user_address)
+            pos = len(top) - 1
+        
+        # Move forward past lower scores...
+        while pos > 0 and scores[top[pos - 1]] < score:
+            top[pos - 1], top[pos] = top[pos], top[pos - 1]
+            pos -= 1
+        # ...or back past higher ones after a score drop
+        while pos < len(top) - 1 and scores[top[pos + 1]] > score:
+            top[pos + 1], top[pos] = top[pos], top[pos + 1]
+            pos += 1
+        
+        if len(top) > capacity:
+            top.pop()
+    
+    # ============================================================
+    # RANK INDEX (Fenwick tree over score buckets)
+    # ============================================================
+    
+    def rank_tree(self, sort_by: str) -> DynArray[u256]:
+        """Fenwick tree for a board, sized on first use"""
+        tree = self.rank_tree_profit if sort_by == "profit" else self.rank_tree_wins
+        while len(tree) < RANK_BUCKETS + 1:
+            tree.append(0)
+        return tree
+    
+    def rank_bucket(self, sort_by: str, score: int) -> int:
+        """Map a score to its bucket index (0 .. RANK_BUCKETS - 1)"""
+        if sort_by == "profit":
+            bucket = score // PROFIT_BUCKET_WIDTH + RANK_BUCKETS // 2
+        else:
+            bucket = score
+        return max(0, min(RANK_BUCKETS - 1, bucket))
+    
+    def fenwick_add(self, tree: DynArray[u256], bucket: int, delta: int):
+        """Add delta to one bucket - O(log n)"""
+        i = bucket + 1
+        while i <= RANK_BUCKETS:
+            tree[i] += delta
+            i += i & (-i)
+    
+    def fenwick_prefix(self, tree: DynArray[u256], bucket: int) -> int:
+        """Number of players in buckets 0..bucket - O(log n)"""
+        total = 0
+        i = bucket + 1
+        while i > 0:
+            total += tree[i]
+            i -= i & (-i)
+        return total
+    
+    def fenwick_find(self, tree: DynArray[u256], k: int) -> int:
+        """Lowest bucket whose prefix count reaches k (1 <= k <= total) - O(log n)"""
+        pos = 0
+        step = RANK_BUCKETS
+        while step > 0:
+            if pos + step <= RANK_BUCKETS and tree[pos + step] < k:
+                pos += step
+                k -= tree[pos]
+            step //= 2
+        return pos
+    
+    def move_rank(self, sort_by: str, old_score, new_score: int, user_address: str):
+        """
+        Move a player between buckets (old_score is None for new players)
+        A player listed in profit_bucket_pos is counted in both trees
+        """
+        old_bucket = None if old_score is None else self.rank_bucket(sort_by, old_score)
+        new_bucket = self.rank_bucket(sort_by, new_score)
+        if old_bucket == new_bucket:
+            return
+        
+        tree = self.rank_tree(sort_by)
+        if old_bucket is not None:
+            self.fenwick_add(tree, old_bucket, -1)
+        self.fenwick_add(tree, new_bucket, 1)
+        
+        if sort_by == "profit":
+            self.move_profit_member(user_address, old_bucket, new_bucket)
+    
+    def move_profit_member(self, user_address: str, old_bucket, new_bucket: int):
+        """Move a player to another profit bucket's member list - O(1)"""
+        if old_bucket is not None and user_address in self.profit_bucket_pos:
+            members = self.profit_bucket_members[old_bucket]
+            # Swap-remove
+            pos = self.profit_bucket_pos[user_address]
+            last = members[len(members) - 1]
+            members[pos] = last
+            self.profit_bucket_pos[last] = pos
+            members.pop()
+        
+        members = self.profit_bucket_members.get_or_insert_default(new_bucket)
+        self.profit_bucket_pos[user_address] = len(members)
+        members.append(user_address)
+    
+    def top_by_profit(self, limit: int) -> list:
+        """
+        The `limit` highest-profit players, exactly: walk non-empty profit
+        buckets from the top (found through the Fenwick tree) and sort each
+        bucket's members by their actual profit
+        """
+        tree = self.rank_tree_profit
+        if len(tree) < RANK_BUCKETS + 1:
+            return []
+        
+        result = []
+        remaining = self.fenwick_prefix(tree, RANK_BUCKETS - 1)
+        while remaining > 0 and len(result) < limit:
+            bucket = self.fenwick_find(tree, remaining)
+            members = list(self.profit_bucket_members.get(bucket, []))
+            members.sort(key=lambda user: self.leaderboard_profit[user], reverse=True)
+            result.extend(members[:limit - len(result)])
+            remaining = self.fenwick_prefix(tree, bucket - 1) if bucket > 0 else 0
+        return result
+    
+    @gl.public.view
+    def get_rank(self, user_address: str, sort_by: str = "wins") -> dict:
+        """
+        Get a player's rank and percentile in O(log n)
+        Args:
+            sort_by: "wins" or "profit"
+        """
+        scores = self.leaderboard_profit if sort_by == "profit" else self.leaderboard_wins
+        if user_address not in scores:
+            return {"error": "Player not ranked yet"}
+        
+        tree = self.rank_tree_profit if sort_by == "profit" else self.rank_tree_wins
+        if len(tree) < RANK_BUCKETS + 1:
+            return {"error": "Rank index not built yet"}
+        
+        score = scores[user_address]
+        bucket = self.rank_bucket(sort_by, score)
+        total = self.fenwick_prefix(tree, RANK_BUCKETS - 1)
+        at_or_below = self.fenwick_prefix(tree, bucket)
+        
+        # Players sharing a bucket share a rank
+        rank = total - at_or_below + 1
+        percentile = (at_or_below * 100) // total if total > 0 else 0
+        
+        return {
+            "user": user_address,
+            "sort_by": "profit" if sort_by == "profit" else "wins",
+            "score": score,
+            "rank": rank,
+            "total_players": total,
+            "percentile": percentile
+        }
+    
     # ============================================================
     # LEADERBOARD & STATS
     # ============================================================
@@ -455,64 +1850,153 @@ New Balance: {self.user_balances[user_address]}"""
             sort_by: "wins" or "profit"
         """
         if sort_by == "profit":
-            if not self.leaderboard_profit:
+            top = self.top_by_profit(LEADERBOARD_SIZE)
+            if len(top) == 0:
                 return "🏆 No players yet"
             
-            sorted_leaders = sorted(
-                self.leaderboard_profit.items(), 
-                key=lambda x: x[1], 
-                reverse=True
-            )
             result = "🏆 Top Players by Profit:\n"
-            for i, (user, profit) in enumerate(sorted_leaders[:10], 1):
-                result += f"{i}. {user[:10]}... - {profit:+d} tokens\n"
+            for i in range(len(top)):
+                user = top[i]
+                profit = self.leaderboard_profit[user]
+                result += f"{i + 1}. {user[:10]}... - {profit:+d} tokens\n"
         else:
-            if not self.leaderboard_wins:
+            if len(self.top_wins) == 0:
                 return "🏆 No winners yet"
             
-            sorted_leaders = sorted(
-                self.leaderboard_wins.items(),
-                key=lambda x: x[1],
-                reverse=True
-            )
             result = "🏆 Top Players by Wins:\n"
-            for i, (user, wins) in enumerate(sorted_leaders[:10], 1):
+            for i in range(len(self.top_wins)):
+                user = self.top_wins[i]
+                wins = self.leaderboard_wins[user]
                 profit = self.leaderboard_profit.get(user, 0)
-                result += f"{i}. {user[:10]}... - {wins} wins ({profit:+d} profit)\n"
+                result += f"{i + 1}. {user[:10]}... - {wins} wins ({profit:+d} profit)\n"
         
         return result
     
     @gl.public.view
     def get_game_stats(self) -> dict:
-        """Get comprehensive game statistics"""
-        total_predictions = len(self.prediction_owners)
-        unique_players = len(set(self.prediction_owners.values()))
-        total_in_pool = sum(self.user_balances.values())
-        
-        # Count by status
-        active = won = lost = expired = 0
-        for pred_id in self.prediction_statuses:
-            status = self.prediction_statuses[pred_id]
-            if status == "ACTIVE":
-                active += 1
-            elif status == "WON":
-                won += 1
-            elif status == "LOST":
-                lost += 1
-            elif status == "EXPIRED":
-                expired += 1
-        
+        """Get comprehensive game statistics (constant time)"""
         return {
-            "total_predictions": total_predictions,
-            "active_predictions": active,
-            "won": won,
-            "lost": lost,
-            "expired": expired,
-            "unique_players": unique_players,
-            "total_pool": total_in_pool,
+            "total_predictions": self.next_prediction_id,
+            "active_predictions": self.status_counts.get(STATUS_ACTIVE, 0),
+            "won": self.status_counts.get(STATUS_WON, 0),
+            "lost": self.status_counts.get(STATUS_LOST, 0),
+            "expired": self.status_counts.get(STATUS_EXPIRED, 0),
+            "unique_players": self.unique_player_count,
+            "total_pool": self.total_pool,
+            "total_volume": self.total_volume,
             "transaction_counter": self.transaction_counter
         }
     
+    def join_pool(self, user_address: str):
+        """
+        Add a user's current balance to total_pool the first time they are
+        seen. On upgraded deployments legacy balances predate the counter,
+        so without this a legacy user's first bet would take it below zero.
+        Call before changing the balance.
+        """
+        if user_address not in self.pool_members:
+            self.pool_members[user_address] = True
+            self.total_pool += self.user_balances.get(user_address, 0)
+    
+    def count_status(self, status: u8, delta: int):
+        """Adjust the running count for one status"""
+        self.status_counts[status] = self.status_counts.get(status, 0) + delta
+    
+    # ============================================================
+    # STORAGE MIGRATION
+    # ============================================================
+    
+    @gl.public.write
+    def migrate_legacy_predictions(self, max_count: u256 = 50) -> str:
+        """
+        Move up to max_count predictions from the legacy per-field maps
+        into packed records. Call repeatedly until nothing is left.
+        """
+        self.transaction_counter += 1
+        
+        migrated = 0
+        pred_id = self.legacy_migration_cursor
+        while pred_id < self.next_prediction_id and migrated < max_count:
+            if pred_id in self.prediction_owners and pred_id not in self.predictions:
+                owner = self.prediction_owners[pred_id]
+                status = STATUS_NAMES.index(self.prediction_statuses[pred_id])
+                self.predictions[pred_id] = Prediction(
+                    owner=owner,
+                    symbol_id=self.intern_symbol(self.prediction_symbols[pred_id]),
+                    direction=DIRECTION_NAMES.index(self.prediction_directions[pred_id]),
+                    status=status,
+                    amount=self.prediction_amounts[pred_id],
+                    entry_price=self.prediction_entry_prices[pred_id],
+                    creation_tx=self.prediction_creation_tx[pred_id],
+                    duration_tx=self.prediction_duration_tx[pred_id],
+                )
+                
+                # Rebuild the indexes and totals the legacy layout never had
+                if owner not in self.user_prediction_ids:
+                    self.unique_player_count += 1
+                self.join_pool(owner)
+                self.user_prediction_ids.get_or_insert_default(owner).append(pred_id)
+                self.count_status(status, 1)
+                amount = self.prediction_amounts[pred_id]
+                self.total_volume += amount
+                
+                stats = self.load_user_stats(owner)
+                stats.total += 1
+                stats.active += 1
+                stats.total_wagered += amount
+                if status != STATUS_ACTIVE:
+                    # Legacy records keep no payout; a WON paid the standard multiple
+                    payout = (amount * self.PAYOUT_MULTIPLIER) // 10 if status == STATUS_WON else 0
+                    self.record_settlement(stats, status, payout)
+                    self.queue_for_archive(pred_id)
+                else:
+                    self.user_active_ids.get_or_insert_default(owner)[pred_id] = True
+                    self.schedule_expiry(
+                        pred_id,
+                        self.prediction_creation_tx[pred_id] + self.prediction_duration_tx[pred_id]
+                    )
+                
+                del self.prediction_symbols[pred_id]
+                del self.prediction_directions[pred_id]
+                del self.prediction_amounts[pred_id]
+                del self.prediction_entry_prices[pred_id]
+                del self.prediction_creation_tx[pred_id]
+                del self.prediction_duration_tx[pred_id]
+                del self.prediction_owners[pred_id]
+                del self.prediction_statuses[pred_id]
+                migrated += 1
+            pred_id += 1
+        
+        self.legacy_migration_cursor = pred_id
+        remaining = len(self.prediction_owners)
+        return f"Migrated {migrated} predictions. Legacy records remaining: {remaining}"
+    
+    @gl.public.write
+    def rebuild_leaderboards(self) -> str:
+        """
+        One-off rebuild of the top-K list, rank trees and profit bucket
+        members from the full score maps. Only needed on deployments that
+        predate them.
+        """
+        self.transaction_counter += 1
+        
+        for sort_by in ["wins", "profit"]:
+            tree = self.rank_tree(sort_by)
+            for i in range(len(tree)):
+                tree[i] = 0
+        for bucket in self.profit_bucket_members:
+            members = self.profit_bucket_members[bucket]
+            while len(members) > 0:
+                del self.profit_bucket_pos[members.pop()]
+        
+        for user in self.leaderboard_wins:
+            self.update_top_k(self.top_wins, self.leaderboard_wins, user, LEADERBOARD_SIZE)
+            self.move_rank("wins", None, self.leaderboard_wins[user], user)
+        for user in self.leaderboard_profit:
+            self.move_rank("profit", None, self.leaderboard_profit[user], user)
+        
+        return f"Leaderboards rebuilt: {len(self.top_wins)} by wins, {len(self.leaderboard_profit)} by profit"
+    
     # ============================================================
     # UTILITY FUNCTIONS
     # ============================================================
@@ -3,6 +3,42 @@
 
 from genlayer import *
 import json
+import struct
+
+# Leaderboard rows kept in the bounded top list
+LEADERBOARD_SIZE = 10
+
+# Archived (settled) predictions, one fixed-width entry per prediction:
+# id, symbol, direction (0=UP, 1=DOWN), won, amount, entry_price,
+# created_at, expires_at (unix seconds)
+HISTORY_RECORD_FORMAT = ">Q8sBBQQQQ"
+
+# Observed prices, per symbol: a ring buffer of
+# (mock samples so far << 224) | (cumulative price-seconds << 128) |
+# (unix_seconds << 64) | (mock << 63) | price_cents
+# A sample is marked mock when the live fetch failed and the mock
+# generator was used instead.
+PRICE_HISTORY_SIZE = 256
+# A lookup whose nearest sample is further away than this falls back to mock
+PRICE_HISTORY_MAX_GAP_SECONDS = 300
+# Settlement only uses a sample taken this soon at or after expiry
+PRICE_SETTLEMENT_MAX_LAG_SECONDS = 60
+# Default window for get_twap_price() and for settlement
+TWAP_WINDOW_SECONDS = 60
+# Bounds for set_settlement_twap(): anyone may call it, so it can't shrink
+# settlement down to a single sample or stretch it past the buffer
+MIN_SETTLEMENT_TWAP_SECONDS = 30
+MAX_SETTLEMENT_TWAP_SECONDS = 600
+
+# Price consensus: validators accept the leader's price if it is within
+# this many basis points of their own (plus 1 cent for rounding)
+PRICE_TOLERANCE_BPS = {"BTC": 50, "ETH": 50, "SOL": 100, "DOGE": 200, "ADA": 200}
+DEFAULT_PRICE_TOLERANCE_BPS = 100
+
+# LLM price extraction only sees the fragment around the price, capped at
+# PROMPT_PAYLOAD_MAX_TOKENS (~4 characters per token)
+PROMPT_PAYLOAD_MAX_TOKENS = 64
+PROMPT_PAYLOAD_LEAD_CHARS = 32
 
 class CryptoPredictionGame(gl.Contract):
     """
@@ -14,6 +50,7 @@ class CryptoPredictionGame(gl.Contract):
     # State variables
     user_balances: TreeMap[str, u256]
     leaderboard: TreeMap[str, u256]
+    top_wins: DynArray[str]  # Bounded, sorted by wins (desc)
     
     # Predictions
     prediction_symbols: TreeMap[u256, str]
@@ -25,11 +62,31 @@ class CryptoPredictionGame(gl.Contract):
     prediction_owners: TreeMap[u256, str]
     prediction_statuses: TreeMap[u256, str]
     
+    # Cold storage for settled predictions (append-only, per user)
+    user_history: TreeMap[str, DynArray[bytes]]
+    archive_queue: TreeMap[u256, u256]  # Settled IDs waiting for compact()
+    archive_queue_head: u256
+    archive_queue_tail: u256
+    
+    # Price samples for settlement at expiry (ring buffer per symbol)
+    price_history: TreeMap[str, DynArray[u256]]
+    price_history_start: TreeMap[str, u256]  # Index of the oldest sample once the buffer is full
+    prediction_twap_seconds: TreeMap[u256, u256]  # Settlement TWAP window, fixed at placement
+    settlement_twap_seconds: u256  # TWAP window for new predictions (MIN/MAX_SETTLEMENT_TWAP_SECONDS)
+    
+    # Players seen so far (kept so get_game_stats doesn't scan predictions)
+    known_players: TreeMap[str, bool]
+    player_count: u256
+    
     next_prediction_id: u256
     
     def __init__(self):
         """Initialize"""
         self.next_prediction_id = 0
+        self.player_count = 0
+        self.archive_queue_head = 0
+        self.archive_queue_tail = 0
+        self.settlement_twap_seconds = TWAP_WINDOW_SECONDS
     
     def parse_datetime(self, datetime_str: str) -> dict:
         """
@@ -174,18 +231,298 @@ class CryptoPredictionGame(gl.Contract):
         }
         return symbol_map.get(symbol.upper(), "bitcoin")
     
-    def get_historical_price(self, crypto_symbol: str, timestamp_str: str) -> dict:
+    # ============================================================
+    # PRICE HISTORY (ring buffer + binary search + TWAP accumulator)
+    # ============================================================
+    
+    def record_price_sample(self, crypto_symbol: str, timestamp: u256, price_cents: u256, mock: bool):
+        """
+        Append one price (mock=True if it came from the mock fallback); once
+        full, overwrite the oldest sample
+        Each sample also carries the running sum of price * seconds up to
+        its timestamp and the number of mock samples so far, so TWAPs never
+        need to walk the buffer.
         """
-        Get price at specific timestamp using deterministic mock prices
-        This ensures fair settlement at exact expiry time
+        symbol = crypto_symbol.upper()
+        samples = self.price_history.get_or_insert_default(symbol)
+        size = len(samples)
+        cumulative = 0
+        mock_count = 0
         
-        NOTE: CoinGecko historical API requires authentication (Pro plan)
-        Using mock prices with consistent algorithm ensures:
-        - Same price for same timestamp (deterministic)
-        - Fair settlement at expiry time
-        - No API rate limits or authentication needed
+        if size > 0:
+            start = self.price_history_start.get(symbol, 0)
+            newest = (start + size - 1) % size
+            newest_entry = samples[newest]
+            newest_ts = self.sample_time(newest_entry)
+            cumulative = self.sample_cumulative(newest_entry)
+            mock_count = self.sample_mock_count(newest_entry)
+            if timestamp < newest_ts:
+                return  # Out of order - keep the buffer sorted
+            if timestamp == newest_ts:
+                mock_count -= self.sample_is_mock(newest_entry)
+                samples[newest] = self.pack_sample(mock_count + int(mock), cumulative, timestamp, mock, price_cents)
+                return
+            cumulative += self.sample_price(newest_entry) * (timestamp - newest_ts)
+        
+        entry = self.pack_sample(mock_count + int(mock), cumulative, timestamp, mock, price_cents)
+        if size < PRICE_HISTORY_SIZE:
+            samples.append(entry)
+        else:
+            start = self.price_history_start.get(symbol, 0)
+            samples[start] = entry
+            self.price_history_start[symbol] = (start + 1) % size
+    
+    def pack_sample(self, mock_count: int, cumulative: int, timestamp: u256, mock: bool, price_cents: u256) -> u256:
+        """One ring buffer entry (see PRICE_HISTORY_SIZE)"""
+        return (mock_count << 224) | (cumulative << 128) | (timestamp << 64) | (int(mock) << 63) | price_cents
+    
+    def sample_time(self, entry: u256) -> u256:
+        """Unix seconds of a packed sample"""
+        return (entry >> 64) & ((1 << 64) - 1)
+    
+    def sample_price(self, entry: u256) -> u256:
+        """Price (cents) of a packed sample"""
+        return entry & ((1 << 63) - 1)
+    
+    def sample_is_mock(self, entry: u256) -> int:
+        """1 if a packed sample came from the mock fallback, else 0"""
+        return (entry >> 63) & 1
+    
+    def sample_cumulative(self, entry: u256) -> u256:
+        """Running price * seconds total at a packed sample's timestamp"""
+        return (entry >> 128) & ((1 << 96) - 1)
+    
+    def sample_mock_count(self, entry: u256) -> u256:
+        """Mock samples recorded up to and including a packed sample"""
+        return entry >> 224
+    
+    def sample_source(self, entry: u256) -> str:
+        """Source label for a price read from one sample"""
+        return "history (mock)" if self.sample_is_mock(entry) else "history"
+    
+    def price_sample(self, samples: DynArray[u256], start: u256, i: int) -> u256:
+        """i-th sample in time order (0 = oldest)"""
+        return samples[(start + i) % len(samples)]
+    
+    def first_sample_at_or_after(self, samples: DynArray[u256], start: u256, timestamp: u256) -> int:
+        """Binary search for the first sample (in time order) at or after timestamp"""
+        lo = 0
+        hi = len(samples)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.sample_time(self.price_sample(samples, start, mid)) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    
+    @gl.public.view
+    def get_historical_price(self, crypto_symbol: str, timestamp_str: str, mode: str = "nearest") -> dict:
+        """
+        Get price at a specific timestamp from recorded price samples
+        mode "nearest" returns the closest sample, "interpolate" draws a
+        straight line between the samples either side of the timestamp.
+        
+        Falls back to the deterministic mock price when no sample lies
+        within PRICE_HISTORY_MAX_GAP_SECONDS of the timestamp.
+        """
+        symbol = crypto_symbol.upper()
+        samples = self.price_history.get(symbol, None)
+        if samples is None or len(samples) == 0:
+            return self.get_mock_price(symbol, timestamp_str)
+        
+        target = self.datetime_to_unix_timestamp(timestamp_str)
+        start = self.price_history_start.get(symbol, 0)
+        size = len(samples)
+        lo = self.first_sample_at_or_after(samples, start, target)
+        
+        after = self.price_sample(samples, start, lo) if lo < size else None
+        before = self.price_sample(samples, start, lo - 1) if lo > 0 else None
+        
+        if after is not None and before is not None and mode == "interpolate":
+            t0, p0 = self.sample_time(before), self.sample_price(before)
+            t1, p1 = self.sample_time(after), self.sample_price(after)
+            if t1 - t0 > 2 * PRICE_HISTORY_MAX_GAP_SECONDS:
+                return self.get_mock_price(symbol, timestamp_str)
+            price = p0 + (p1 - p0) * (target - t0) // (t1 - t0)
+            sample_ts = target
+            source = self.sample_source(before if self.sample_is_mock(before) else after)
+        else:
+            # Nearest sample (also used when target is outside the buffer)
+            if after is None or (before is not None and target - self.sample_time(before) <= self.sample_time(after) - target):
+                nearest = before
+            else:
+                nearest = after
+            sample_ts = self.sample_time(nearest)
+            if max(sample_ts, target) - min(sample_ts, target) > PRICE_HISTORY_MAX_GAP_SECONDS:
+                return self.get_mock_price(symbol, timestamp_str)
+            price = self.sample_price(nearest)
+            source = self.sample_source(nearest)
+        
+        return {
+            "symbol": symbol,
+            "price_usd_cents": price,
+            "source": source,
+            "timestamp": timestamp_str,
+            "sample_unix": sample_ts
+        }
+    
+    def get_expiry_price(self, symbol: str, expiry_time: str, created_at: u256) -> dict:
+        """
+        Spot exit price for settlement: the first sample at or after expiry
+        (and after the prediction was placed), at most
+        PRICE_SETTLEMENT_MAX_LAG_SECONDS late. Anything else - including the
+        prediction's own entry sample - falls back to the mock price at expiry.
+        """
+        samples = self.price_history.get(symbol, None)
+        if samples is None or len(samples) == 0:
+            return self.get_mock_price(symbol, expiry_time)
+        
+        target = max(self.datetime_to_unix_timestamp(expiry_time), created_at + 1)
+        start = self.price_history_start.get(symbol, 0)
+        i = self.first_sample_at_or_after(samples, start, target)
+        if i >= len(samples):
+            return self.get_mock_price(symbol, expiry_time)
+        
+        sample = self.price_sample(samples, start, i)
+        if self.sample_time(sample) - target > PRICE_SETTLEMENT_MAX_LAG_SECONDS:
+            return self.get_mock_price(symbol, expiry_time)
+        
+        return {
+            "symbol": symbol,
+            "price_usd_cents": self.sample_price(sample),
+            "source": self.sample_source(sample),
+            "timestamp": expiry_time,
+            "sample_unix": self.sample_time(sample)
+        }
+    
+    def cumulative_price_at(self, symbol: str, timestamp: u256) -> int:
+        """
+        Sum of price * seconds from the first sample up to timestamp
+        The price is held flat after the last sample at or before timestamp.
+        Returns -1 if timestamp is outside the buffer or too far past a sample.
+        """
+        samples = self.price_history.get(symbol, None)
+        if samples is None or len(samples) == 0:
+            return -1
+        
+        start = self.price_history_start.get(symbol, 0)
+        i = self.first_sample_at_or_after(samples, start, timestamp + 1) - 1
+        if i < 0:
+            return -1
+        
+        entry = self.price_sample(samples, start, i)
+        elapsed = timestamp - self.sample_time(entry)
+        if elapsed > PRICE_HISTORY_MAX_GAP_SECONDS:
+            return -1
+        return self.sample_cumulative(entry) + self.sample_price(entry) * elapsed
+    
+    def mock_samples_between(self, symbol: str, begin: u256, end: u256) -> int:
+        """
+        Mock samples whose price is averaged into [begin, end]: the one in
+        force at begin plus those taken after it, up to end
+        """
+        samples = self.price_history[symbol]
+        start = self.price_history_start.get(symbol, 0)
+        at_begin = self.price_sample(samples, start, self.first_sample_at_or_after(samples, start, begin + 1) - 1)
+        at_end = self.price_sample(samples, start, self.first_sample_at_or_after(samples, start, end + 1) - 1)
+        return self.sample_mock_count(at_end) - self.sample_mock_count(at_begin) + self.sample_is_mock(at_begin)
+    
+    def twap_source(self, symbol: str, begin: u256, end: u256) -> str:
+        """Source label for a TWAP, counting any mock samples in it"""
+        mock_samples = self.mock_samples_between(symbol, begin, end)
+        if mock_samples > 0:
+            return f"twap {end - begin}s ({mock_samples} mock samples)"
+        return f"twap {end - begin}s"
+    
+    @gl.public.view
+    def get_twap_price(self, crypto_symbol: str, end_time_str: str, window_seconds: u256 = TWAP_WINDOW_SECONDS) -> dict:
+        """
+        Time-weighted average price over window_seconds ending at end_time_str
+        Two accumulator readings and one division. Falls back to the
+        spot historical price when the window isn't covered by samples.
+        """
+        symbol = crypto_symbol.upper()
+        end = self.datetime_to_unix_timestamp(end_time_str)
+        if window_seconds == 0 or window_seconds > end:
+            return self.get_historical_price(symbol, end_time_str)
+        
+        cumulative_end = self.cumulative_price_at(symbol, end)
+        cumulative_start = self.cumulative_price_at(symbol, end - window_seconds)
+        if cumulative_end < 0 or cumulative_start < 0:
+            return self.get_historical_price(symbol, end_time_str)
+        
+        return {
+            "symbol": symbol,
+            "price_usd_cents": (cumulative_end - cumulative_start) // window_seconds,
+            "source": self.twap_source(symbol, end - window_seconds, end),
+            "timestamp": end_time_str
+        }
+    
+    def get_settlement_price(self, symbol: str, expiry_time: str, created_at: u256, window: u256) -> dict:
+        """
+        Exit price for a prediction: TWAP over its own window (fixed at
+        placement) ending at expiry, else spot at expiry (see get_expiry_price)
+        The window is clipped to start after placement and needs a sample
+        taken after the entry, so it never collapses to the entry price.
+        """
+        if window == 0:
+            return self.get_expiry_price(symbol, expiry_time, created_at)
+        
+        end = self.datetime_to_unix_timestamp(expiry_time)
+        begin = max(end - min(window, end), created_at)
+        samples = self.price_history.get(symbol, None)
+        if end <= begin or samples is None or len(samples) == 0:
+            return self.get_expiry_price(symbol, expiry_time, created_at)
+        
+        oldest = self.price_history_start.get(symbol, 0)
+        i = self.first_sample_at_or_after(samples, oldest, created_at + 1)
+        if i >= len(samples) or self.sample_time(self.price_sample(samples, oldest, i)) > end:
+            return self.get_expiry_price(symbol, expiry_time, created_at)
+        
+        cumulative_end = self.cumulative_price_at(symbol, end)
+        cumulative_begin = self.cumulative_price_at(symbol, begin)
+        if cumulative_end < 0 or cumulative_begin < 0:
+            return self.get_expiry_price(symbol, expiry_time, created_at)
+        
+        return {
+            "symbol": symbol,
+            "price_usd_cents": (cumulative_end - cumulative_begin) // (end - begin),
+            "source": self.twap_source(symbol, begin, end),
+            "timestamp": expiry_time
+        }
+    
+    @gl.public.write
+    def set_settlement_twap(self, window_seconds: u256) -> str:
+        """
+        Settle on a TWAP of window_seconds ending at expiry, within
+        MIN_SETTLEMENT_TWAP_SECONDS..MAX_SETTLEMENT_TWAP_SECONDS
+        Applies to predictions placed from now on; open ones keep their window
         """
-        return self.get_mock_price(crypto_symbol, timestamp_str)
+        if window_seconds < MIN_SETTLEMENT_TWAP_SECONDS or window_seconds > MAX_SETTLEMENT_TWAP_SECONDS:
+            return f"ERROR: Settlement TWAP must be {MIN_SETTLEMENT_TWAP_SECONDS}-{MAX_SETTLEMENT_TWAP_SECONDS} seconds"
+        self.settlement_twap_seconds = window_seconds
+        return f"Settlement uses a {window_seconds}s TWAP ending at expiry"
+    
+    @gl.public.write
+    def update_price(self, crypto_symbol: str) -> str:
+        """
+        Keeper entry point: record the current live price as a history sample
+        Call regularly (e.g. every minute) so expiries have nearby samples.
+        If the live fetch fails the mock price is recorded, marked as mock.
+        """
+        current_time = gl.message_raw["datetime"]
+        price_data = self.get_current_price(crypto_symbol)
+        mock = price_data["source"] != "api"
+        self.record_price_sample(crypto_symbol, self.datetime_to_unix_timestamp(current_time), price_data["price_usd_cents"], mock)
+        
+        price_usd = price_data["price_usd_cents"] / 100.0
+        return f"Recorded {crypto_symbol.upper()}: ${price_usd:.2f} at {current_time} (source: {price_data['source']})"
+    
+    @gl.public.view
+    def get_price_history_size(self, crypto_symbol: str) -> u256:
+        """Number of samples held for a symbol (at most PRICE_HISTORY_SIZE)"""
+        return len(self.price_history.get(crypto_symbol.upper(), []))
     
     def get_mock_price(self, crypto_symbol: str, timestamp_str: str) -> dict:
         """Fallback mock price generator"""
@@ -221,14 +558,132 @@ class CryptoPredictionGame(gl.Contract):
         except:
             return "ERROR: datetime not available"
     
+    def parse_price_cents(self, web_data: str) -> int:
+        """
+        Read integer cents straight from a known price API response
+        Handles CryptoCompare {"USD": 95642.5} and CoinGecko {"bitcoin": {"usd": 95642.5}}
+        Returns -1 for any other shape so the caller can fall back to the LLM
+        """
+        try:
+            data = json.loads(web_data.strip(), parse_float=str, parse_int=str)
+        except ValueError:
+            return -1
+        if not isinstance(data, dict):
+            return -1
+        
+        if "USD" in data:
+            return self.decimal_to_cents(data["USD"])
+        if len(data) == 1:
+            inner = next(iter(data.values()))
+            if isinstance(inner, dict) and "usd" in inner:
+                return self.decimal_to_cents(inner["usd"])
+        return -1
+    
+    def decimal_to_cents(self, value) -> int:
+        """Convert a JSON decimal literal (kept as a string) to integer cents, truncating"""
+        if not isinstance(value, str):
+            return -1
+        whole, _, fraction = value.partition(".")
+        if not whole.isdigit() or (fraction and not fraction.isdigit()):
+            return -1
+        return int(whole) * 100 + int((fraction + "00")[:2])
+    
+    def trim_price_payload(self, web_data: str, keys: list, max_tokens: int = PROMPT_PAYLOAD_MAX_TOKENS) -> str:
+        """
+        Cut a rendered response down to the part around the price before prompting
+        Starts just before the first key found (else at the beginning) and
+        keeps at most max_tokens worth of text, with whitespace collapsed.
+        """
+        text = " ".join(web_data.split())
+        budget = max_tokens * 4
+        for key in keys:
+            i = text.find(key)
+            if i >= 0:
+                start = max(0, i - PROMPT_PAYLOAD_LEAD_CHARS)
+                return text[start:start + budget]
+        return text[:budget]
+    
+    def prices_agree(self, symbol: str, a: int, b: int) -> bool:
+        """Whether two cent prices are within the symbol's tolerance (integer math)"""
+        if a <= 0 or b <= 0:
+            return False
+        bps = PRICE_TOLERANCE_BPS.get(symbol, DEFAULT_PRICE_TOLERANCE_BPS)
+        diff = abs(a - b)
+        return diff <= 1 or diff * 10000 <= bps * max(a, b)
+    
+    def run_price_consensus(self, symbol: str, fetch, key: str = "price_usd_cents") -> dict:
+        """
+        Run fetch() with a numeric equivalence check instead of an LLM comparison
+        Each validator fetches its own price and accepts the leader's result
+        if both succeeded with prices within tolerance (or both failed).
+        """
+        def validator_fn(leaders_res) -> bool:
+            if not isinstance(leaders_res, gl.vm.Return):
+                return False
+            leader = leaders_res.calldata
+            mine = fetch()
+            if not leader.get("success", False) or not mine.get("success", False):
+                return leader.get("success", False) == mine.get("success", False)
+            return self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0)))
+        
+        return gl.vm.run_nondet(fetch, validator_fn)
+    
     @gl.public.view
     def get_current_price(self, crypto_symbol: str) -> dict:
-        """Get current crypto price (uses mock for real-time)"""
+        """
+        Get current crypto price from CryptoCompare (numeric consensus)
+        Falls back to the mock price at the current time if the API fails
+        """
+        crypto_symbol_upper = crypto_symbol.upper()
         try:
             current_time = gl.message_raw["datetime"]
-            return self.get_mock_price(crypto_symbol, current_time)
         except:
-            return self.get_mock_price(crypto_symbol, "2026-01-16T12:00:00Z")
+            current_time = "2026-01-16T12:00:00Z"
+        
+        def fetch_and_extract_price():
+            url = f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol_upper}&tsyms=USD"
+            web_data = gl.nondet.web.render(url, mode="text")
+            # Known JSON shape: parse directly and skip the LLM call
+            cents = self.parse_price_cents(web_data)
+            if cents > 0:
+                return {"price_usd_cents": cents, "success": True}
+            
+            payload = self.trim_price_payload(web_data, ['"USD"', '"usd"'])
+            task = f"""
+Extract USD price from: {payload}
+
+Return JSON only:
+{{"price_usd_cents": <integer>, "success": true}}
+
+Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
+"""
+            
+            result = gl.nondet.exec_prompt(task).replace("```json", "").replace("```", "").strip()
+            parsed = json.loads(result)
+            
+            if "price_usd" in parsed and "price_usd_cents" not in parsed:
+                parsed["price_usd_cents"] = int(float(parsed["price_usd"]) * 100)
+                del parsed["price_usd"]
+            elif "price_usd_cents" in parsed:
+                parsed["price_usd_cents"] = int(parsed["price_usd_cents"])
+            
+            return parsed
+        
+        try:
+            # Numeric consensus: validators accept prices within tolerance
+            price_data = self.run_price_consensus(crypto_symbol_upper, fetch_and_extract_price)
+            
+            if price_data.get("success", False):
+                return {
+                    "symbol": crypto_symbol_upper,
+                    "price_usd_cents": int(price_data["price_usd_cents"]),
+                    "source": "api",
+                    "timestamp": current_time
+                }
+        except Exception as e:
+            print(f"Error fetching price, using fallback: {e}")
+        
+        return self.get_mock_price(crypto_symbol_upper, current_time)
     
     @gl.public.write
     def deposit(self, user_address: str, amount: u256) -> str:
@@ -272,6 +727,9 @@ class CryptoPredictionGame(gl.Contract):
         current_time = gl.message_raw["datetime"]
         expiry_time = self.add_seconds_to_datetime(current_time, duration_seconds)
         
+        # Every entry price is also a history sample
+        self.record_price_sample(crypto_symbol, self.datetime_to_unix_timestamp(current_time), price_data["price_usd_cents"], price_data["source"] != "api")
+        
         self.prediction_symbols[prediction_id] = crypto_symbol.upper()
         self.prediction_directions[prediction_id] = direction.upper()
         self.prediction_amounts[prediction_id] = bet_amount
@@ -280,6 +738,11 @@ class CryptoPredictionGame(gl.Contract):
         self.prediction_expiry_time[prediction_id] = expiry_time
         self.prediction_owners[prediction_id] = user_address
         self.prediction_statuses[prediction_id] = "ACTIVE"
+        self.prediction_twap_seconds[prediction_id] = self.settlement_twap_seconds
+        
+        if user_address not in self.known_players:
+            self.known_players[user_address] = True
+            self.player_count += 1
         
         price_usd = price_data["price_usd_cents"] / 100.0
         
@@ -309,7 +772,9 @@ class CryptoPredictionGame(gl.Contract):
         
         # ⭐ KEY CHANGE: Get price at EXPIRY TIME, not current time
         symbol = self.prediction_symbols[prediction_id]
-        price_data = self.get_historical_price(symbol, expiry_time)
+        created_at = self.datetime_to_unix_timestamp(self.prediction_creation_time[prediction_id])
+        window = self.prediction_twap_seconds.get(prediction_id, 0)
+        price_data = self.get_settlement_price(symbol, expiry_time, created_at, window)
         
         exit_price_cents = price_data["price_usd_cents"]
         entry_price_cents = self.prediction_entry_prices[prediction_id]
@@ -327,6 +792,7 @@ class CryptoPredictionGame(gl.Contract):
             if user_address not in self.leaderboard:
                 self.leaderboard[user_address] = 0
             self.leaderboard[user_address] += 1
+            self.update_top_k(self.top_wins, self.leaderboard, user_address, LEADERBOARD_SIZE)
             
             result = "WON"
         else:
@@ -334,15 +800,21 @@ class CryptoPredictionGame(gl.Contract):
             self.prediction_statuses[prediction_id] = "LOST"
             result = "LOST"
         
+        # Queue for compact() - it moves the record out of the hot maps
+        self.archive_queue[self.archive_queue_tail] = prediction_id
+        self.archive_queue_tail += 1
+        
         entry_usd = entry_price_cents / 100.0
         exit_usd = exit_price_cents / 100.0
         
-        return f"{result}: {symbol} ${entry_usd:.2f} -> ${exit_usd:.2f} (at expiry) | Payout: {payout} | Balance: {self.user_balances[user_address]}"
+        return f"{result}: {symbol} ${entry_usd:.2f} -> ${exit_usd:.2f} (at expiry, {price_data['source']}) | Payout: {payout} | Balance: {self.user_balances[user_address]}"
     
     @gl.public.view
     def get_prediction_details(self, prediction_id: u256) -> str:
         """Get prediction details"""
         if prediction_id not in self.prediction_owners:
+            if prediction_id < self.next_prediction_id:
+                return "ERROR: Archived - see get_user_history"
             return "ERROR: Not found"
         
         symbol = self.prediction_symbols[prediction_id]
@@ -370,9 +842,17 @@ class CryptoPredictionGame(gl.Contract):
         """Get user summary"""
         total = active = won = lost = 0
         
-        # Iterate through all prediction IDs up to next_prediction_id
-        for pred_id in range(self.next_prediction_id):
-            if pred_id in self.prediction_owners and self.prediction_owners[pred_id] == user_address:
+        # Archived predictions are all settled
+        for record in self.user_history.get(user_address, []):
+            total += 1
+            if self.decode_history_record(record)["status"] == "WON":
+                won += 1
+            else:
+                lost += 1
+        
+        # Hot maps only hold open and not-yet-archived predictions
+        for pred_id in self.prediction_owners:
+            if self.prediction_owners[pred_id] == user_address:
                 total += 1
                 status = self.prediction_statuses[pred_id]
                 if status == "ACTIVE":
@@ -397,9 +877,9 @@ class CryptoPredictionGame(gl.Contract):
         except:
             current_time = "unknown"
         
-        # Iterate through all prediction IDs up to next_prediction_id
-        for pred_id in range(self.next_prediction_id):
-            if pred_id in self.prediction_owners and self.prediction_owners[pred_id] == user_address:
+        # Hot maps only hold open and not-yet-archived predictions
+        for pred_id in self.prediction_owners:
+            if self.prediction_owners[pred_id] == user_address:
                 status = self.prediction_statuses[pred_id]
                 if status == "ACTIVE":
                     symbol = self.prediction_symbols[pred_id]
@@ -419,38 +899,137 @@ class CryptoPredictionGame(gl.Contract):
         
         return ";;".join(active_list)
     
+    # ============================================================
+    # ARCHIVE (settled predictions leave the hot maps)
+    # ============================================================
+    
+    def encode_history_record(self, prediction_id: u256) -> bytes:
+        """Pack a settled prediction into a fixed-width history entry"""
+        return struct.pack(
+            HISTORY_RECORD_FORMAT,
+            prediction_id,
+            self.prediction_symbols[prediction_id].encode("ascii")[:8],
+            0 if self.prediction_directions[prediction_id] == "UP" else 1,
+            1 if self.prediction_statuses[prediction_id] == "WON" else 0,
+            self.prediction_amounts[prediction_id],
+            self.prediction_entry_prices[prediction_id],
+            self.datetime_to_unix_timestamp(self.prediction_creation_time[prediction_id]),
+            self.datetime_to_unix_timestamp(self.prediction_expiry_time[prediction_id]),
+        )
+    
+    def decode_history_record(self, record: bytes) -> dict:
+        """Unpack a history entry"""
+        (prediction_id, symbol, direction, won, amount,
+         entry_price, created_at, expires_at) = struct.unpack(HISTORY_RECORD_FORMAT, record)
+        return {
+            "id": prediction_id,
+            "symbol": symbol.rstrip(b"\x00").decode("ascii"),
+            "direction": "UP" if direction == 0 else "DOWN",
+            "status": "WON" if won else "LOST",
+            "amount": amount,
+            "entry_price_usd": entry_price / 100.0,
+            "created_at": created_at,
+            "expires_at": expires_at
+        }
+    
+    @gl.public.write
+    def compact(self, max_count: u256 = 50) -> str:
+        """
+        Move up to max_count settled predictions into their owners'
+        history logs and delete them from the hot maps
+        """
+        archived = 0
+        while self.archive_queue_head < self.archive_queue_tail and archived < max_count:
+            pred_id = self.archive_queue[self.archive_queue_head]
+            del self.archive_queue[self.archive_queue_head]
+            self.archive_queue_head += 1
+            
+            if pred_id not in self.prediction_owners:
+                continue
+            
+            owner = self.prediction_owners[pred_id]
+            self.user_history.get_or_insert_default(owner).append(self.encode_history_record(pred_id))
+            
+            del self.prediction_symbols[pred_id]
+            del self.prediction_directions[pred_id]
+            del self.prediction_amounts[pred_id]
+            del self.prediction_entry_prices[pred_id]
+            del self.prediction_creation_time[pred_id]
+            del self.prediction_expiry_time[pred_id]
+            del self.prediction_owners[pred_id]
+            del self.prediction_statuses[pred_id]
+            if pred_id in self.prediction_twap_seconds:
+                del self.prediction_twap_seconds[pred_id]
+            archived += 1
+        
+        pending = self.archive_queue_tail - self.archive_queue_head
+        return f"Archived {archived} predictions. Waiting: {pending}"
+    
+    @gl.public.view
+    def get_user_history(self, user_address: str) -> str:
+        """Archived predictions for a user, oldest settlement first"""
+        entries = []
+        for record in self.user_history.get(user_address, []):
+            entry = self.decode_history_record(record)
+            entries.append(f"{entry['id']}|{entry['symbol']}|{entry['direction']}|{entry['amount']}|{entry['entry_price_usd']}|{entry['expires_at']}|{entry['status']}")
+        
+        if len(entries) == 0:
+            return "NONE"
+        
+        return ";;".join(entries)
+    
+    # ============================================================
+    # TOP-K LEADERBOARD
+    # ============================================================
+    
+    def update_top_k(self, top: DynArray[str], scores: TreeMap[str, u256], user_address: str, capacity: int):
+        """
+        Re-rank one user inside a bounded, score-descending list - O(K)
+        Players outside the list only get in by beating its last entry
+        """
+        score = scores[user_address]
+        
+        pos = -1
+        for i in range(len(top)):
+            if top[i] == user_address:
+                pos = i
+                break
+        
+        if pos == -1:
+            if len(top) >= capacity and score <= scores[top[len(top) - 1]]:
+                return
+            top.append(user_address)
+            pos = len(top) - 1
+        
+        # Move forward past lower scores...
+        while pos > 0 and scores[top[pos - 1]] < score:
+            top[pos - 1], top[pos] = top[pos], top[pos - 1]
+            pos -= 1
+        # ...or back past higher ones after a score drop
+        while pos < len(top) - 1 and scores[top[pos + 1]] > score:
+            top[pos + 1], top[pos] = top[pos], top[pos + 1]
+            pos += 1
+        
+        if len(top) > capacity:
+            top.pop()
+    
     @gl.public.view
     def get_leaderboard(self) -> str:
         """Get leaderboard"""
-        if len(self.leaderboard) == 0:
+        if len(self.top_wins) == 0:
             return "No winners yet"
         
         result = "Leaderboard:\n"
-        # Convert TreeMap to list for sorting
-        leaders_list = []
-        for user_addr in self.leaderboard:
-            wins = self.leaderboard[user_addr]
-            leaders_list.append((user_addr, wins))
-        
-        # Sort by wins (descending)
-        sorted_leaders = sorted(leaders_list, key=lambda x: x[1], reverse=True)
-        
-        for i, (user, wins) in enumerate(sorted_leaders[:10], 1):
-            result += f"{i}. {user[:10]}... - {wins} wins\n"
+        for i in range(len(self.top_wins)):
+            user = self.top_wins[i]
+            result += f"{i + 1}. {user[:10]}... - {self.leaderboard[user]} wins\n"
         return result
     
     @gl.public.view
     def get_game_stats(self) -> str:
         """Get game stats"""
-        # Count total predictions
         total = self.next_prediction_id
-        
-        # Count unique players
-        players_set = set()
-        for pred_id in range(self.next_prediction_id):
-            if pred_id in self.prediction_owners:
-                players_set.add(self.prediction_owners[pred_id])
-        players = len(players_set)
+        players = self.player_count
         
         try:
             current_time = gl.message_raw["datetime"]
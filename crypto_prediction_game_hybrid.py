@@ -2,7 +2,61 @@
 # { "Depends": "py-genlayer:latest" }
 
 from genlayer import *
+from datetime import datetime
 import json
+import time
+
+
+# Price cache freshness, in wall-clock seconds (per-symbol overrides via set_price_ttl)
+# FRESH:   age <= ttl              -> served from cache
+# STALE:   age <= ttl + stale      -> still served, symbol flagged for keeper refresh
+# EXPIRED: older                   -> live fetch
+# Overrides can only shorten these: cached prices are used as entry prices,
+# so a long window would let old quotes be bet against
+DEFAULT_PRICE_TTL_SECONDS = 60
+DEFAULT_STALE_SECONDS = 240
+MAX_PRICE_TTL_SECONDS = DEFAULT_PRICE_TTL_SECONDS
+MAX_STALE_SECONDS = DEFAULT_STALE_SECONDS
+
+# Symbols refreshed by refresh_all_prices() (see price_keeper.py)
+SUPPORTED_SYMBOLS = ["BTC", "ETH", "SOL", "DOGE", "ADA"]
+
+# Live prices come from CryptoCompare, or CoinGecko (for COINGECKO_IDS) if it
+# is down. A validator that disagrees takes the median of both before rejecting
+COINGECKO_IDS = {"BTC": "bitcoin", "ETH": "ethereum", "SOL": "solana", "DOGE": "dogecoin", "ADA": "cardano"}
+
+# Circuit breaker for the live price source. After BREAKER_FAILURE_THRESHOLD
+# consecutive failures it opens and prices come from the mock generator
+# without trying the API. After BREAKER_COOLDOWN_SECONDS one probe is let through.
+BREAKER_CLOSED = 0
+BREAKER_OPEN = 1
+BREAKER_HALF_OPEN = 2
+BREAKER_STATE_NAMES = ["CLOSED", "OPEN", "HALF_OPEN"]
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_SECONDS = 120
+
+# Price consensus: validators accept the leader's price if it is within
+# this many basis points of their own (plus 1 cent for rounding)
+PRICE_TOLERANCE_BPS = {"BTC": 50, "ETH": 50, "SOL": 100, "DOGE": 200, "ADA": 200}
+DEFAULT_PRICE_TOLERANCE_BPS = 100
+
+# LLM price extraction only sees the fragment around the price, capped at
+# PROMPT_PAYLOAD_MAX_TOKENS (~4 characters per token)
+PROMPT_PAYLOAD_MAX_TOKENS = 64
+PROMPT_PAYLOAD_LEAD_CHARS = 32
+
+# Counters kept by the price instrumentation (see get_price_metrics)
+PRICE_METRIC_NAMES = [
+    "render_calls", "render_ms", "render_bytes", "render_failures", "retries",
+    "prompt_calls", "prompt_ms", "prompt_chars",
+    "consensus_rounds", "consensus_failures", "mock_fallbacks", "breaker_skips",
+]
+
+# Per-call traces for local runs (module state is not kept between
+# transactions on chain, and node-local timings never reach storage)
+PRICE_TRACE = []
+PRICE_TRACE_LIMIT = 500
+
 
 class CryptoPredictionGame(gl.Contract):
     """
@@ -26,75 +80,310 @@ class CryptoPredictionGame(gl.Contract):
     prediction_owners: TreeMap[u256, str]
     prediction_statuses: TreeMap[u256, str]
     
+    # Expiry queue: min-heap of (expiry_tx << 64) | prediction_id
+    expiry_heap: DynArray[u256]
+    
     # Price cache (stores last known prices)
     cached_prices: TreeMap[str, u256]
-    price_timestamps: TreeMap[str, u256]
+    price_timestamps: TreeMap[str, u256]  # Unix seconds from message datetime
+    price_ttl_seconds: TreeMap[str, u256]    # Per-symbol TTL override
+    price_stale_seconds: TreeMap[str, u256]  # Per-symbol stale window override
+    refresh_wanted: TreeMap[str, bool]  # Symbols served stale, waiting for a keeper refresh
+    cache_hits: u256
+    cache_stale_hits: u256
+    cache_misses: u256
+    
+    # Live price circuit breaker (BREAKER_*)
+    breaker_state: u8
+    breaker_failures: u256  # Consecutive failures
+    breaker_total_failures: u256
+    breaker_trips: u256  # Times the breaker opened
+    breaker_opened_at: u256  # Unix seconds
     
     next_prediction_id: u256
     transaction_counter: u256
     price_counter: u256
     
+    # Price instrumentation counters (PRICE_METRIC_NAMES -> total)
+    price_metrics: TreeMap[str, u256]
+    
     def __init__(self):
         """Initialize"""
         self.next_prediction_id = 0
         self.transaction_counter = 0
         self.price_counter = 0
+        self.cache_hits = 0
+        self.cache_stale_hits = 0
+        self.cache_misses = 0
+        self.breaker_state = BREAKER_CLOSED
+        self.breaker_failures = 0
+        self.breaker_total_failures = 0
+        self.breaker_trips = 0
+        self.breaker_opened_at = 0
+    
+    def price_sources(self, crypto_symbol: str) -> list:
+        """(name, url) pairs queried for a live price, in order"""
+        sources = [("cryptocompare", f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol}&tsyms=USD")]
+        if crypto_symbol in COINGECKO_IDS:
+            sources.append(("coingecko", f"https://api.coingecko.com/api/v3/simple/price?ids={COINGECKO_IDS[crypto_symbol]}&vs_currencies=usd"))
+        return sources
+    
+    def median_cents(self, values: list) -> int:
+        """Median of integer prices (lower-biased mean of the middle two for even counts)"""
+        ordered = sorted(values)
+        mid = len(ordered) // 2
+        if len(ordered) % 2 == 1:
+            return ordered[mid]
+        return (ordered[mid - 1] + ordered[mid]) // 2
+    
+    def parse_price_cents(self, web_data: str) -> int:
+        """
+        Read integer cents straight from a known price API response
+        Handles CryptoCompare {"USD": 95642.5} and CoinGecko {"bitcoin": {"usd": 95642.5}}
+        Returns -1 for any other shape so the caller can fall back to the LLM
+        """
+        try:
+            data = json.loads(web_data.strip(), parse_float=str, parse_int=str)
+        except ValueError:
+            return -1
+        if not isinstance(data, dict):
+            return -1
+        
+        if "USD" in data:
+            return self.decimal_to_cents(data["USD"])
+        if len(data) == 1:
+            inner = next(iter(data.values()))
+            if isinstance(inner, dict) and "usd" in inner:
+                return self.decimal_to_cents(inner["usd"])
+        return -1
+    
+    def decimal_to_cents(self, value) -> int:
+        """Convert a JSON decimal literal (kept as a string) to integer cents, truncating"""
+        if not isinstance(value, str):
+            return -1
+        whole, _, fraction = value.partition(".")
+        if not whole.isdigit() or (fraction and not fraction.isdigit()):
+            return -1
+        return int(whole) * 100 + int((fraction + "00")[:2])
+    
+    def trim_price_payload(self, web_data: str, keys: list, max_tokens: int = PROMPT_PAYLOAD_MAX_TOKENS) -> str:
+        """
+        Cut a rendered response down to the part around the price before prompting
+        Starts just before the first key found (else at the beginning) and
+        keeps at most max_tokens worth of text, with whitespace collapsed.
+        """
+        text = " ".join(web_data.split())
+        budget = max_tokens * 4
+        for key in keys:
+            i = text.find(key)
+            if i >= 0:
+                start = max(0, i - PROMPT_PAYLOAD_LEAD_CHARS)
+                return text[start:start + budget]
+        return text[:budget]
+    
+    def prices_agree(self, symbol: str, a: int, b: int) -> bool:
+        """Whether two cent prices are within the symbol's tolerance (integer math)"""
+        if a <= 0 or b <= 0:
+            return False
+        bps = PRICE_TOLERANCE_BPS.get(symbol, DEFAULT_PRICE_TOLERANCE_BPS)
+        diff = abs(a - b)
+        return diff <= 1 or diff * 10000 <= bps * max(a, b)
+    
+    def run_price_consensus(self, symbol: str, fetch, key: str = "price_usd_cents") -> dict:
+        """
+        Run fetch() with a numeric equivalence check instead of an LLM comparison
+        Each validator fetches its own price and accepts the leader's result
+        if both succeeded with prices within tolerance (or both failed).
+        fetch() stops at the first source that answers, so a fetch costs one
+        render; only a validator that disagrees asks every source, via
+        fetch(True), before rejecting.
+        """
+        def validator_fn(leaders_res) -> bool:
+            if not isinstance(leaders_res, gl.vm.Return):
+                return False
+            leader = leaders_res.calldata
+            mine = fetch()
+            if not leader.get("success", False) or not mine.get("success", False):
+                return leader.get("success", False) == mine.get("success", False)
+            if self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0))):
+                return True
+            mine = fetch(True)
+            return mine.get("success", False) and self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0)))
+        
+        return self.timed_consensus(lambda: gl.vm.run_nondet(fetch, validator_fn))
     
     @gl.public.view
     def get_current_price(self, crypto_symbol: str) -> dict:
         """
         Get current crypto price - tries real API first
         This is a VIEW function so it's fast and doesn't need consensus
+        Skips the API while the circuit breaker is open
         """
-        crypto_symbol_upper = crypto_symbol.upper()
+        return self.fetch_price(crypto_symbol.upper(), False)
+    
+    def fetch_price(self, crypto_symbol: str, track: bool) -> dict:
+        """
+        Live price with mock fallback, guarded by the circuit breaker
+        Write paths pass track=True so the outcome moves the breaker and
+        the price metrics; views only read them.
+        """
+        if not self.breaker_allows_live(track):
+            if track:
+                self.record_price_metrics({"breaker_skips": 1, "mock_fallbacks": 1})
+            return self.get_mock_price(crypto_symbol)
         
         # Try real API
         try:
-            def fetch_and_extract_price():
-                url = f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol_upper}&tsyms=USD"
-                web_data = gl.nondet.web.render(url, mode="text")
+            price_data = self.fetch_real_price(crypto_symbol)
+        except Exception as e:
+            print(f"API fetch failed: {e}")
+            if track:
+                self.record_breaker_result(False)
+                self.record_price_metrics({"consensus_rounds": 1, "consensus_failures": 1, "mock_fallbacks": 1})
+            return self.get_mock_price(crypto_symbol)
+        
+        metrics = price_data.pop("metrics", {})
+        if track:
+            self.record_breaker_result(True)
+            metrics["consensus_rounds"] = 1
+            self.record_price_metrics(metrics)
+        return price_data
+    
+    def fetch_real_price(self, crypto_symbol: str) -> dict:
+        """Fetch real price: CryptoCompare, else CoinGecko (raises on failure)"""
+        def fetch_and_extract_price(all_sources: bool = False):
+            metrics = {}
+            quotes = {}
+            web_data = ""
+            for name, url in self.price_sources(crypto_symbol):
+                if metrics.get("render_calls", 0) > len(quotes):
+                    metrics["retries"] = metrics.get("retries", 0) + 1
+                try:
+                    response = self.timed_render(url, metrics)
+                except Exception as e:
+                    continue  # Source down - try the next one
+                if web_data == "":
+                    web_data = response
                 
-                task = f"""
-Extract USD price from: {web_data}
+                # Known JSON shape: parse directly and skip the LLM call
+                cents = self.parse_price_cents(response)
+                if cents > 0:
+                    quotes[name] = cents
+                    if not all_sources:
+                        break  # One quote is enough unless a validator disagrees
+            
+            if len(quotes) > 0:
+                return {"price_usd_cents": self.median_cents(list(quotes.values())), "success": True, "sources": sorted(quotes), "metrics": metrics}
+            if web_data == "":
+                return {"success": False, "metrics": metrics}
+            
+            payload = self.trim_price_payload(web_data, ['"USD"', '"usd"'])
+            task = f"""
+Extract USD price from: {payload}
 
 Return JSON only:
 {{"price_usd_cents": <integer>, "success": true}}
 
 Convert to cents (multiply by 100).
 """
-                
-                result = gl.nondet.exec_prompt(task).replace("```json", "").replace("```", "").strip()
-                parsed = json.loads(result)
-                
-                if "price_usd" in parsed and "price_usd_cents" not in parsed:
-                    parsed["price_usd_cents"] = int(float(parsed["price_usd"]) * 100)
-                    del parsed["price_usd"]
-                elif "price_usd_cents" in parsed:
-                    parsed["price_usd_cents"] = int(parsed["price_usd_cents"])
-                
-                return parsed
             
-            def get_price_json():
-                return json.dumps(fetch_and_extract_price())
+            result = self.timed_prompt(task, metrics).replace("```json", "").replace("```", "").strip()
+            parsed = json.loads(result)
             
-            price_json = gl.eq_principle.prompt_comparative(
-                get_price_json,
-                "Price values should be within 1% of each other"
-            )
-            price_data = json.loads(price_json)
+            if "price_usd" in parsed and "price_usd_cents" not in parsed:
+                parsed["price_usd_cents"] = int(float(parsed["price_usd"]) * 100)
+                del parsed["price_usd"]
+            elif "price_usd_cents" in parsed:
+                parsed["price_usd_cents"] = int(parsed["price_usd_cents"])
             
-            if price_data.get("success", False):
-                price_cents = int(price_data["price_usd_cents"])
-                
-                return {
-                    "symbol": crypto_symbol_upper,
-                    "price_usd_cents": price_cents,
-                    "source": "api"
-                }
-        except Exception as e:
-            print(f"API fetch failed: {e}")
+            parsed["metrics"] = metrics
+            return parsed
         
-        # Fallback to mock
+        # Numeric consensus: validators accept prices within tolerance
+        price_data = self.run_price_consensus(crypto_symbol, fetch_and_extract_price)
+        
+        if not price_data.get("success", False):
+            raise Exception("API returned failure")
+        
+        return {
+            "symbol": crypto_symbol,
+            "price_usd_cents": int(price_data["price_usd_cents"]),
+            "source": "api",
+            "sources": price_data.get("sources", ["llm"]),
+            "metrics": price_data.get("metrics", {})
+        }
+    
+    def run_price_vector_consensus(self, fetch) -> dict:
+        """
+        run_price_consensus for {"prices": {symbol: cents}, ...} payloads:
+        same symbols, each within tolerance
+        """
+        def validator_fn(leaders_res) -> bool:
+            if not isinstance(leaders_res, gl.vm.Return):
+                return False
+            leader = leaders_res.calldata["prices"]
+            mine = fetch()["prices"]
+            if set(leader) != set(mine):
+                return False
+            return all(self.prices_agree(symbol, int(leader[symbol]), int(mine[symbol])) for symbol in mine)
+        
+        return self.timed_consensus(lambda: gl.vm.run_nondet(fetch, validator_fn))
+    
+    def fetch_real_prices(self, symbols: list) -> dict:
+        """
+        Fetch a price vector from CryptoCompare pricemulti
+        Returns {"prices": {symbol: cents}, "metrics": {...}}
+        """
+        def fetch_and_extract_prices():
+            metrics = {}
+            url = f"https://min-api.cryptocompare.com/data/pricemulti?fsyms={','.join(symbols)}&tsyms=USD"
+            web_data = self.timed_render(url, metrics)
+            # Known JSON shape: parse directly and skip the LLM call
+            prices = self.parse_price_vector(web_data, symbols)
+            if len(prices) > 0:
+                return {"prices": prices, "metrics": metrics}
+            
+            payload = self.trim_price_payload(web_data, [f'"{symbols[0]}"'], PROMPT_PAYLOAD_MAX_TOKENS * len(symbols))
+            task = f"""
+Extract the USD price of each symbol from this API response: {payload}
+
+Return ONLY valid JSON mapping symbol to price in cents (integer), e.g.
+{{"BTC": 9564250, "ETH": 350012}}
+Leave out any symbol whose price is missing.
+"""
+            
+            result = self.timed_prompt(task, metrics).replace("```json", "").replace("```", "").strip()
+            parsed = json.loads(result)
+            return {
+                "prices": {symbol: int(parsed[symbol]) for symbol in symbols if symbol in parsed},
+                "metrics": metrics
+            }
+        
+        return self.run_price_vector_consensus(fetch_and_extract_prices)
+    
+    def parse_price_vector(self, web_data: str, symbols: list) -> dict:
+        """
+        Read {"BTC": {"USD": 95642.5}, ...} (pricemulti) into {symbol: cents}
+        Symbols that are absent or malformed are left out
+        """
+        try:
+            data = json.loads(web_data.strip(), parse_float=str, parse_int=str)
+        except ValueError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        
+        prices = {}
+        for symbol in symbols:
+            entry = data.get(symbol)
+            if isinstance(entry, dict) and "USD" in entry:
+                cents = self.decimal_to_cents(entry["USD"])
+                if cents > 0:
+                    prices[symbol] = cents
+        return prices
+    
+    def get_mock_price(self, crypto_symbol: str) -> dict:
+        """Mock price with variation (fallback)"""
         base_prices = {
             "BTC": 9500000,
             "ETH": 350000,
@@ -103,56 +392,283 @@ Convert to cents (multiply by 100).
             "ADA": 95,
         }
         
-        base = base_prices.get(crypto_symbol_upper, 100000)
+        base = base_prices.get(crypto_symbol, 100000)
         variation = ((self.price_counter * 7919) % 200) - 100
         price = base + (base * variation // 1000)
         
         return {
-            "symbol": crypto_symbol_upper,
+            "symbol": crypto_symbol,
             "price_usd_cents": price,
             "source": "mock"
         }
     
+    # ============================================================
+    # PRICE INSTRUMENTATION
+    # ============================================================
+    
+    def timed_render(self, url: str, metrics: dict) -> str:
+        """gl.nondet.web.render, counting calls, time, bytes and failures into metrics"""
+        started = time.monotonic()
+        try:
+            response = gl.nondet.web.render(url, mode="text")
+        except Exception as e:
+            self.count_price_call(metrics, "render", started, 0, True)
+            raise
+        self.count_price_call(metrics, "render", started, len(response), False)
+        return response
+    
+    def timed_prompt(self, task: str, metrics: dict) -> str:
+        """gl.nondet.exec_prompt, counting calls, time and prompt size into metrics"""
+        started = time.monotonic()
+        result = gl.nondet.exec_prompt(task)
+        self.count_price_call(metrics, "prompt", started, len(task), False)
+        return result
+    
+    def timed_consensus(self, run) -> dict:
+        """
+        Run one consensus call, tracing its duration locally only
+        (each node measures a different time, so it cannot be stored)
+        """
+        started = time.monotonic()
+        failed = True
+        try:
+            result = run()
+            failed = False
+            return result
+        finally:
+            self.trace_price_call("consensus", int((time.monotonic() - started) * 1000), 0, failed)
+    
+    def count_price_call(self, metrics: dict, kind: str, started: float, size: int, failed: bool):
+        """Add one render/prompt call to a nondet metrics dict and to the local trace"""
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        size_key = "render_bytes" if kind == "render" else "prompt_chars"
+        metrics[f"{kind}_calls"] = metrics.get(f"{kind}_calls", 0) + 1
+        metrics[f"{kind}_ms"] = metrics.get(f"{kind}_ms", 0) + elapsed_ms
+        metrics[size_key] = metrics.get(size_key, 0) + size
+        if failed:
+            metrics[f"{kind}_failures"] = metrics.get(f"{kind}_failures", 0) + 1
+        self.trace_price_call(kind, elapsed_ms, size, failed)
+    
+    def trace_price_call(self, kind: str, elapsed_ms: int, size: int, failed: bool):
+        """Append to PRICE_TRACE, dropping the oldest entry once full"""
+        if len(PRICE_TRACE) >= PRICE_TRACE_LIMIT:
+            del PRICE_TRACE[0]
+        PRICE_TRACE.append({"kind": kind, "ms": elapsed_ms, "size": size, "failed": failed})
+    
+    def record_price_metrics(self, metrics: dict):
+        """Add the leader's agreed metrics to the stored counters (write paths only)"""
+        for name, value in metrics.items():
+            if name in PRICE_METRIC_NAMES:
+                self.price_metrics[name] = self.price_metrics.get(name, 0) + int(value)
+    
+    @gl.public.view
+    def get_price_metrics(self) -> dict:
+        """Aggregated price-path counters, with average render/prompt latency"""
+        result = {name: self.price_metrics.get(name, 0) for name in PRICE_METRIC_NAMES}
+        for kind in ["render", "prompt"]:
+            calls = result[f"{kind}_calls"]
+            result[f"{kind}_avg_ms"] = result[f"{kind}_ms"] // calls if calls > 0 else 0
+        return result
+    
+    # ============================================================
+    # CIRCUIT BREAKER (skip the live source while it is failing)
+    # ============================================================
+    
+    def breaker_allows_live(self, track_breaker: bool) -> bool:
+        """Whether to try the live API now. An OPEN breaker past its cooldown half-opens"""
+        if self.breaker_state != BREAKER_OPEN:
+            return True
+        if self.current_time_seconds() - self.breaker_opened_at < BREAKER_COOLDOWN_SECONDS:
+            return False
+        
+        # Cooldown over - let one probe through
+        if track_breaker:
+            self.breaker_state = BREAKER_HALF_OPEN
+        return True
+    
+    def record_breaker_result(self, ok: bool):
+        """Feed one live fetch outcome into the breaker"""
+        if ok:
+            self.breaker_state = BREAKER_CLOSED
+            self.breaker_failures = 0
+            return
+        
+        self.breaker_failures += 1
+        self.breaker_total_failures += 1
+        if self.breaker_state == BREAKER_HALF_OPEN or self.breaker_failures >= BREAKER_FAILURE_THRESHOLD:
+            # Failed probe, or too many failures in a row - (re)open
+            if self.breaker_state != BREAKER_OPEN:
+                self.breaker_trips += 1
+            self.breaker_state = BREAKER_OPEN
+            self.breaker_opened_at = self.current_time_seconds()
+    
+    @gl.public.view
+    def get_breaker_state(self) -> dict:
+        """Circuit breaker state and failure counts"""
+        probe_in = 0
+        if self.breaker_state == BREAKER_OPEN:
+            probe_in = max(0, BREAKER_COOLDOWN_SECONDS - (self.current_time_seconds() - self.breaker_opened_at))
+        return {
+            "state": BREAKER_STATE_NAMES[self.breaker_state],
+            "consecutive_failures": self.breaker_failures,
+            "total_failures": self.breaker_total_failures,
+            "trips": self.breaker_trips,
+            "opened_at": self.breaker_opened_at,
+            "probe_in_seconds": probe_in
+        }
+    
+    # ============================================================
+    # PRICE CACHE (wall-clock TTL + stale-while-revalidate)
+    # ============================================================
+    
+    def current_time_seconds(self) -> u256:
+        """Unix seconds from the transaction's message datetime"""
+        return int(datetime.fromisoformat(gl.message_raw["datetime"].replace("Z", "+00:00")).timestamp())
+    
+    def cache_state(self, symbol: str, now: u256) -> str:
+        """FRESH, STALE, EXPIRED or MISSING for one cached symbol"""
+        if symbol not in self.cached_prices:
+            return "MISSING"
+        
+        age = now - min(now, self.price_timestamps.get(symbol, 0))
+        ttl = self.price_ttl(symbol)
+        if age <= ttl:
+            return "FRESH"
+        if age <= ttl + min(self.price_stale_seconds.get(symbol, DEFAULT_STALE_SECONDS), MAX_STALE_SECONDS):
+            return "STALE"
+        return "EXPIRED"
+    
+    def price_ttl(self, symbol: str) -> u256:
+        """A symbol's TTL, capped at MAX_PRICE_TTL_SECONDS"""
+        return min(self.price_ttl_seconds.get(symbol, DEFAULT_PRICE_TTL_SECONDS), MAX_PRICE_TTL_SECONDS)
+    
+    def store_cached_price(self, symbol: str, price_cents: u256):
+        """Write a fetched price into the cache and clear any pending refresh"""
+        self.cached_prices[symbol] = price_cents
+        self.price_timestamps[symbol] = self.current_time_seconds()
+        if symbol in self.refresh_wanted:
+            del self.refresh_wanted[symbol]
+    
     @gl.public.write
     def update_price_cache(self, crypto_symbol: str) -> str:
         """
         Manually update the price cache with real API data
-        Call this periodically to refresh prices
+        Keepers call this for symbols listed by get_stale_symbols()
         """
         self.transaction_counter += 1
         
-        price_data = self.get_current_price(crypto_symbol)
         symbol = crypto_symbol.upper()
+        price_data = self.fetch_price(symbol, True)
         
-        self.cached_prices[symbol] = price_data["price_usd_cents"]
-        self.price_timestamps[symbol] = self.transaction_counter
+        if price_data.get("source") != "api":
+            return f"ERROR: API unavailable, {symbol} cache left unchanged"
+        
+        self.store_cached_price(symbol, price_data["price_usd_cents"])
         
         price_usd = price_data["price_usd_cents"] / 100.0
         return f"Updated {symbol}: ${price_usd:.2f} (source: {price_data.get('source', 'unknown')})"
     
+    @gl.public.write
+    def refresh_all_prices(self, symbols: list = []) -> str:
+        """
+        Refresh the cache for every supported symbol (or just `symbols`)
+        with one batched fetch and one consensus round. Run by price_keeper.py,
+        which passes only the symbols that are no longer fresh.
+        """
+        self.transaction_counter += 1
+        
+        targets = []
+        for symbol in symbols or SUPPORTED_SYMBOLS:
+            if symbol.upper() not in targets:
+                targets.append(symbol.upper())
+        
+        if not self.breaker_allows_live(True):
+            self.record_price_metrics({"breaker_skips": 1})
+            return "ERROR: API unavailable (circuit breaker open), cache left unchanged"
+        
+        metrics = {"consensus_rounds": 1}
+        try:
+            fetched = self.fetch_real_prices(targets)
+            prices = fetched["prices"]
+            metrics.update(fetched.get("metrics", {}))
+        except Exception as e:
+            print(f"Batched API fetch failed: {e}")
+            metrics["consensus_failures"] = 1
+            prices = {}
+        self.record_price_metrics(metrics)
+        
+        if len(prices) == 0:
+            self.record_breaker_result(False)
+            return "ERROR: API unavailable, cache left unchanged"
+        self.record_breaker_result(True)
+        
+        refreshed = []
+        for symbol in targets:
+            if prices.get(symbol, 0) > 0:
+                self.store_cached_price(symbol, prices[symbol])
+                refreshed.append(symbol)
+        
+        missing = [symbol for symbol in targets if symbol not in refreshed]
+        result = f"Refreshed {len(refreshed)}/{len(targets)}: {', '.join(refreshed)}"
+        if len(missing) > 0:
+            result += f" (no price for {', '.join(missing)})"
+        return result
+    
+    @gl.public.write
+    def set_price_ttl(self, crypto_symbol: str, ttl_seconds: u256, stale_seconds: u256) -> str:
+        """
+        Set how long a symbol's cached price is fresh, and how long after that it stays usable
+        Both are capped (MAX_PRICE_TTL_SECONDS / MAX_STALE_SECONDS)
+        """
+        symbol = crypto_symbol.upper()
+        ttl_seconds = min(ttl_seconds, MAX_PRICE_TTL_SECONDS)
+        stale_seconds = min(stale_seconds, MAX_STALE_SECONDS)
+        self.price_ttl_seconds[symbol] = ttl_seconds
+        self.price_stale_seconds[symbol] = stale_seconds
+        return f"{symbol}: fresh for {ttl_seconds}s, usable while stale for {stale_seconds}s more"
+    
     def get_price_for_gameplay(self, crypto_symbol: str) -> dict:
         """
         Internal: Get price for gameplay (uses cache if available)
-        Avoids consensus delays during active gameplay
+        Fresh and stale entries are served without a fetch (stale ones are
+        flagged for refresh); only a missing or expired entry fetches live.
         """
         symbol = crypto_symbol.upper()
-        
-        # Check if we have a cached price
-        if symbol in self.cached_prices:
-            cached_price = self.cached_prices[symbol]
-            cached_at = self.price_timestamps.get(symbol, 0)
-            age = self.transaction_counter - cached_at
-            
-            # Use cached price if it's recent (within 100 transactions)
-            if age < 100:
-                return {
-                    "symbol": symbol,
-                    "price_usd_cents": cached_price,
-                    "source": f"cache (age: {age} tx)"
-                }
+        now = self.current_time_seconds()
+        state = self.cache_state(symbol, now)
+        
+        if state == "FRESH" or state == "STALE":
+            age = now - min(now, self.price_timestamps[symbol])
+            if state == "FRESH":
+                self.cache_hits += 1
+            else:
+                self.cache_stale_hits += 1
+                self.refresh_wanted[symbol] = True
+            return {
+                "symbol": symbol,
+                "price_usd_cents": self.cached_prices[symbol],
+                "source": f"cache ({state.lower()}, age: {age}s)"
+            }
         
         # No cache or too old, use current price
-        return self.get_current_price(symbol)
+        self.cache_misses += 1
+        price_data = self.fetch_price(symbol, True)
+        if price_data.get("source") == "api":
+            self.store_cached_price(symbol, price_data["price_usd_cents"])
+        return price_data
+    
+    def get_price_for_settlement(self, crypto_symbol: str) -> dict:
+        """
+        Internal: Get the exit price for settlement (always fetches live)
+        Expiry is counted in transactions, so no cached price is known to be
+        from after it - a cache hit could be the very price the entry used.
+        The fetched price is written through to the cache.
+        """
+        symbol = crypto_symbol.upper()
+        price_data = self.fetch_price(symbol, True)
+        if price_data.get("source") == "api":
+            self.store_cached_price(symbol, price_data["price_usd_cents"])
+        return price_data
     
     @gl.public.write
     def deposit(self, user_address: str, amount: u256) -> str:
@@ -209,9 +725,8 @@ Convert to cents (multiply by 100).
         self.prediction_owners[prediction_id] = user_address
         self.prediction_statuses[prediction_id] = "ACTIVE"
         
-        # Also update cache for next time
-        self.cached_prices[crypto_symbol.upper()] = price_data["price_usd_cents"]
-        self.price_timestamps[crypto_symbol.upper()] = self.transaction_counter
+        # Queue for keeper settlement
+        self.schedule_expiry(prediction_id, self.transaction_counter + duration_tx)
         
         price_usd = price_data["price_usd_cents"] / 100.0
         
@@ -239,9 +754,9 @@ Convert to cents (multiply by 100).
         if tx_passed < duration_tx:
             return f"ERROR: Too early. Need {duration_tx - tx_passed} more tx"
         
-        # Use cached price for settlement (also fast)
+        # Live price for settlement - the cache may still hold the entry price
         symbol = self.prediction_symbols[prediction_id]
-        price_data = self.get_price_for_gameplay(symbol)
+        price_data = self.get_price_for_settlement(symbol)
         
         exit_price_cents = price_data["price_usd_cents"]
         entry_price_cents = self.prediction_entry_prices[prediction_id]
@@ -331,6 +846,95 @@ Convert to cents (multiply by 100).
         """Get game stats"""
         return f"Predictions: {len(self.prediction_owners)} | Players: {len(set(self.prediction_owners.values()))} | TX: {self.transaction_counter}"
     
+    # ============================================================
+    # EXPIRY QUEUE & KEEPER SETTLEMENT
+    # ============================================================
+    
+    def schedule_expiry(self, prediction_id: u256, expiry_tx: u256):
+        """Push a prediction onto the expiry heap (sift up)"""
+        heap = self.expiry_heap
+        heap.append((expiry_tx << 64) | prediction_id)
+        i = len(heap) - 1
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[parent] <= heap[i]:
+                break
+            heap[parent], heap[i] = heap[i], heap[parent]
+            i = parent
+    
+    def pop_expiry(self) -> u256:
+        """Pop the entry with the earliest expiry (sift down)"""
+        heap = self.expiry_heap
+        top = heap[0]
+        last = heap.pop()
+        size = len(heap)
+        if size > 0:
+            heap[0] = last
+            i = 0
+            while True:
+                smallest = i
+                left = 2 * i + 1
+                right = left + 1
+                if left < size and heap[left] < heap[smallest]:
+                    smallest = left
+                if right < size and heap[right] < heap[smallest]:
+                    smallest = right
+                if smallest == i:
+                    break
+                heap[i], heap[smallest] = heap[smallest], heap[i]
+                i = smallest
+        return top
+    
+    @gl.public.write
+    def settle_due(self, max_count: u256 = 10) -> str:
+        """
+        Keeper entry point: settle due predictions for ALL users
+        Only pops predictions whose expiry has passed by the start of the call,
+        up to max_count heap entries (already-settled entries count too)
+        """
+        self.transaction_counter += 1
+        
+        now = self.transaction_counter  # settle_prediction advances the counter; don't chase it
+        popped = 0
+        settled_count = 0
+        results = []
+        retry = []
+        
+        while len(self.expiry_heap) > 0 and popped < max_count:
+            entry = self.expiry_heap[0]
+            if (entry >> 64) > now:
+                break
+            
+            self.pop_expiry()
+            popped += 1
+            pred_id = entry & ((1 << 64) - 1)
+            
+            # Skip predictions already settled by their owner
+            if self.prediction_statuses[pred_id] != "ACTIVE":
+                continue
+            
+            result = self.settle_prediction(self.prediction_owners[pred_id], pred_id)
+            if self.prediction_statuses[pred_id] == "ACTIVE":
+                # Settlement failed (e.g. price fetch) - keep it queued
+                retry.append(entry)
+                continue
+            
+            settled_count += 1
+            results.append(f"#{pred_id}: {result[:30]}...")
+        
+        for entry in retry:
+            self.schedule_expiry(entry & ((1 << 64) - 1), entry >> 64)
+        
+        if settled_count == 0:
+            return "No predictions due"
+        
+        return f"✅ Settled {settled_count} due predictions:\n" + "\n".join(results)
+    
+    @gl.public.view
+    def get_pending_expiries(self) -> u256:
+        """Number of queued expiry entries (may include already-settled ones)"""
+        return len(self.expiry_heap)
+    
     @gl.public.write
     def advance_time(self) -> str:
         """Advance time"""
@@ -349,9 +953,50 @@ Convert to cents (multiply by 100).
         if symbol not in self.cached_prices:
             return f"{symbol}: Not cached yet"
         
+        now = self.current_time_seconds()
         price_cents = self.cached_prices[symbol]
-        cached_at = self.price_timestamps.get(symbol, 0)
-        age = self.transaction_counter - cached_at
+        age = now - min(now, self.price_timestamps.get(symbol, 0))
         price_usd = price_cents / 100.0
         
-        return f"{symbol}: ${price_usd:.2f} (cached {age} tx ago)"
+        return f"{symbol}: ${price_usd:.2f} (cached {age}s ago, {self.cache_state(symbol, now)})"
+    
+    @gl.public.view
+    def get_stale_symbols(self) -> list:
+        """Symbols served stale since their last refresh - the keeper's work list"""
+        return list(self.refresh_wanted)
+    
+    @gl.public.view
+    def get_cache_states(self) -> dict:
+        """
+        {symbol: {state, age, ttl}} for supported and cached symbols
+        price_keeper.py reads this to decide what refresh_all_prices() should cover
+        """
+        now = self.current_time_seconds()
+        symbols = list(SUPPORTED_SYMBOLS)
+        for symbol in self.cached_prices:
+            if symbol not in symbols:
+                symbols.append(symbol)
+        
+        states = {}
+        for symbol in symbols:
+            age = 0
+            if symbol in self.cached_prices:
+                age = now - min(now, self.price_timestamps.get(symbol, 0))
+            states[symbol] = {
+                "state": self.cache_state(symbol, now),
+                "age": age,
+                "ttl": self.price_ttl(symbol)
+            }
+        return states
+    
+    @gl.public.view
+    def get_cache_stats(self) -> dict:
+        """Cache hit/miss counters"""
+        lookups = self.cache_hits + self.cache_stale_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "stale_hits": self.cache_stale_hits,
+            "misses": self.cache_misses,
+            "hit_rate_pct": ((self.cache_hits + self.cache_stale_hits) * 100 // lookups) if lookups > 0 else 0,
+            "pending_refresh": len(self.refresh_wanted)
+        }
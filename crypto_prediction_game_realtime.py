@@ -4,6 +4,34 @@
 from genlayer import *
 import json
 
+# Leaderboard rows kept in the bounded top list
+LEADERBOARD_SIZE = 10
+
+# Observed prices, per symbol: a ring buffer of
+# (mock samples so far << 224) | (cumulative price-seconds << 128) |
+# (seconds << 64) | (mock << 63) | price_cents
+# A sample is marked mock when the live fetch failed and the mock
+# generator was used instead.
+PRICE_HISTORY_SIZE = 256
+# Accumulator readings further than this past their last sample are not used
+PRICE_HISTORY_MAX_GAP_SECONDS = 300
+# Default window for get_twap_price() and for settlement
+TWAP_WINDOW_SECONDS = 60
+# Bounds for set_settlement_twap(): anyone may call it, so it can't shrink
+# settlement down to a single sample or stretch it past the buffer
+MIN_SETTLEMENT_TWAP_SECONDS = 30
+MAX_SETTLEMENT_TWAP_SECONDS = 600
+
+# Price consensus: validators accept the leader's price if it is within
+# this many basis points of their own (plus 1 cent for rounding)
+PRICE_TOLERANCE_BPS = {"BTC": 50, "ETH": 50, "SOL": 100, "DOGE": 200, "ADA": 200}
+DEFAULT_PRICE_TOLERANCE_BPS = 100
+
+# LLM price extraction only sees the fragment around the price, capped at
+# PROMPT_PAYLOAD_MAX_TOKENS (~4 characters per token)
+PROMPT_PAYLOAD_MAX_TOKENS = 64
+PROMPT_PAYLOAD_LEAD_CHARS = 32
+
 class CryptoPredictionGame(gl.Contract):
     """
     Crypto Prediction Game with REAL TIMESTAMPS
@@ -13,6 +41,7 @@ class CryptoPredictionGame(gl.Contract):
     # State variables
     user_balances: TreeMap[str, u256]
     leaderboard: TreeMap[str, u256]
+    top_wins: DynArray[str]  # Bounded, sorted by wins (desc)
     
     # Predictions
     prediction_symbols: TreeMap[u256, str]
@@ -24,11 +53,18 @@ class CryptoPredictionGame(gl.Contract):
     prediction_owners: TreeMap[u256, str]
     prediction_statuses: TreeMap[u256, str]
     
+    # Price samples for TWAP settlement (ring buffer per symbol)
+    price_history: TreeMap[str, DynArray[u256]]
+    price_history_start: TreeMap[str, u256]  # Index of the oldest sample once the buffer is full
+    prediction_twap_seconds: TreeMap[u256, u256]  # Settlement TWAP window, fixed at placement
+    settlement_twap_seconds: u256  # TWAP window for new predictions (MIN/MAX_SETTLEMENT_TWAP_SECONDS)
+    
     next_prediction_id: u256
     
     def __init__(self):
         """Initialize"""
         self.next_prediction_id = 0
+        self.settlement_twap_seconds = TWAP_WINDOW_SECONDS
     
     def parse_datetime(self, datetime_str: str) -> dict:
         """
@@ -150,9 +186,130 @@ class CryptoPredictionGame(gl.Contract):
         except:
             return "ERROR: datetime not available"
     
+    def parse_price_cents(self, web_data: str) -> int:
+        """
+        Read integer cents straight from a known price API response
+        Handles CryptoCompare {"USD": 95642.5} and CoinGecko {"bitcoin": {"usd": 95642.5}}
+        Returns -1 for any other shape so the caller can fall back to the LLM
+        """
+        try:
+            data = json.loads(web_data.strip(), parse_float=str, parse_int=str)
+        except ValueError:
+            return -1
+        if not isinstance(data, dict):
+            return -1
+        
+        if "USD" in data:
+            return self.decimal_to_cents(data["USD"])
+        if len(data) == 1:
+            inner = next(iter(data.values()))
+            if isinstance(inner, dict) and "usd" in inner:
+                return self.decimal_to_cents(inner["usd"])
+        return -1
+    
+    def decimal_to_cents(self, value) -> int:
+        """Convert a JSON decimal literal (kept as a string) to integer cents, truncating"""
+        if not isinstance(value, str):
+            return -1
+        whole, _, fraction = value.partition(".")
+        if not whole.isdigit() or (fraction and not fraction.isdigit()):
+            return -1
+        return int(whole) * 100 + int((fraction + "00")[:2])
+    
+    def trim_price_payload(self, web_data: str, keys: list, max_tokens: int = PROMPT_PAYLOAD_MAX_TOKENS) -> str:
+        """
+        Cut a rendered response down to the part around the price before prompting
+        Starts just before the first key found (else at the beginning) and
+        keeps at most max_tokens worth of text, with whitespace collapsed.
+        """
+        text = " ".join(web_data.split())
+        budget = max_tokens * 4
+        for key in keys:
+            i = text.find(key)
+            if i >= 0:
+                start = max(0, i - PROMPT_PAYLOAD_LEAD_CHARS)
+                return text[start:start + budget]
+        return text[:budget]
+    
+    def prices_agree(self, symbol: str, a: int, b: int) -> bool:
+        """Whether two cent prices are within the symbol's tolerance (integer math)"""
+        if a <= 0 or b <= 0:
+            return False
+        bps = PRICE_TOLERANCE_BPS.get(symbol, DEFAULT_PRICE_TOLERANCE_BPS)
+        diff = abs(a - b)
+        return diff <= 1 or diff * 10000 <= bps * max(a, b)
+    
+    def run_price_consensus(self, symbol: str, fetch, key: str = "price_usd_cents") -> dict:
+        """
+        Run fetch() with a numeric equivalence check instead of an LLM comparison
+        Each validator fetches its own price and accepts the leader's result
+        if both succeeded with prices within tolerance (or both failed).
+        """
+        def validator_fn(leaders_res) -> bool:
+            if not isinstance(leaders_res, gl.vm.Return):
+                return False
+            leader = leaders_res.calldata
+            mine = fetch()
+            if not leader.get("success", False) or not mine.get("success", False):
+                return leader.get("success", False) == mine.get("success", False)
+            return self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0)))
+        
+        return gl.vm.run_nondet(fetch, validator_fn)
+    
     @gl.public.view
     def get_current_price(self, crypto_symbol: str) -> dict:
-        """Get crypto price with mock variation"""
+        """
+        Get current crypto price from CryptoCompare (numeric consensus)
+        Falls back to the mock price if the API fails
+        """
+        crypto_symbol_upper = crypto_symbol.upper()
+        
+        def fetch_and_extract_price():
+            url = f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol_upper}&tsyms=USD"
+            web_data = gl.nondet.web.render(url, mode="text")
+            # Known JSON shape: parse directly and skip the LLM call
+            cents = self.parse_price_cents(web_data)
+            if cents > 0:
+                return {"price_usd_cents": cents, "success": True}
+            
+            payload = self.trim_price_payload(web_data, ['"USD"', '"usd"'])
+            task = f"""
+Extract USD price from: {payload}
+
+Return JSON only:
+{{"price_usd_cents": <integer>, "success": true}}
+
+Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
+"""
+            
+            result = gl.nondet.exec_prompt(task).replace("```json", "").replace("```", "").strip()
+            parsed = json.loads(result)
+            
+            if "price_usd" in parsed and "price_usd_cents" not in parsed:
+                parsed["price_usd_cents"] = int(float(parsed["price_usd"]) * 100)
+                del parsed["price_usd"]
+            elif "price_usd_cents" in parsed:
+                parsed["price_usd_cents"] = int(parsed["price_usd_cents"])
+            
+            return parsed
+        
+        try:
+            # Numeric consensus: validators accept prices within tolerance
+            price_data = self.run_price_consensus(crypto_symbol_upper, fetch_and_extract_price)
+            
+            if price_data.get("success", False):
+                return {
+                    "symbol": crypto_symbol_upper,
+                    "price_usd_cents": int(price_data["price_usd_cents"]),
+                    "source": "api"
+                }
+        except Exception as e:
+            print(f"Error fetching price, using fallback: {e}")
+        
+        return self.get_mock_price(crypto_symbol_upper)
+    
+    def get_mock_price(self, crypto_symbol: str) -> dict:
+        """Get crypto price with mock variation (fallback)"""
         crypto_symbol_upper = crypto_symbol.upper()
         
         base_prices = {
@@ -181,6 +338,219 @@ class CryptoPredictionGame(gl.Contract):
             "source": "mock"
         }
     
+    # ============================================================
+    # PRICE HISTORY (ring buffer + TWAP accumulator)
+    # ============================================================
+    
+    def record_price_sample(self, crypto_symbol: str, timestamp: u256, price_cents: u256, mock: bool):
+        """
+        Append one price (mock=True if it came from the mock fallback); once
+        full, overwrite the oldest sample
+        Each sample also carries the running sum of price * seconds up to
+        its timestamp and the number of mock samples so far, so TWAPs never
+        need to walk the buffer.
+        """
+        symbol = crypto_symbol.upper()
+        samples = self.price_history.get_or_insert_default(symbol)
+        size = len(samples)
+        cumulative = 0
+        mock_count = 0
+        
+        if size > 0:
+            start = self.price_history_start.get(symbol, 0)
+            newest = (start + size - 1) % size
+            newest_entry = samples[newest]
+            newest_ts = self.sample_time(newest_entry)
+            cumulative = self.sample_cumulative(newest_entry)
+            mock_count = self.sample_mock_count(newest_entry)
+            if timestamp < newest_ts:
+                return  # Out of order - keep the buffer sorted
+            if timestamp == newest_ts:
+                mock_count -= self.sample_is_mock(newest_entry)
+                samples[newest] = self.pack_sample(mock_count + int(mock), cumulative, timestamp, mock, price_cents)
+                return
+            cumulative += self.sample_price(newest_entry) * (timestamp - newest_ts)
+        
+        entry = self.pack_sample(mock_count + int(mock), cumulative, timestamp, mock, price_cents)
+        if size < PRICE_HISTORY_SIZE:
+            samples.append(entry)
+        else:
+            start = self.price_history_start.get(symbol, 0)
+            samples[start] = entry
+            self.price_history_start[symbol] = (start + 1) % size
+    
+    def pack_sample(self, mock_count: int, cumulative: int, timestamp: u256, mock: bool, price_cents: u256) -> u256:
+        """One ring buffer entry (see PRICE_HISTORY_SIZE)"""
+        return (mock_count << 224) | (cumulative << 128) | (timestamp << 64) | (int(mock) << 63) | price_cents
+    
+    def sample_time(self, entry: u256) -> u256:
+        """Unix seconds of a packed sample"""
+        return (entry >> 64) & ((1 << 64) - 1)
+    
+    def sample_price(self, entry: u256) -> u256:
+        """Price (cents) of a packed sample"""
+        return entry & ((1 << 63) - 1)
+    
+    def sample_is_mock(self, entry: u256) -> int:
+        """1 if a packed sample came from the mock fallback, else 0"""
+        return (entry >> 63) & 1
+    
+    def sample_cumulative(self, entry: u256) -> u256:
+        """Running price * seconds total at a packed sample's timestamp"""
+        return (entry >> 128) & ((1 << 96) - 1)
+    
+    def sample_mock_count(self, entry: u256) -> u256:
+        """Mock samples recorded up to and including a packed sample"""
+        return entry >> 224
+    
+    def sample_source(self, entry: u256) -> str:
+        """Source label for a price read from one sample"""
+        return "history (mock)" if self.sample_is_mock(entry) else "history"
+    
+    def price_sample(self, samples: DynArray[u256], start: u256, i: int) -> u256:
+        """i-th sample in time order (0 = oldest)"""
+        return samples[(start + i) % len(samples)]
+    
+    def first_sample_at_or_after(self, samples: DynArray[u256], start: u256, timestamp: u256) -> int:
+        """Binary search for the first sample (in time order) at or after timestamp"""
+        lo = 0
+        hi = len(samples)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.sample_time(self.price_sample(samples, start, mid)) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    
+    def cumulative_price_at(self, symbol: str, timestamp: u256) -> int:
+        """
+        Sum of price * seconds from the first sample up to timestamp
+        The price is held flat after the last sample at or before timestamp.
+        Returns -1 if timestamp is outside the buffer or too far past a sample.
+        """
+        samples = self.price_history.get(symbol, None)
+        if samples is None or len(samples) == 0:
+            return -1
+        
+        start = self.price_history_start.get(symbol, 0)
+        i = self.first_sample_at_or_after(samples, start, timestamp + 1) - 1
+        if i < 0:
+            return -1
+        
+        entry = self.price_sample(samples, start, i)
+        elapsed = timestamp - self.sample_time(entry)
+        if elapsed > PRICE_HISTORY_MAX_GAP_SECONDS:
+            return -1
+        return self.sample_cumulative(entry) + self.sample_price(entry) * elapsed
+    
+    def mock_samples_between(self, symbol: str, begin: u256, end: u256) -> int:
+        """
+        Mock samples whose price is averaged into [begin, end]: the one in
+        force at begin plus those taken after it, up to end
+        """
+        samples = self.price_history[symbol]
+        start = self.price_history_start.get(symbol, 0)
+        at_begin = self.price_sample(samples, start, self.first_sample_at_or_after(samples, start, begin + 1) - 1)
+        at_end = self.price_sample(samples, start, self.first_sample_at_or_after(samples, start, end + 1) - 1)
+        return self.sample_mock_count(at_end) - self.sample_mock_count(at_begin) + self.sample_is_mock(at_begin)
+    
+    def twap_source(self, symbol: str, begin: u256, end: u256) -> str:
+        """Source label for a TWAP, counting any mock samples in it"""
+        mock_samples = self.mock_samples_between(symbol, begin, end)
+        if mock_samples > 0:
+            return f"twap {end - begin}s ({mock_samples} mock samples)"
+        return f"twap {end - begin}s"
+    
+    @gl.public.view
+    def get_twap_price(self, crypto_symbol: str, end_time_str: str, window_seconds: u256 = TWAP_WINDOW_SECONDS) -> dict:
+        """
+        Time-weighted average price over window_seconds ending at end_time_str
+        Two accumulator readings and one division. Falls back to the
+        current price when the window isn't covered by samples.
+        """
+        symbol = crypto_symbol.upper()
+        end = self.datetime_to_seconds(end_time_str)
+        if window_seconds == 0 or window_seconds > end:
+            return self.get_current_price(symbol)
+        
+        cumulative_end = self.cumulative_price_at(symbol, end)
+        cumulative_start = self.cumulative_price_at(symbol, end - window_seconds)
+        if cumulative_end < 0 or cumulative_start < 0:
+            return self.get_current_price(symbol)
+        
+        return {
+            "symbol": symbol,
+            "price_usd_cents": (cumulative_end - cumulative_start) // window_seconds,
+            "source": self.twap_source(symbol, end - window_seconds, end),
+            "timestamp": end_time_str
+        }
+    
+    def get_settlement_price(self, symbol: str, expiry_time: str, created_at: u256, window: u256) -> dict:
+        """
+        Exit price for a prediction: TWAP over its own window (fixed at
+        placement) ending at expiry, else the current price
+        The window is clipped to start after placement and needs a sample
+        taken after the entry, so it never collapses to the entry price.
+        """
+        if window == 0:
+            return self.get_current_price(symbol)
+        
+        end = self.datetime_to_seconds(expiry_time)
+        begin = max(end - min(window, end), created_at)
+        samples = self.price_history.get(symbol, None)
+        if end <= begin or samples is None or len(samples) == 0:
+            return self.get_current_price(symbol)
+        
+        oldest = self.price_history_start.get(symbol, 0)
+        i = self.first_sample_at_or_after(samples, oldest, created_at + 1)
+        if i >= len(samples) or self.sample_time(self.price_sample(samples, oldest, i)) > end:
+            return self.get_current_price(symbol)
+        
+        cumulative_end = self.cumulative_price_at(symbol, end)
+        cumulative_begin = self.cumulative_price_at(symbol, begin)
+        if cumulative_end < 0 or cumulative_begin < 0:
+            return self.get_current_price(symbol)
+        
+        return {
+            "symbol": symbol,
+            "price_usd_cents": (cumulative_end - cumulative_begin) // (end - begin),
+            "source": self.twap_source(symbol, begin, end),
+            "timestamp": expiry_time
+        }
+    
+    @gl.public.write
+    def set_settlement_twap(self, window_seconds: u256) -> str:
+        """
+        Settle on a TWAP of window_seconds ending at expiry, within
+        MIN_SETTLEMENT_TWAP_SECONDS..MAX_SETTLEMENT_TWAP_SECONDS
+        Applies to predictions placed from now on; open ones keep their window
+        """
+        if window_seconds < MIN_SETTLEMENT_TWAP_SECONDS or window_seconds > MAX_SETTLEMENT_TWAP_SECONDS:
+            return f"ERROR: Settlement TWAP must be {MIN_SETTLEMENT_TWAP_SECONDS}-{MAX_SETTLEMENT_TWAP_SECONDS} seconds"
+        self.settlement_twap_seconds = window_seconds
+        return f"Settlement uses a {window_seconds}s TWAP ending at expiry"
+    
+    @gl.public.write
+    def update_price(self, crypto_symbol: str) -> str:
+        """
+        Keeper entry point: record the current live price as a history sample
+        Call regularly (e.g. every minute) so expiries have nearby samples.
+        If the live fetch fails the mock price is recorded, marked as mock.
+        """
+        current_time = gl.message_raw["datetime"]
+        price_data = self.get_current_price(crypto_symbol)
+        mock = price_data["source"] != "api"
+        self.record_price_sample(crypto_symbol, self.datetime_to_seconds(current_time), price_data["price_usd_cents"], mock)
+        
+        price_usd = price_data["price_usd_cents"] / 100.0
+        return f"Recorded {crypto_symbol.upper()}: ${price_usd:.2f} at {current_time} (source: {price_data['source']})"
+    
+    @gl.public.view
+    def get_price_history_size(self, crypto_symbol: str) -> u256:
+        """Number of samples held for a symbol (at most PRICE_HISTORY_SIZE)"""
+        return len(self.price_history.get(crypto_symbol.upper(), []))
+    
     @gl.public.write
     def deposit(self, user_address: str, amount: u256) -> str:
         """Deposit funds"""
@@ -225,6 +595,9 @@ class CryptoPredictionGame(gl.Contract):
         current_time = gl.message_raw["datetime"]
         expiry_time = self.add_seconds_to_datetime(current_time, duration_seconds)
         
+        # Every entry price is also a history sample
+        self.record_price_sample(crypto_symbol, self.datetime_to_seconds(current_time), price_data["price_usd_cents"], price_data["source"] != "api")
+        
         self.prediction_symbols[prediction_id] = crypto_symbol.upper()
         self.prediction_directions[prediction_id] = direction.upper()
         self.prediction_amounts[prediction_id] = bet_amount
@@ -233,6 +606,7 @@ class CryptoPredictionGame(gl.Contract):
         self.prediction_expiry_time[prediction_id] = expiry_time
         self.prediction_owners[prediction_id] = user_address
         self.prediction_statuses[prediction_id] = "ACTIVE"
+        self.prediction_twap_seconds[prediction_id] = self.settlement_twap_seconds
         
         price_usd = price_data["price_usd_cents"] / 100.0
         
@@ -257,9 +631,11 @@ class CryptoPredictionGame(gl.Contract):
         if not self.is_time_expired(expiry_time, current_time):
             return f"ERROR: Too early! Current: {current_time} | Expires: {expiry_time}"
         
-        # Get exit price
+        # Get exit price (TWAP ending at expiry when enabled)
         symbol = self.prediction_symbols[prediction_id]
-        price_data = self.get_current_price(symbol)
+        created_at = self.datetime_to_seconds(self.prediction_creation_time[prediction_id])
+        window = self.prediction_twap_seconds.get(prediction_id, 0)
+        price_data = self.get_settlement_price(symbol, expiry_time, created_at, window)
         
         exit_price_cents = price_data["price_usd_cents"]
         entry_price_cents = self.prediction_entry_prices[prediction_id]
@@ -277,6 +653,7 @@ class CryptoPredictionGame(gl.Contract):
             if user_address not in self.leaderboard:
                 self.leaderboard[user_address] = 0
             self.leaderboard[user_address] += 1
+            self.update_top_k(self.top_wins, self.leaderboard, user_address, LEADERBOARD_SIZE)
             
             result = "WON"
         else:
@@ -367,16 +744,51 @@ class CryptoPredictionGame(gl.Contract):
         
         return ";;".join(active_list)
     
+    # ============================================================
+    # TOP-K LEADERBOARD
+    # ============================================================
+    
+    def update_top_k(self, top: DynArray[str], scores: TreeMap[str, u256], user_address: str, capacity: int):
+        """
+        Re-rank one user inside a bounded, score-descending list - O(K)
+        Players outside the list only get in by beating its last entry
+        """
+        score = scores[user_address]
+        
+        pos = -1
+        for i in range(len(top)):
+            if top[i] == user_address:
+                pos = i
+                break
+        
+        if pos == -1:
+            if len(top) >= capacity and score <= scores[top[len(top) - 1]]:
+                return
+            top.append(user_address)
+            pos = len(top) - 1
+        
+        # Move forward past lower scores...
+        while pos > 0 and scores[top[pos - 1]] < score:
+            top[pos - 1], top[pos] = top[pos], top[pos - 1]
+            pos -= 1
+        # ...or back past higher ones after a score drop
+        while pos < len(top) - 1 and scores[top[pos + 1]] > score:
+            top[pos + 1], top[pos] = top[pos], top[pos + 1]
+            pos += 1
+        
+        if len(top) > capacity:
+            top.pop()
+    
     @gl.public.view
     def get_leaderboard(self) -> str:
         """Get leaderboard"""
-        if not self.leaderboard:
+        if len(self.top_wins) == 0:
             return "No winners yet"
         
         result = "Leaderboard:\n"
-        sorted_leaders = sorted(self.leaderboard.items(), key=lambda x: x[1], reverse=True)
-        for i, (user, wins) in enumerate(sorted_leaders[:10], 1):
-            result += f"{i}. {user[:10]}... - {wins} wins\n"
+        for i in range(len(self.top_wins)):
+            user = self.top_wins[i]
+            result += f"{i + 1}. {user[:10]}... - {self.leaderboard[user]} wins\n"
         return result
     
     @gl.public.view
@@ -24,6 +24,9 @@ class CryptoPredictionGame(gl.Contract):
     prediction_owners: TreeMap[u256, str]
     prediction_statuses: TreeMap[u256, str]
     
+    # Expiry queue: min-heap of (expiry_tx << 64) | prediction_id
+    expiry_heap: DynArray[u256]
+    
     next_prediction_id: u256
     transaction_counter: u256
     price_counter: u256
@@ -114,6 +117,9 @@ class CryptoPredictionGame(gl.Contract):
         self.prediction_owners[prediction_id] = user_address
         self.prediction_statuses[prediction_id] = "ACTIVE"
         
+        # Queue for keeper settlement
+        self.schedule_expiry(prediction_id, self.transaction_counter + duration_tx)
+        
         price_usd = price_data["price_usd_cents"] / 100.0
         
         return f"Prediction #{prediction_id} placed: {direction} on {crypto_symbol} at ${price_usd:.2f} for {duration_seconds}s ({duration_tx} tx)"
@@ -253,6 +259,95 @@ class CryptoPredictionGame(gl.Contract):
         
         return f"Total predictions: {total_predictions}, Total players: {total_players}, Total in pool: {total_in_pool}, Transaction counter: {self.transaction_counter}"
     
+    # ============================================================
+    # EXPIRY QUEUE & KEEPER SETTLEMENT
+    # ============================================================
+    
+    def schedule_expiry(self, prediction_id: u256, expiry_tx: u256):
+        """Push a prediction onto the expiry heap (sift up)"""
+        heap = self.expiry_heap
+        heap.append((expiry_tx << 64) | prediction_id)
+        i = len(heap) - 1
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[parent] <= heap[i]:
+                break
+            heap[parent], heap[i] = heap[i], heap[parent]
+            i = parent
+    
+    def pop_expiry(self) -> u256:
+        """Pop the entry with the earliest expiry (sift down)"""
+        heap = self.expiry_heap
+        top = heap[0]
+        last = heap.pop()
+        size = len(heap)
+        if size > 0:
+            heap[0] = last
+            i = 0
+            while True:
+                smallest = i
+                left = 2 * i + 1
+                right = left + 1
+                if left < size and heap[left] < heap[smallest]:
+                    smallest = left
+                if right < size and heap[right] < heap[smallest]:
+                    smallest = right
+                if smallest == i:
+                    break
+                heap[i], heap[smallest] = heap[smallest], heap[i]
+                i = smallest
+        return top
+    
+    @gl.public.write
+    def settle_due(self, max_count: u256 = 10) -> str:
+        """
+        Keeper entry point: settle due predictions for ALL users
+        Only pops predictions whose expiry has passed by the start of the call,
+        up to max_count heap entries (already-settled entries count too)
+        """
+        self.transaction_counter += 1
+        
+        now = self.transaction_counter  # settle_prediction advances the counter; don't chase it
+        popped = 0
+        settled_count = 0
+        results = []
+        retry = []
+        
+        while len(self.expiry_heap) > 0 and popped < max_count:
+            entry = self.expiry_heap[0]
+            if (entry >> 64) > now:
+                break
+            
+            self.pop_expiry()
+            popped += 1
+            pred_id = entry & ((1 << 64) - 1)
+            
+            # Skip predictions already settled by their owner
+            if self.prediction_statuses[pred_id] != "ACTIVE":
+                continue
+            
+            result = self.settle_prediction(self.prediction_owners[pred_id], pred_id)
+            if self.prediction_statuses[pred_id] == "ACTIVE":
+                # Settlement failed (e.g. price fetch) - keep it queued
+                retry.append(entry)
+                continue
+            
+            settled_count += 1
+            results.append(f"#{pred_id}: {result[:30]}...")
+        
+        for entry in retry:
+            self.schedule_expiry(entry & ((1 << 64) - 1), entry >> 64)
+        
+        if settled_count == 0:
+            return "No predictions due"
+        
+        return f"✅ Settled {settled_count} due predictions:\n" + "\n".join(results)
+    
+    @gl.public.view
+    def get_pending_expiries(self) -> u256:
+        """Number of queued expiry entries (may include already-settled ones)"""
+        return len(self.expiry_heap)
+    
     @gl.public.write
     def advance_time(self) -> str:
         """Advance time by 1 transaction"""
@@ -3,6 +3,40 @@
 
 from genlayer import *
 import json
+import time
+
+# Leaderboards show LEADERBOARD_SIZE rows. Wins only grow, so a bounded
+# list is exact; profit can drop, so its board is read from profit buckets
+# (a Fenwick tree of bucket counts, each bucket listing its members).
+LEADERBOARD_SIZE = 10
+RANK_BUCKETS = 1024
+PROFIT_BUCKET_WIDTH = 100
+
+# Live prices come from CryptoCompare, or CoinGecko (for COINGECKO_IDS) if it
+# is down. A validator that disagrees takes the median of both before rejecting
+COINGECKO_IDS = {"BTC": "bitcoin", "ETH": "ethereum", "SOL": "solana", "DOGE": "dogecoin", "ADA": "cardano"}
+
+# Price consensus: validators accept the leader's price if it is within
+# this many basis points of their own (plus 1 cent for rounding)
+PRICE_TOLERANCE_BPS = {"BTC": 50, "ETH": 50, "SOL": 100, "DOGE": 200, "ADA": 200}
+DEFAULT_PRICE_TOLERANCE_BPS = 100
+
+# LLM price extraction only sees the fragment around the price, capped at
+# PROMPT_PAYLOAD_MAX_TOKENS (~4 characters per token)
+PROMPT_PAYLOAD_MAX_TOKENS = 64
+PROMPT_PAYLOAD_LEAD_CHARS = 32
+
+# Counters kept by the price instrumentation (see get_price_metrics)
+PRICE_METRIC_NAMES = [
+    "render_calls", "render_ms", "render_bytes", "render_failures", "retries",
+    "prompt_calls", "prompt_ms", "prompt_chars",
+    "consensus_rounds", "consensus_failures", "mock_fallbacks",
+]
+
+# Per-call traces for local runs (module state is not kept between
+# transactions on chain, and node-local timings never reach storage)
+PRICE_TRACE = []
+PRICE_TRACE_LIMIT = 500
 
 class CryptoPredictionGame(gl.Contract):
     """
@@ -15,6 +49,10 @@ class CryptoPredictionGame(gl.Contract):
     # Leaderboard tracking
     leaderboard_wins: TreeMap[str, u256]
     leaderboard_profit: TreeMap[str, u256]
+    top_wins: DynArray[str]    # Bounded, sorted by wins (desc)
+    rank_tree_profit: DynArray[u256]  # Fenwick tree: players per profit bucket
+    profit_bucket_members: TreeMap[u256, DynArray[str]]  # Profit bucket -> players in it
+    profit_bucket_pos: TreeMap[str, u256]  # Player -> index in their bucket's list
     
     # Prediction storage - using prediction_id as key
     prediction_symbols: TreeMap[u256, str]
@@ -26,30 +64,151 @@ class CryptoPredictionGame(gl.Contract):
     prediction_owners: TreeMap[u256, str]
     prediction_statuses: TreeMap[u256, str]
     
+    # Expiry queue: min-heap of (expiry_tx << 64) | prediction_id
+    expiry_heap: DynArray[u256]
+    
     # Global counters
     next_prediction_id: u256
     transaction_counter: u256
     price_counter: u256
     
+    # Price instrumentation counters (PRICE_METRIC_NAMES -> total)
+    price_metrics: TreeMap[str, u256]
+    
     def __init__(self):
         """Initialize the game contract"""
         self.next_prediction_id = 0
         self.transaction_counter = 0
         self.price_counter = 0
     
+    def price_sources(self, crypto_symbol: str) -> list:
+        """(name, url) pairs queried for a live price, in order"""
+        sources = [("cryptocompare", f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol}&tsyms=USD")]
+        if crypto_symbol in COINGECKO_IDS:
+            sources.append(("coingecko", f"https://api.coingecko.com/api/v3/simple/price?ids={COINGECKO_IDS[crypto_symbol]}&vs_currencies=usd"))
+        return sources
+    
+    def median_cents(self, values: list) -> int:
+        """Median of integer prices (lower-biased mean of the middle two for even counts)"""
+        ordered = sorted(values)
+        mid = len(ordered) // 2
+        if len(ordered) % 2 == 1:
+            return ordered[mid]
+        return (ordered[mid - 1] + ordered[mid]) // 2
+    
+    def parse_price_cents(self, web_data: str) -> int:
+        """
+        Read integer cents straight from a known price API response
+        Handles CryptoCompare {"USD": 95642.5} and CoinGecko {"bitcoin": {"usd": 95642.5}}
+        Returns -1 for any other shape so the caller can fall back to the LLM
+        """
+        try:
+            data = json.loads(web_data.strip(), parse_float=str, parse_int=str)
+        except ValueError:
+            return -1
+        if not isinstance(data, dict):
+            return -1
+        
+        if "USD" in data:
+            return self.decimal_to_cents(data["USD"])
+        if len(data) == 1:
+            inner = next(iter(data.values()))
+            if isinstance(inner, dict) and "usd" in inner:
+                return self.decimal_to_cents(inner["usd"])
+        return -1
+    
+    def decimal_to_cents(self, value) -> int:
+        """Convert a JSON decimal literal (kept as a string) to integer cents, truncating"""
+        if not isinstance(value, str):
+            return -1
+        whole, _, fraction = value.partition(".")
+        if not whole.isdigit() or (fraction and not fraction.isdigit()):
+            return -1
+        return int(whole) * 100 + int((fraction + "00")[:2])
+    
+    def trim_price_payload(self, web_data: str, keys: list, max_tokens: int = PROMPT_PAYLOAD_MAX_TOKENS) -> str:
+        """
+        Cut a rendered response down to the part around the price before prompting
+        Starts just before the first key found (else at the beginning) and
+        keeps at most max_tokens worth of text, with whitespace collapsed.
+        """
+        text = " ".join(web_data.split())
+        budget = max_tokens * 4
+        for key in keys:
+            i = text.find(key)
+            if i >= 0:
+                start = max(0, i - PROMPT_PAYLOAD_LEAD_CHARS)
+                return text[start:start + budget]
+        return text[:budget]
+    
+    def prices_agree(self, symbol: str, a: int, b: int) -> bool:
+        """Whether two cent prices are within the symbol's tolerance (integer math)"""
+        if a <= 0 or b <= 0:
+            return False
+        bps = PRICE_TOLERANCE_BPS.get(symbol, DEFAULT_PRICE_TOLERANCE_BPS)
+        diff = abs(a - b)
+        return diff <= 1 or diff * 10000 <= bps * max(a, b)
+    
+    def run_price_consensus(self, symbol: str, fetch, key: str = "price_usd_cents") -> dict:
+        """
+        Run fetch() with a numeric equivalence check instead of an LLM comparison
+        Each validator fetches its own price and accepts the leader's result
+        if both succeeded with prices within tolerance (or both failed).
+        fetch() stops at the first source that answers, so a fetch costs one
+        render; only a validator that disagrees asks every source, via
+        fetch(True), before rejecting.
+        """
+        def validator_fn(leaders_res) -> bool:
+            if not isinstance(leaders_res, gl.vm.Return):
+                return False
+            leader = leaders_res.calldata
+            mine = fetch()
+            if not leader.get("success", False) or not mine.get("success", False):
+                return leader.get("success", False) == mine.get("success", False)
+            if self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0))):
+                return True
+            mine = fetch(True)
+            return mine.get("success", False) and self.prices_agree(symbol, int(leader.get(key, 0)), int(mine.get(key, 0)))
+        
+        return self.timed_consensus(lambda: gl.vm.run_nondet(fetch, validator_fn))
+    
     @gl.public.view
     def get_current_price(self, crypto_symbol: str) -> dict:
-        """Fetch crypto price - tries real API, falls back to mock"""
+        """Fetch crypto price - first live API to answer, falls back to mock (with the call's metrics)"""
         crypto_symbol_upper = crypto_symbol.upper()
+        metrics = {"consensus_rounds": 1}
         
         # Try real API
         try:
-            def fetch_and_extract_price():
-                url = f"https://min-api.cryptocompare.com/data/price?fsym={crypto_symbol_upper}&tsyms=USD"
-                web_data = gl.nondet.web.render(url, mode="text")
+            def fetch_and_extract_price(all_sources: bool = False):
+                metrics = {}
+                quotes = {}
+                web_data = ""
+                for name, url in self.price_sources(crypto_symbol_upper):
+                    if metrics.get("render_calls", 0) > len(quotes):
+                        metrics["retries"] = metrics.get("retries", 0) + 1
+                    try:
+                        response = self.timed_render(url, metrics)
+                    except Exception as e:
+                        continue  # Source down - try the next one
+                    if web_data == "":
+                        web_data = response
+                    
+                    # Known JSON shape: parse directly and skip the LLM call
+                    cents = self.parse_price_cents(response)
+                    if cents > 0:
+                        quotes[name] = cents
+                        if not all_sources:
+                            break  # One quote is enough unless a validator disagrees
                 
+                if len(quotes) > 0:
+                    return {"price_usd_cents": self.median_cents(list(quotes.values())), "success": True, "sources": sorted(quotes), "metrics": metrics}
+                if web_data == "":
+                    return {"success": False, "metrics": metrics}
+                
+                payload = self.trim_price_payload(web_data, ['"USD"', '"usd"'])
                 task = f"""
-Extract USD price from: {web_data}
+Extract USD price from: {payload}
 
 Return JSON only:
 {{"price_usd_cents": <integer>, "success": true}}
@@ -57,7 +216,7 @@ Return JSON only:
 Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
 """
                 
-                result = gl.nondet.exec_prompt(task).replace("```json", "").replace("```", "").strip()
+                result = self.timed_prompt(task, metrics).replace("```json", "").replace("```", "").strip()
                 parsed = json.loads(result)
                 
                 # Ensure integer
@@ -67,27 +226,26 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
                 elif "price_usd_cents" in parsed:
                     parsed["price_usd_cents"] = int(parsed["price_usd_cents"])
                 
+                parsed["metrics"] = metrics
                 return parsed
             
-            def get_price_json():
-                return json.dumps(fetch_and_extract_price())
-            
-            price_json = gl.eq_principle.prompt_comparative(
-                get_price_json,
-                "Price values should be within 1% of each other"
-            )
-            price_data = json.loads(price_json)
+            # Numeric consensus: validators accept prices within tolerance
+            price_data = self.run_price_consensus(crypto_symbol_upper, fetch_and_extract_price)
+            metrics.update(price_data.get("metrics", {}))
             
             if price_data.get("success", False):
                 return {
                     "symbol": crypto_symbol_upper,
                     "price_usd_cents": int(price_data["price_usd_cents"]),
-                    "source": "api"
+                    "source": "api",
+                    "sources": price_data.get("sources", ["llm"]),
+                    "metrics": metrics
                 }
         except:
-            pass
+            metrics["consensus_failures"] = 1
         
         # Fallback to mock prices
+        metrics["mock_fallbacks"] = 1
         base_prices = {
             "BTC": 9500000,
             "ETH": 350000,
@@ -103,7 +261,8 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
         return {
             "symbol": crypto_symbol_upper,
             "price_usd_cents": price,
-            "source": "mock"
+            "source": "mock",
+            "metrics": metrics
         }
     
     @gl.public.write
@@ -152,6 +311,7 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
             return f"ERROR: Insufficient balance. Have {user_balance}, need {bet_amount}"
         
         price_data = self.get_current_price(crypto_symbol)
+        self.record_price_metrics(price_data.pop("metrics", {}))
         if price_data["price_usd_cents"] == 0:
             return "ERROR: Failed to fetch price"
         
@@ -171,6 +331,9 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
         self.prediction_owners[prediction_id] = user_address
         self.prediction_statuses[prediction_id] = "ACTIVE"
         
+        # Queue for keeper settlement
+        self.schedule_expiry(prediction_id, self.transaction_counter + duration_tx)
+        
         price_usd = price_data["price_usd_cents"] / 100
         potential_win = (bet_amount * 18) // 10
         
@@ -201,6 +364,7 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
         
         symbol = self.prediction_symbols[prediction_id]
         price_data = self.get_current_price(symbol)
+        self.record_price_metrics(price_data.pop("metrics", {}))
         
         if price_data["price_usd_cents"] == 0:
             return "ERROR: Failed to fetch exit price"
@@ -213,6 +377,7 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
         won = (price_went_up and direction == "UP") or (not price_went_up and direction == "DOWN")
         
         bet = self.prediction_amounts[prediction_id]
+        old_profit = self.leaderboard_profit.get(user_address, None)
         
         if won:
             payout = (bet * 18) // 10
@@ -237,6 +402,11 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
             
             result = "You Lost"
         
+        # Re-rank in the bounded wins list and the profit buckets
+        if won:
+            self.update_top_k(self.top_wins, self.leaderboard_wins, user_address, LEADERBOARD_SIZE)
+        self.move_profit_rank(old_profit, self.leaderboard_profit[user_address], user_address)
+        
         entry_usd = entry_price / 100
         exit_usd = exit_price / 100
         change = ((exit_price - entry_price) * 100 / entry_price) if entry_price > 0 else 0
@@ -321,26 +491,212 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
         
         return f"Balance: {balance} | Predictions: {total} (Active: {active}, Won: {won}, Lost: {lost}) | Win Rate: {win_rate}% | Profit: {profit:+d}"
     
+    # ============================================================
+    # PRICE INSTRUMENTATION
+    # ============================================================
+    
+    def timed_render(self, url: str, metrics: dict) -> str:
+        """gl.nondet.web.render, counting calls, time, bytes and failures into metrics"""
+        started = time.monotonic()
+        try:
+            response = gl.nondet.web.render(url, mode="text")
+        except Exception as e:
+            self.count_price_call(metrics, "render", started, 0, True)
+            raise
+        self.count_price_call(metrics, "render", started, len(response), False)
+        return response
+    
+    def timed_prompt(self, task: str, metrics: dict) -> str:
+        """gl.nondet.exec_prompt, counting calls, time and prompt size into metrics"""
+        started = time.monotonic()
+        result = gl.nondet.exec_prompt(task)
+        self.count_price_call(metrics, "prompt", started, len(task), False)
+        return result
+    
+    def timed_consensus(self, run) -> dict:
+        """
+        Run one consensus call, tracing its duration locally only
+        (each node measures a different time, so it cannot be stored)
+        """
+        started = time.monotonic()
+        failed = True
+        try:
+            result = run()
+            failed = False
+            return result
+        finally:
+            self.trace_price_call("consensus", int((time.monotonic() - started) * 1000), 0, failed)
+    
+    def count_price_call(self, metrics: dict, kind: str, started: float, size: int, failed: bool):
+        """Add one render/prompt call to a nondet metrics dict and to the local trace"""
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        size_key = "render_bytes" if kind == "render" else "prompt_chars"
+        metrics[f"{kind}_calls"] = metrics.get(f"{kind}_calls", 0) + 1
+        metrics[f"{kind}_ms"] = metrics.get(f"{kind}_ms", 0) + elapsed_ms
+        metrics[size_key] = metrics.get(size_key, 0) + size
+        if failed:
+            metrics[f"{kind}_failures"] = metrics.get(f"{kind}_failures", 0) + 1
+        self.trace_price_call(kind, elapsed_ms, size, failed)
+    
+    def trace_price_call(self, kind: str, elapsed_ms: int, size: int, failed: bool):
+        """Append to PRICE_TRACE, dropping the oldest entry once full"""
+        if len(PRICE_TRACE) >= PRICE_TRACE_LIMIT:
+            del PRICE_TRACE[0]
+        PRICE_TRACE.append({"kind": kind, "ms": elapsed_ms, "size": size, "failed": failed})
+    
+    def record_price_metrics(self, metrics: dict):
+        """Add the leader's agreed metrics to the stored counters (write paths only)"""
+        for name, value in metrics.items():
+            if name in PRICE_METRIC_NAMES:
+                self.price_metrics[name] = self.price_metrics.get(name, 0) + int(value)
+    
+    @gl.public.view
+    def get_price_metrics(self) -> dict:
+        """Aggregated price-path counters, with average render/prompt latency"""
+        result = {name: self.price_metrics.get(name, 0) for name in PRICE_METRIC_NAMES}
+        for kind in ["render", "prompt"]:
+            calls = result[f"{kind}_calls"]
+            result[f"{kind}_avg_ms"] = result[f"{kind}_ms"] // calls if calls > 0 else 0
+        return result
+    
+    # ============================================================
+    # TOP-K LEADERBOARD
+    # ============================================================
+    
+    def update_top_k(self, top: DynArray[str], scores: TreeMap[str, u256], user_address: str, capacity: int):
+        """
+        Re-rank one user inside a bounded, score-descending list - O(K)
+        Players outside the list only get in by beating its last entry
+        """
+        score = scores[user_address]
+        
+        pos = -1
+        for i in range(len(top)):
+            if top[i] == user_address:
+                pos = i
+                break
+        
+        if pos == -1:
+            if len(top) >= capacity and score <= scores[top[len(top) - 1]]:
+                return
+            top.append(user_address)
+            pos = len(top) - 1
+        
+        # Move forward past lower scores...
+        while pos > 0 and scores[top[pos - 1]] < score:
+            top[pos - 1], top[pos] = top[pos], top[pos - 1]
+            pos -= 1
+        # ...or back past higher ones after a score drop
+        while pos < len(top) - 1 and scores[top[pos + 1]] > score:
+            top[pos + 1], top[pos] = top[pos], top[pos + 1]
+            pos += 1
+        
+        if len(top) > capacity:
+            top.pop()
+    
+    def profit_bucket(self, profit: int) -> int:
+        """Map a profit to its bucket index (0 .. RANK_BUCKETS - 1)"""
+        return max(0, min(RANK_BUCKETS - 1, profit // PROFIT_BUCKET_WIDTH + RANK_BUCKETS // 2))
+    
+    def fenwick_add(self, tree: DynArray[u256], bucket: int, delta: int):
+        """Add delta to one bucket - O(log n)"""
+        i = bucket + 1
+        while i <= RANK_BUCKETS:
+            tree[i] += delta
+            i += i & (-i)
+    
+    def fenwick_prefix(self, tree: DynArray[u256], bucket: int) -> int:
+        """Number of players in buckets 0..bucket - O(log n)"""
+        total = 0
+        i = bucket + 1
+        while i > 0:
+            total += tree[i]
+            i -= i & (-i)
+        return total
+    
+    def fenwick_find(self, tree: DynArray[u256], k: int) -> int:
+        """Lowest bucket whose prefix count reaches k (1 <= k <= total) - O(log n)"""
+        pos = 0
+        step = RANK_BUCKETS
+        while step > 0:
+            if pos + step <= RANK_BUCKETS and tree[pos + step] < k:
+                pos += step
+                k -= tree[pos]
+            step //= 2
+        return pos
+    
+    def move_profit_rank(self, old_profit, new_profit: int, user_address: str):
+        """Move a player between profit buckets (old_profit is None for new players) - O(log n)"""
+        tree = self.rank_tree_profit
+        while len(tree) < RANK_BUCKETS + 1:
+            tree.append(0)
+        
+        # Players not listed yet are inserted, whatever their old score
+        if user_address not in self.profit_bucket_pos:
+            old_profit = None
+        old_bucket = None if old_profit is None else self.profit_bucket(old_profit)
+        new_bucket = self.profit_bucket(new_profit)
+        if old_bucket == new_bucket:
+            return
+        
+        if old_bucket is not None:
+            self.fenwick_add(tree, old_bucket, -1)
+            members = self.profit_bucket_members[old_bucket]
+            # Swap-remove
+            pos = self.profit_bucket_pos[user_address]
+            last = members[len(members) - 1]
+            members[pos] = last
+            self.profit_bucket_pos[last] = pos
+            members.pop()
+        
+        self.fenwick_add(tree, new_bucket, 1)
+        members = self.profit_bucket_members.get_or_insert_default(new_bucket)
+        self.profit_bucket_pos[user_address] = len(members)
+        members.append(user_address)
+    
+    def top_by_profit(self, limit: int) -> list:
+        """
+        The `limit` highest-profit players, exactly: walk non-empty profit
+        buckets from the top (found through the Fenwick tree) and sort each
+        bucket's members by their actual profit
+        """
+        tree = self.rank_tree_profit
+        if len(tree) < RANK_BUCKETS + 1:
+            return []
+        
+        result = []
+        remaining = self.fenwick_prefix(tree, RANK_BUCKETS - 1)
+        while remaining > 0 and len(result) < limit:
+            bucket = self.fenwick_find(tree, remaining)
+            members = list(self.profit_bucket_members.get(bucket, []))
+            members.sort(key=lambda user: self.leaderboard_profit[user], reverse=True)
+            result.extend(members[:limit - len(result)])
+            remaining = self.fenwick_prefix(tree, bucket - 1) if bucket > 0 else 0
+        return result
+    
     @gl.public.view
     def get_leaderboard(self, sort_by: str = "wins") -> str:
         """Get leaderboard"""
         if sort_by == "profit":
-            if not self.leaderboard_profit:
+            top = self.top_by_profit(LEADERBOARD_SIZE)
+            if len(top) == 0:
                 return "No players yet"
             
-            sorted_leaders = sorted(self.leaderboard_profit.items(), key=lambda x: x[1], reverse=True)
             result = "Top Players by Profit:\n"
-            for i, (user, profit) in enumerate(sorted_leaders[:10], 1):
-                result += f"{i}. {user[:10]}... - {profit:+d} tokens\n"
+            for i in range(len(top)):
+                user = top[i]
+                profit = self.leaderboard_profit[user]
+                result += f"{i + 1}. {user[:10]}... - {profit:+d} tokens\n"
         else:
-            if not self.leaderboard_wins:
+            if len(self.top_wins) == 0:
                 return "No winners yet"
             
-            sorted_leaders = sorted(self.leaderboard_wins.items(), key=lambda x: x[1], reverse=True)
             result = "Top Players by Wins:\n"
-            for i, (user, wins) in enumerate(sorted_leaders[:10], 1):
+            for i in range(len(self.top_wins)):
+                user = self.top_wins[i]
+                wins = self.leaderboard_wins[user]
                 profit = self.leaderboard_profit.get(user, 0)
-                result += f"{i}. {user[:10]}... - {wins} wins ({profit:+d} profit)\n"
+                result += f"{i + 1}. {user[:10]}... - {wins} wins ({profit:+d} profit)\n"
         
         return result
     
@@ -363,6 +719,95 @@ Convert price to cents (multiply by 100). If USD is 95642.50, return 9564250.
         
         return f"Total: {total_predictions} predictions | {unique_players} players | {total_in_pool} tokens | Active: {active} | Won: {won} | Lost: {lost} | TX: {self.transaction_counter}"
     
+    # ============================================================
+    # EXPIRY QUEUE & KEEPER SETTLEMENT
+    # ============================================================
+    
+    def schedule_expiry(self, prediction_id: u256, expiry_tx: u256):
+        """Push a prediction onto the expiry heap (sift up)"""
+        heap = self.expiry_heap
+        heap.append((expiry_tx << 64) | prediction_id)
+        i = len(heap) - 1
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[parent] <= heap[i]:
+                break
+            heap[parent], heap[i] = heap[i], heap[parent]
+            i = parent
+    
+    def pop_expiry(self) -> u256:
+        """Pop the entry with the earliest expiry (sift down)"""
+        heap = self.expiry_heap
+        top = heap[0]
+        last = heap.pop()
+        size = len(heap)
+        if size > 0:
+            heap[0] = last
+            i = 0
+            while True:
+                smallest = i
+                left = 2 * i + 1
+                right = left + 1
+                if left < size and heap[left] < heap[smallest]:
+                    smallest = left
+                if right < size and heap[right] < heap[smallest]:
+                    smallest = right
+                if smallest == i:
+                    break
+                heap[i], heap[smallest] = heap[smallest], heap[i]
+                i = smallest
+        return top
+    
+    @gl.public.write
+    def settle_due(self, max_count: u256 = 10) -> str:
+        """
+        Keeper entry point: settle due predictions for ALL users
+        Only pops predictions whose expiry has passed by the start of the call,
+        up to max_count heap entries (already-settled entries count too)
+        """
+        self.transaction_counter += 1
+        
+        now = self.transaction_counter  # settle_prediction advances the counter; don't chase it
+        popped = 0
+        settled_count = 0
+        results = []
+        retry = []
+        
+        while len(self.expiry_heap) > 0 and popped < max_count:
+            entry = self.expiry_heap[0]
+            if (entry >> 64) > now:
+                break
+            
+            self.pop_expiry()
+            popped += 1
+            pred_id = entry & ((1 << 64) - 1)
+            
+            # Skip predictions already settled by their owner
+            if self.prediction_statuses[pred_id] != "ACTIVE":
+                continue
+            
+            result = self.settle_prediction(self.prediction_owners[pred_id], pred_id)
+            if self.prediction_statuses[pred_id] == "ACTIVE":
+                # Settlement failed (e.g. price fetch) - keep it queued
+                retry.append(entry)
+                continue
+            
+            settled_count += 1
+            results.append(f"#{pred_id}: {result[:30]}...")
+        
+        for entry in retry:
+            self.schedule_expiry(entry & ((1 << 64) - 1), entry >> 64)
+        
+        if settled_count == 0:
+            return "No predictions due"
+        
+        return f"✅ Settled {settled_count} due predictions:\n" + "\n".join(results)
+    
+    @gl.public.view
+    def get_pending_expiries(self) -> u256:
+        """Number of queued expiry entries (may include already-settled ones)"""
+        return len(self.expiry_heap)
+    
     @gl.public.write
     def advance_time(self) -> str:
         """Advance transaction counter (simulate time passing)"""
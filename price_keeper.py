@@ -0,0 +1,118 @@
+# Price cache keeper for crypto_prediction_game_hybrid.py
+#
+# Keeps the contract's price cache warm so gameplay transactions are served
+# from cache instead of fetching live. Every --interval seconds it reads
+# get_cache_states(), skips symbols that will still be fresh at the next tick,
+# and sends one refresh_all_prices(symbols) transaction for the rest.
+#
+# Requires genlayer-py:  pip install genlayer-py
+#
+# Usage:
+#   export CONTRACT_ADDRESS=0x...
+#   export KEEPER_PRIVATE_KEY=0x...      # optional, a new account is used otherwise
+#   python price_keeper.py --interval 30 --network studionet
+
+import argparse
+import asyncio
+import os
+
+from genlayer_py import create_account, create_client
+from genlayer_py.chains import localnet, studionet, testnet_asimov
+from genlayer_py.types import TransactionStatus
+
+
+NETWORKS = {
+    "localnet": localnet,
+    "studionet": studionet,
+    "testnet": testnet_asimov,
+}
+
+DEFAULT_INTERVAL_SECONDS = 30
+
+
+def symbols_to_refresh(states: dict, lead_seconds: int) -> list:
+    """Symbols that are not FRESH, or will stop being fresh within lead_seconds"""
+    due = []
+    for symbol, info in states.items():
+        if info["state"] != "FRESH" or int(info["ttl"]) - int(info["age"]) <= lead_seconds:
+            due.append(symbol)
+    return sorted(due)
+
+
+class PriceKeeper:
+    """Polls the cache state and refreshes due symbols in one transaction"""
+
+    def __init__(self, client, contract_address: str, interval: int):
+        self.client = client
+        self.contract_address = contract_address
+        self.interval = interval
+
+    async def read_states(self) -> dict:
+        return await asyncio.to_thread(
+            self.client.read_contract,
+            address=self.contract_address,
+            function_name="get_cache_states",
+            args=[],
+        )
+
+    async def refresh(self, symbols: list):
+        tx_hash = await asyncio.to_thread(
+            self.client.write_contract,
+            address=self.contract_address,
+            function_name="refresh_all_prices",
+            args=[symbols],
+            value=0,
+        )
+        await asyncio.to_thread(
+            self.client.wait_for_transaction_receipt,
+            transaction_hash=tx_hash,
+            status=TransactionStatus.ACCEPTED,
+        )
+        return tx_hash
+
+    async def tick(self):
+        states = await self.read_states()
+        due = symbols_to_refresh(states, self.interval)
+        if len(due) == 0:
+            print(f"All {len(states)} symbols fresh, nothing to do")
+            return
+        print(f"Refreshing {', '.join(due)} ({len(states) - len(due)} still fresh)")
+        tx_hash = await self.refresh(due)
+        print(f"Refresh accepted: {tx_hash}")
+
+    async def run(self, once: bool = False):
+        while True:
+            started = asyncio.get_running_loop().time()
+            try:
+                await self.tick()
+            except Exception as e:
+                # Keep going: a failed tick is retried at the next interval
+                print(f"Keeper tick failed: {e}")
+            if once:
+                return
+            elapsed = asyncio.get_running_loop().time() - started
+            await asyncio.sleep(max(0, self.interval - elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the hybrid game's price cache warm")
+    parser.add_argument("--contract", default=os.environ.get("CONTRACT_ADDRESS"))
+    parser.add_argument("--network", choices=sorted(NETWORKS), default="studionet")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL_SECONDS,
+                        help="seconds between checks; symbols that stay fresh that long are skipped")
+    parser.add_argument("--once", action="store_true", help="run a single check and exit")
+    args = parser.parse_args()
+
+    if not args.contract:
+        parser.error("set --contract or CONTRACT_ADDRESS")
+
+    private_key = os.environ.get("KEEPER_PRIVATE_KEY")
+    account = create_account(private_key) if private_key else create_account()
+    client = create_client(chain=NETWORKS[args.network], account=account)
+
+    keeper = PriceKeeper(client, args.contract, args.interval)
+    asyncio.run(keeper.run(args.once))
+
+
+if __name__ == "__main__":
+    main()